@@ -0,0 +1,100 @@
+import threading
+from functools import partial
+from collections import deque
+from time import time
+import epics
+
+#############################################################################################
+# EPICS Channel Access backend for the ACMI charge readings.  Every PV is subscribed as a CA
+# monitor and each update is buffered with its IOC timestamp, so the averaging loop gets
+# exactly the updates the IOC posted: no polling delay, no value read twice and none skipped.
+# MonitorSampler has the same start()/next()/summary() interface as ACMIPlc.Sampler.  It can
+# be tried against the soft IOC in ACMISoftIOC.py.
+#############################################################################################
+
+class MonitorSampler:
+    """One sample per update of the PVs.  next() returns the oldest buffered update of every
+    PV that arrived after start(), so N calls take exactly N fresh updates."""
+
+    def __init__(self, pvnames, timeout=10.0, depth=64):
+        self.names = list(pvnames)
+        self.timeout = timeout      # Longest Sec to wait for an update before sampling anyway
+        self.cond = threading.Condition()
+        self.updates = [deque(maxlen=depth) for name in self.names]     # (timestamp, value) per PV
+        self.last = [None]*len(self.names)      # Latest (timestamp, value) per PV
+        self.received = [0]*len(self.names)
+        self.periods = []           # Sec between the timestamps of consecutive samples
+        self.skew = 0.0             # Largest timestamp spread between the PVs of one sample
+        self.dropped = 0            # Updates that overflowed the buffer before they were used
+        self.timeouts = 0
+        self.tlast = None
+        self.pvs = []
+        for i in range(0,len(self.names)):
+            # The callback is given to the PV itself, so it cannot miss the first monitor event
+            pv = epics.PV(self.names[i], auto_monitor=True, callback=partial(self.update, slot=i))
+            self.pvs.append(pv)
+        for pv in self.pvs:
+            if(not pv.wait_for_connection(timeout)):
+                raise TimeoutError('PV '+pv.pvname+' did not connect')
+        # The first monitor event of a PV carries the value it had when it connected, which
+        # may be an update from long before.  Wait for it on every PV and drop it, so that it
+        # is not taken for a fresh update by the first next().
+        with self.cond:
+            if(not self.cond.wait_for(lambda: all(n > 0 for n in self.received), timeout)):
+                raise TimeoutError('No initial monitor update from '+', '.join([self.names[i] for i in range(0,len(self.names)) if self.received[i] == 0]))
+            for q in self.updates:
+                q.clear()
+
+    def update(self, pvname=None, value=None, timestamp=None, slot=None, **kw):
+        """CA monitor callback (runs on the CA thread)."""
+        i = slot
+        if(timestamp is None):
+            timestamp = time()
+        with self.cond:
+            if(len(self.updates[i]) == self.updates[i].maxlen):
+                self.dropped += 1
+            self.updates[i].append((timestamp, value))
+            self.last[i] = (timestamp, value)
+            self.received[i] += 1
+            self.cond.notify_all()
+
+    def start(self):
+        """Forget the buffered updates, so the next sample is the first update from now on.
+        The connect-time values were dropped in __init__, so they never count as new."""
+        with self.cond:
+            for q in self.updates:
+                q.clear()
+        self.tlast = None
+
+    def latest(self):
+        """Most recent value of every PV."""
+        with self.cond:
+            return [u[1] if u is not None else None for u in self.last]
+
+    def next(self):
+        """Wait for the next update of every PV and return its time and the values."""
+        with self.cond:
+            ready = self.cond.wait_for(lambda: all(len(q) > 0 for q in self.updates), self.timeout)
+            if(ready):
+                S = [q.popleft() for q in self.updates]
+            else:
+                self.timeouts += 1
+                S = [u if u is not None else (time(), None) for u in self.last]
+        T = [s[0] for s in S]
+        t = max(T)
+        self.skew = max(self.skew, t-min(T))
+        if(self.tlast is not None):
+            self.periods.append(t-self.tlast)
+        self.tlast = t
+        return t, [s[1] for s in S]
+
+    def summary(self):
+        mess = 'ACMI monitors: '+', '.join([self.names[i]+' '+str(self.received[i]) for i in range(0,len(self.names))])+' updates'
+        if(len(self.periods) > 0):
+            mess += ', '+str(round(sum(self.periods)/len(self.periods),3))+' Sec avg period, '+str(round(min(self.periods),3))+' to '+str(round(max(self.periods),3))+' Sec'
+        return mess+', '+str(round(self.skew,3))+' Sec max skew, '+str(self.dropped)+' dropped, '+str(self.timeouts)+' timed out'
+
+    def close(self):
+        for pv in self.pvs:
+            pv.clear_callbacks()
+            pv.disconnect()
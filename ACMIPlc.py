@@ -0,0 +1,223 @@
+from time import time, sleep, perf_counter
+from pylogix import PLC
+from Retry import RetryPolicy
+
+#############################################################################################
+# PLC access for the ACMI calibration scripts.  The ACMI tags of one sample are read with a
+# single pylogix list Read, which goes out as one multi-service CIP request, so the A and B
+# ADC values of a sample come from the same ACMI update and a sample costs one round trip
+# instead of one per tag.  Sampler takes the samples when a new ACMI measurement has landed,
+# as seen on an update counter tag, rather than after a fixed sleep.  Without a counter tag it
+# is seen as a change of the values, which misses an update that repeats them (a saturated
+# ADC at 2047 with a steady baseline), so those updates are timed from the update period
+# instead of waiting for the timeout.  PLCSession keeps one pylogix connection open for the
+# whole sweep and reconnects it with bounded backoff.
+#############################################################################################
+
+class PLCError(Exception):
+    """A tag read that did not succeed."""
+    pass
+
+class PLCConnectionError(PLCError):
+    """The connection to the PLC failed or was lost."""
+    pass
+
+# Read status strings from pylogix that mean the connection itself is gone
+LOST = ('Connection failure','Connection lost','Register session failed','Forward open failed')
+
+def lost(status):
+    status = str(status)
+    return status in LOST or 'Errno' in status or 'timed out' in status
+
+def classify(e):
+    """Retry class of an exception raised by a PLC read (None: do not retry)."""
+    if(isinstance(e, (PLCConnectionError, OSError))):
+        return 'io'
+    return None
+
+def read_tags(comm, tags):
+    """Read all tags in one request.  Returns the time of the request (Sec since the epoch,
+    taken halfway through the round trip) and the list of values in tag order."""
+    t0 = time()
+    ret = comm.Read(tags)
+    t1 = time()
+    if(not isinstance(ret, list)):
+        ret = [ret]
+    values = []
+    for r in ret:
+        if(r.Status != 'Success'):
+            raise PLCError(str(r.TagName)+': '+str(r.Status))
+        values.append(r.Value)
+    return (t0+t1)/2.0, values
+
+class Sampler:
+    """Take one sample of tags per ACMI update instead of sleeping a guessed update period.
+    A new update is seen as a step of the counter tag, which is read in the same request as
+    the sample.  Without a counter tag it is seen as a change of any of the sample values,
+    and the update period is needed: when half a period has passed after an update was due
+    without a change, that update repeated the values and is taken as they are.  Counter
+    steps larger than one are counted as missed updates, and the time between the updates
+    is kept in periods."""
+
+    def __init__(self, comm, tags, counter=None, poll=0.05, timeout=10.0, period=None):
+        if(counter is None and period is None):
+            raise ValueError('Sampler needs an update counter tag or the update period')
+        self.comm = comm
+        self.tags = list(tags)
+        self.counter = counter
+        self.poll = poll            # Sec between polls
+        self.timeout = timeout      # Longest Sec to wait for an update before sampling anyway
+        self.period = period        # ACMI update period in Sec, which times the updates without a counter
+        self.periods = []           # Sec between consecutive updates
+        self.missed = 0
+        self.repeats = 0            # Updates taken from the period because they repeated the values
+        self.timeouts = 0
+        self.values = [None]*len(self.tags)     # Values of the last update taken
+        self.tupdate = None         # Time of the last update, kept by start() for the update phase
+        self.start()
+
+    def start(self):
+        """Forget the last update, so the next sample is the first update from now on."""
+        self.last = None
+        self.tlast = None
+
+    def next(self):
+        """Wait for the next ACMI update and return its time and the values of tags."""
+        read = self.tags
+        if(self.counter is not None):
+            read = self.tags + [self.counter]
+        t0 = time()
+        due = None
+        if(self.counter is None):
+            # The next update is one period after the last one, or within a period from now
+            # when the last one is older than that
+            due = t0 + self.period
+            if(self.tupdate is not None and t0-self.tupdate < self.period):
+                due = self.tupdate + self.period
+        while(True):
+            t, V = read_tags(self.comm, read)
+            key = V[len(self.tags):] if self.counter is not None else V
+            if(self.last is None):
+                self.last = key
+            elif(key != self.last):
+                if(self.counter is not None):
+                    step = int(key[0]) - int(self.last[0])
+                    if(step > 1):
+                        self.missed += step-1
+                break
+            if(due is not None and t-due > self.period/2.0):
+                t = due             # The update at due repeated the values
+                self.repeats += 1
+                break
+            if(t-t0 > self.timeout):
+                self.timeouts += 1
+                break
+            sleep(self.poll)
+        if(self.tlast is not None):
+            self.periods.append(t-self.tlast)
+        self.last = key
+        self.tlast = t
+        self.tupdate = t
+        self.values = V[0:len(self.tags)]
+        return t, self.values
+
+    def latest(self):
+        """Values of the last update taken by next(), without another read of the PLC."""
+        return list(self.values)
+
+    def summary(self):
+        mess = 'ACMI updates: '+str(len(self.periods))+' periods'
+        if(len(self.periods) > 0):
+            mess += ', '+str(round(sum(self.periods)/len(self.periods),3))+' Sec avg, '+str(round(min(self.periods),3))+' to '+str(round(max(self.periods),3))+' Sec'
+        if(self.counter is None):
+            mess += ', '+str(self.repeats)+' repeated'
+        return mess+', '+str(self.missed)+' missed, '+str(self.timeouts)+' timed out'
+
+class PLCSession:
+    """Long-lived connection to the PLC.  Read() takes the same arguments and returns the same
+    responses as pylogix PLC.Read(), so it can be used in place of comm.  The connection is
+    opened once and checked with GetPLCTime() when it has been idle for keepalive Sec.  A lost
+    connection is closed and reopened with bounded backoff by a RetryPolicy.  driver makes the
+    PLC objects (pylogix PLC, or Simulator.FakeACMI(lab).PLC offline)."""
+
+    def __init__(self, ip, slot=0, keepalive=10.0, timeout=5.0, driver=PLC):
+        self.ip = ip
+        self.slot = slot
+        self.keepalive = keepalive  # Idle Sec before the connection is checked
+        self.timeout = timeout      # Socket timeout in Sec
+        self.driver = driver
+        self.comm = None
+        self.device = None
+        self.tlast = 0.0
+        self.connects = 0           # Connections opened
+        self.reads = 0              # Reads on the connections
+        self.checks = 0             # Keepalive checks
+        self.latency = []           # Sec per read
+        self.retry = RetryPolicy(classify, self.recover, attempts=6, base=0.2, cap=5.0, name='PLC')
+
+    def connect(self):
+        """Open the connection and return the properties of the module in slot."""
+        self.comm = self.driver()
+        self.comm.IPAddress = self.ip
+        self.comm.ProcessorSlot = self.slot
+        self.comm.SocketTimeout = self.timeout
+        ret = self.comm.GetModuleProperties(self.slot)
+        if(ret.Status != 'Success'):
+            self.close()
+            raise PLCConnectionError(self.ip+': '+str(ret.Status))
+        self.device = ret.Value
+        self.connects += 1
+        self.tlast = time()
+        return self.device
+
+    def check(self):
+        """Make sure an idle connection is still alive."""
+        self.checks += 1
+        ret = self.comm.GetPLCTime()
+        if(lost(ret.Status)):
+            raise PLCConnectionError(self.ip+' keepalive: '+str(ret.Status))
+        self.tlast = time()
+
+    def recover(self, kind, attempt):
+        self.close()
+        self.retry.write('reconnecting to '+self.ip)
+
+    def Read(self, tag, count=None, datatype=None):
+        def read():
+            if(self.comm is None):
+                self.connect()
+            elif(time()-self.tlast > self.keepalive):
+                self.check()
+            t0 = perf_counter()
+            if(count is None and datatype is None):
+                ret = self.comm.Read(tag)
+            else:
+                ret = self.comm.Read(tag, count, datatype)
+            R = ret if isinstance(ret, list) else [ret]
+            for r in R:
+                if(lost(r.Status)):
+                    raise PLCConnectionError(self.ip+': '+str(r.Status))
+            self.latency.append(perf_counter()-t0)
+            self.reads += 1
+            self.tlast = time()
+            return ret
+        return self.retry.run(read)
+
+    def close(self):
+        if(self.comm is not None):
+            try:
+                self.comm.Close()
+            except Exception:
+                pass
+        self.comm = None
+
+    def summary(self):
+        mess = 'PLC '+self.ip+': '+str(self.reads)+' reads on '+str(self.connects)+' connection(s), '+str(self.checks)+' keepalive checks'
+        n = len(self.latency)
+        if(n > 0):
+            k = max(1, n//10)
+            first = sum(self.latency[0:k])/k
+            last = sum(self.latency[n-k:n])/k
+            mess += ', read '+str(round(1000*sum(self.latency)/n,2))+' mSec avg, '+str(round(1000*max(self.latency),2))+' mSec max'
+            mess += ' (first 10% '+str(round(1000*first,2))+', last 10% '+str(round(1000*last,2))+' mSec)'
+        return mess
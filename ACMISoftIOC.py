@@ -0,0 +1,35 @@
+import numpy as np
+from caproto.server import PVGroup, pvproperty, ioc_arg_parser, run
+
+#############################################################################################
+# caproto soft IOC that stands in for the ACMI charge PVs, to try the CA monitor backend
+# (ACMIEpics.py) without the PLC.  ACMI_BEAM_Q, ACMI_ST1_QAB and ACMI_ST1_QBA are posted
+# together every ACMI_SIM_PERIOD Sec, around the test charge in ACMI_SIM_Q (nC) with a little
+# noise.
+#
+#   python ACMISoftIOC.py --list-pvs
+#   caput ACMI_SIM_Q 2.5
+#############################################################################################
+
+class ACMIIOC(PVGroup):
+    beam = pvproperty(name='ACMI_BEAM_Q', value=0.0, read_only=True, precision=4)
+    qab = pvproperty(name='ACMI_ST1_QAB', value=0.0, read_only=True, precision=4)
+    qba = pvproperty(name='ACMI_ST1_QBA', value=0.0, read_only=True, precision=4)
+    period = pvproperty(name='ACMI_SIM_PERIOD', value=2.2, precision=3)
+    charge = pvproperty(name='ACMI_SIM_Q', value=1.0, precision=4)
+    noise = pvproperty(name='ACMI_SIM_NOISE', value=0.002, precision=4)
+
+    @beam.startup
+    async def beam(self, instance, async_lib):
+        while(True):
+            await async_lib.library.sleep(self.period.value)
+            q = self.charge.value
+            sd = self.noise.value
+            await self.beam.write(q + np.random.normal(0,sd))
+            await self.qab.write(1.0 + np.random.normal(0,sd))
+            await self.qba.write(1.0 + np.random.normal(0,sd))
+
+if __name__ == '__main__':
+    ioc_options, run_options = ioc_arg_parser(default_prefix='', desc='ACMI charge soft IOC')
+    ioc = ACMIIOC(**ioc_options)
+    run(ioc.pvdb, **run_options)
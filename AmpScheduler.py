@@ -0,0 +1,206 @@
+import numpy as np
+from math import inf, sqrt
+
+#############################################################################################
+# Adaptive choice of the pulser amplitudes of an ACMI calibration sweep.  Instead of stepping
+# through every amplitude of the list, AmpScheduler picks them one at a time: a few seed
+# amplitudes spread over the range, then the amplitude where the quadratic fit of the charge
+# against the ADC counts is least certain (large residuals nearby, large prediction error, far
+# from the measured points), and last the saturation checks at the largest amplitudes.  The
+# counts measured so far against the pulser volts predict where the ADC saturates, so no
+# points are spent between that and the checks, and the saturating points are kept out of
+# the fit.  The sweep ends once the charge uncertainty that the covariance of the fit
+# coefficients leaves is below tol or no longer improves, and the checks are done.
+#
+#     SCHED = AmpScheduler(Vp)
+#     for j in SCHED:
+#         ...measure amplitude j...
+#         SCHED.add(j, charge, counts, saturated)
+#
+# Run this file to replay the scheduler on the ACMI data of a PosACMI/NegACMI raw file
+# (python AmpScheduler.py ACMI2026_Mar/Results/posacmi.raw).
+#############################################################################################
+
+FULLSCALE = 2047    # ACMI ADC full scale in counts
+
+class AmpScheduler:
+    """Choose the amplitudes (indices into volts, in increasing order) of a sweep.  add() the
+    measured charge (pC), ADC counts and saturation of an amplitude before asking for the next
+    one.  tol is the uncertainty of the fitted charge (pC) that is good enough."""
+
+    def __init__(self, volts, seeds=4, checks=3, minimum=8, tol=15.0, stall=0.05, patience=3, margin=0.9, degree=2, full=FULLSCALE):
+        self.volts = [float(v) for v in volts]
+        n = len(self.volts)
+        self.checks = list(range(max(0,n-checks),n))       # The largest amplitudes, which must saturate the ADC
+        top = max(0, n-len(self.checks)-1)
+        self.seeds = sorted(set([int(round(x)) for x in np.linspace(0,top,seeds)]))
+        self.minimum = max(minimum, degree+2)   # Fewest fit points before the fit can have converged
+        self.tol = tol
+        self.stall = stall      # Smallest improvement (fraction) of the uncertainty over
+        self.patience = patience    # patience fit points that is worth more points
+        self.margin = margin    # Fraction of full scale from which on an amplitude counts as saturating
+        self.degree = degree
+        self.full = full
+        self.points = {}        # j: (charge, counts, saturated)
+        self.order = []         # Amplitudes in the order they were measured
+        self.history = []       # Fit uncertainty after every fit point from the minimum on
+        self.pfit = None        # Fit of charge against counts, highest power first (None: too few points)
+        self.cov = None
+        self.residuals = []
+        self.asked = None
+
+    def saturates(self, j):
+        charge,counts,saturated = self.points[j]
+        return saturated or abs(counts) >= self.margin*self.full
+
+    def limit(self):
+        """Pulser volts from which on the ADC is predicted to saturate (inf when out of reach)."""
+        J = sorted(self.points)
+        vsat = min([self.volts[j] for j in J if self.saturates(j)]+[inf])
+        V = [self.volts[j] for j in J if not self.saturates(j)]
+        C = [abs(self.points[j][1]) for j in J if not self.saturates(j)]
+        if(len(V) >= 2):
+            pc = np.polyfit(V, C, 1 if len(V) < 4 else 2)
+            for v in self.volts:
+                if(v < vsat and np.polyval(pc,v) >= self.margin*self.full):
+                    vsat = v
+                    break
+        return vsat
+
+    def region(self):
+        """Amplitudes below the predicted saturation point, which the fit is made on."""
+        vsat = self.limit()
+        return [j for j in range(0,len(self.volts)) if self.volts[j] < vsat and j not in self.checks]
+
+    def fitted(self):
+        """The measured amplitudes in the fit, in increasing order.  They are the first ones of
+        all the measured amplitudes in increasing order."""
+        return [j for j in self.region() if j in self.points]
+
+    def fitcount(self, V):
+        """How many of the pulser volts V (in increasing order) are in the fit range, which is
+        how many of them come first in a fit."""
+        fit = [self.volts[j] for j in self.region()]
+        return len([v for v in V if float(v) in fit])
+
+    def fit(self):
+        J = self.fitted()
+        if(len(J) < self.degree+2):
+            self.pfit = None
+            return
+        x = np.array([self.points[j][1] for j in J], dtype=float)/self.full
+        y = np.array([self.points[j][0] for j in J], dtype=float)
+        X = np.vander(x, self.degree+1)
+        p = np.linalg.lstsq(X, y, rcond=None)[0]
+        r = y - X.dot(p)
+        s2 = r.dot(r)/(len(J)-self.degree-1)
+        self.cov = s2*np.linalg.pinv(X.T.dot(X))
+        self.pfit = p/self.full**np.arange(self.degree,-1,-1)      # Back to charge per count
+        self.residuals = list(r)
+
+    def uncertainty(self):
+        """Standard error (pC) of the fitted charge that follows from the uncertainty of the
+        coefficients, at the worst point of the measured counts range (inf without a fit)."""
+        if(self.pfit is None):
+            return inf
+        C = [self.points[j][1] for j in self.fitted()]
+        X = np.vander(np.linspace(min(C),max(C),50)/self.full, self.degree+1)
+        return sqrt(max(0.0, np.max(np.einsum('ij,jk,ik->i',X,self.cov,X))))
+
+    def converged(self):
+        J = self.fitted()
+        region = self.region()
+        if(len(J) < self.minimum or len(region) == 0 or region[-1] not in self.points):
+            return False
+        h = self.history
+        if(len(h) == 0):
+            return False
+        if(h[-1] <= self.tol):
+            return True
+        n = self.patience
+        return len(h) > n and min(h[-n:]) > min(h[:-n])*(1.0-self.stall)     # No longer improving
+
+    def add(self, j, charge, counts, saturated=False):
+        """Result of amplitude j: its charge in pC, mean ADC counts and whether the ADC saturated."""
+        self.points[j] = (float(charge), float(counts), bool(saturated))
+        self.order.append(j)
+        self.fit()
+        if(j in self.fitted() and len(self.fitted()) >= self.minimum):
+            self.history.append(self.uncertainty())
+
+    def score(self, j):
+        """How much the fit would gain from amplitude j."""
+        J = self.fitted()
+        V = [self.volts[k] for k in J]
+        v = self.volts[j]
+        gap = min([abs(v-u) for u in V])
+        if(self.pfit is None):
+            return gap
+        res = np.interp(v, V, np.abs(self.residuals))
+        x = np.interp(v, V, [self.points[k][1] for k in J])/self.full
+        X = x**np.arange(self.degree,-1,-1)
+        return gap*(res + sqrt(max(0.0, X.dot(self.cov).dot(X))))
+
+    def next(self):
+        """Index of the next amplitude to measure, None when the sweep is done."""
+        for j in self.seeds:
+            if(j not in self.points):
+                return j
+        region = self.region()
+        todo = [j for j in region if j not in self.points]
+        if(len(todo) > 0 and not self.converged()):
+            if(region[-1] not in self.points):
+                return region[-1]       # Span the whole range up to saturation first
+            return max(todo, key=self.score)
+        for j in self.checks:
+            if(j not in self.points):
+                return j
+        return None
+
+    def __iter__(self):
+        j = self.next()
+        while(j is not None):
+            if(j == self.asked):
+                raise RuntimeError('Amplitude '+str(j)+' was not add()ed before the next one was asked for')
+            self.asked = j
+            yield j
+            j = self.next()
+
+    def summary(self):
+        J = self.fitted()
+        mess = 'Amplitudes: '+str(len(self.points))+' of '+str(len(self.volts))+' measured ('+str(len(J))+' in the fit, '
+        mess += str(len([j for j in self.checks if j in self.points]))+' saturation checks)'
+        vsat = self.limit()
+        if(vsat < inf):
+            mess += ', saturation predicted from '+str(vsat)+' V'
+        if(self.pfit is not None):
+            mess += ', fit uncertainty '+str(round(self.uncertainty(),2))+' pC'
+        return mess
+
+if __name__ == '__main__':
+    # Replay the scheduler on measured data:  python AmpScheduler.py file.raw
+    import sys
+    from Stats import RunningStats
+    B = {}
+    for line in open(sys.argv[1]):
+        Z = line.strip().split(',')
+        if(len(Z) == 9 and not Z[0][0].isalpha()):
+            j = int(Z[0])
+            if(j not in B):
+                B[j] = (1000.0*float(Z[2]), RunningStats(), [])
+            A = int(Z[3])
+            B[j][1].add(A if abs(A) >= FULLSCALE else A-int(Z[4]))
+            B[j][2].append(abs(A) >= FULLSCALE)
+    J = sorted(B)
+    sched = AmpScheduler([j+1 for j in J])     # The 1 V steps of the scripts
+    for k in sched:
+        q,st,sat = B[J[k]]
+        sched.add(k, q, st.mean, any(sat))
+    print('Measured in the order', sched.order)
+    print(sched.summary())
+    K = list(range(0,min(len(J),19)))
+    pall = np.polyfit([B[J[k]][1].mean for k in K], [B[J[k]][0] for k in K], 2)
+    print('Fit of the 19 lowest amplitudes:    ', pall)
+    print('Fit of the scheduled amplitudes:     ', sched.pfit)
+    x = np.linspace(0, max([abs(B[J[k]][1].mean) for k in K]), 50)*np.sign(B[J[0]][1].mean)
+    print('Largest difference of the fits over the range: '+str(round(np.max(np.abs(np.polyval(pall,x)-np.polyval(sched.pfit,x))),2))+' pC')
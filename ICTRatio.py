@@ -1,14 +1,26 @@
-import pyvisa as visa
+from ScopeDriver import MSO64B, locate
+from Pipeline import Pipeline
+from Integrate import integrate, charge, save
+from Stats import RunningStats, Sequential, report
+from Settling import Settler
 import numpy as np
 from struct import unpack
 import matplotlib.pyplot as plt
 from matplotlib.widgets import TextBox
-from time import sleep
 import epics
 from matplotlib.widgets import Button
-import telnetlib3 as tn
+from Prologix import Prologix
 
 props = dict(boxstyle='round', facecolor='wheat', alpha=0.5)
+FASTFRAME = True   # Capture the 25 shots of each amplitude in one FastFrame acquisition
+WINDOW = False     # Transfer only the pulse window located in the first shot (leaves the rest of the record out of the charge)
+GUIPERIOD = 0.2    # Sec between plot updates while the acquisition runs in the background
+KERNEL = 'rect'     # Integration kernel of the shots: 'rect', 'trapz', 'simpson' or 'gated' (see Integrate.py)
+SAVEWAVES = False  # Also save the shots (Volts) to <fname>.wav for comparing the kernels offline
+SEQUENTIAL = False # Average every amplitude only until its mean charge is known to QTARGET (see Stats.Sequential)
+QTARGET = [0.5,0.1] # Target standard error of the mean charge: pC, or % of the charge when that is larger
+SHOTS = [8,100]    # Fewest and most scope shots per amplitude with SEQUENTIAL (25 without)
+SCOPESETTLE = Settler(tol=0.005,count=3,dwell=0.1,timeout=1.0,name='Scope')   # Wait for stable scope integrals after an amplitude step
 
 # # Setup for Prologix USB-Ethernet converter for the HP8114A
 # PORT = "COM4"      # Windows example (e.g., COM3)
@@ -20,21 +32,15 @@ props = dict(boxstyle='round', facecolor='wheat', alpha=0.5)
 # )
 # sleep(0.5)  # Give the port time to settle
 
-tnet = tn.Telnet('10.0.142.150','1234')
+pulser = Prologix('10.0.142.150',14)   # HP8114A at GPIB address 14, controller mode with *OPC? handshakes
 
 def HPwrite(cmd):
-    tnet.write((cmd + "\n").encode("ascii"))
-    sleep(0.1)
+    pulser.write(cmd)
 
 def HPread():
-    return tnet.read_until(b'\n',7)
+    return pulser.read()
 
-# Put Prologix in controller mode and set GPIB address
-HPwrite("++mode 1")      # Controller mode
-HPwrite("++addr 14")      # Change to HP8114A's GPIB address
-HPwrite("++auto 1")      # Automatically read response after write
-HPwrite("*IDN?")
-response = HPread()
+response = pulser.query("*IDN?")
 print(response)
 model = int(response[18:22])
 if(model != 8114):
@@ -42,19 +48,9 @@ if(model != 8114):
     exit()
 else:
     print('HP8114A Pusle Generator FOUND.')   
-    HPwrite(':SOUR:VOLT 0.0')
-    sleep(0.5)
-    HPwrite(':OUTP:POL NEG')
-    sleep(0.5)
-    HPwrite(':SOUR:PULS:DEL 5US')
-    sleep(0.5)
-    HPwrite(':SOUR:PULS:WIDT 50.0NS')
-    sleep(0.5)
-    HPwrite(':SOUR:VOLT 1.0')
-    sleep(0.5)
+    pulser.batch([':SOUR:VOLT 0.0',':OUTP:POL NEG',':SOUR:PULS:DEL 5US',':SOUR:PULS:WIDT 50.0NS',':SOUR:VOLT 1.0'])
     
-rm = visa.ResourceManager()
-scope = rm.open_resource('TCPIP0::10.0.142.110::inst0::INSTR')
+scope = MSO64B('TCPIP0::10.0.142.110::inst0::INSTR')   # or 'TCPIP0::10.0.142.110::4000::SOCKET' (raw socket server)
 scoperesponse = scope.query('*IDN?')
 print(scoperesponse)
 serial_number = int(scoperesponse[18:24])
@@ -65,19 +61,20 @@ else:
     print('Tektronix MSO64B Scope FOUND.')
     
 #Set up the scope:
-scope.write('HOR:RECO 2000')
-scope.write('TRIGGER:A:MODE NORM')
-scope.write('TRIGGER:A:TYPE EDGE')
-scope.write('TRIGGER:A:EDGE:SOURCE CH1')
-scope.write('TRIGGER:A:EDGE:SLOPE FALL')
-scope.write('TRIGGER:A:EDGE:COUPLING DC')
-scope.write('HORIZONTAL:MODE MANUAL')
-scope.write('HORIZONTAL:MODE:SAMPLERATE 3.125E9')
-scope.write('HORIZONTAL:SCALE 3.2e-8')
-scope.write('HORIZONTAL:POS 10')
+scope.set('HOR:RECO','2000')
+scope.set('TRIGGER:A:MODE','NORM')
+scope.set('TRIGGER:A:TYPE','EDGE')
+scope.set('TRIGGER:A:EDGE:SOURCE','CH1')
+scope.set('TRIGGER:A:EDGE:SLOPE','FALL')
+scope.set('TRIGGER:A:EDGE:COUPLING','DC')
+scope.set('HORIZONTAL:MODE','MANUAL')
+scope.set('HORIZONTAL:MODE:SAMPLERATE','3.125E9')
+scope.set('HORIZONTAL:SCALE','3.2e-8')
+scope.set('HORIZONTAL:POS','10')
 scope.write('*WAI')
-scope.write('CH1:SCALE 0.2')
-scope.write('CH1:POS 4.5')
+scope.set('CH1:SCALE','0.2')
+scope.set('CH1:POS','4.5')
+scope.transfer('CH1',0,5000)
 
 plt.ion()
 fq,axq = plt.subplots(2,2,figsize=(12,10))
@@ -94,6 +91,8 @@ if(int(year)<2024 or int(year)>2064):
     exit()
 
 fname = input("Enter file name for data (No Extension): ")
+runlog = open("/ACMICal" + year + "/"+fname+".log","w")
+scope.retry.log = runlog
 
 CH1scale=[0.2,0.5,0.5,0.5,1,1,1,1,1,2,2,2,2,2,2,2,2,2,5] #in Volts/Division on Scope
 Vp = [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19] #in Volts for Pulse Amplitude
@@ -102,80 +101,118 @@ Qtest = []
 Itest = []
 Vtest= []
 f = open("/ACMICal" + year + "/"+fname+".raw","w")
+if(SAVEWAVES):
+    waves = open("/ACMICal" + year + "/"+fname+".wav","wb")
 f.write("Raw Data for Test Pulse Charge Measurement:\n")
 
-for j in range(0,19):
-    HPwrite(':SOUR:VOLT '+str(Vp[j]))
-    sleep(1)
-    Vtest.append(Vp[j])
-    Qhist=[]
-    Ihist=[]
-    scope.write('CH1:SCALE '+str(CH1scale[j]))
-    scope.write('TRIGGER:A:LEVEL:CH1 '+str(-CH1scale[j]))
-    for N in range(0,25):
-        print("N = ",N,"\n")
-        # scope.write('ACQUIRE:STOPAFTER SEQUENCE')
-        # scope.write('ACQUIRE:STATE 1')
-        # scope.write('*WAI')
+SHOTRULE = Sequential(25,25)    #Scope shots per amplitude
+if(SEQUENTIAL):
+    SHOTRULE = Sequential(SHOTS[0],SHOTS[1],QTARGET[0]/1000.0,QTARGET[1]/100.0,batch=scope.buf.shots)
 
-        axq[0][0].clear()
-    
-        good=0
-        while(good==0):
-            try:
-                scope.write('ACQUIRE:STOPAFTER SEQUENCE')
-                scope.write('ACQUIRE:STATE 1')
-                scope.write('*WAI')
-                scope.write('DATA:SOU CH1')
-                scope.write('DATA:START 0')
-                scope.write('DATA:STOP 5000')
-                scope.write('DATA:WIDTH 2')
-                scope.write('DATA:ENC RIB')
-                scope.write('WFMOUTPRE:BYT_NR 2')
-
-                scope.query('*OPC?')
-    
-                ymult1 = float(scope.query('WFMPRE:YMULT?'))
-                yzero1 = float(scope.query('WFMPRE:YZERO?'))
-                yoff1 = float(scope.query('WFMPRE:YOFF?'))
-                xincr1 = float(scope.query('WFMPRE:XINCR?'))
-
-                scope.write('CURVE?')
-
-                data1 = scope.read_raw()
-                sleep(0.1)
-                good = 1
-            except:
-                good = 0
-        header_len_digits = int(data1[1:2])
-        num_bytes = int(data1[2:2+ header_len_digits])
-        bin_start = 2 + header_len_digits
-        bin_end = bin_start + num_bytes
-        ADC_wave1 = data1[bin_start:bin_end]
-        print(len(ADC_wave1))
-        CH1 = []
+def pulse_area():
+    #Integral of one single shot, to see when the pulser output has settled
+    Vq,xincr1 = scope.waveform()
+    return integrate(Vq,xincr1,0)[0]
 
-        waveform = np.frombuffer(ADC_wave1, dtype='>i2')   
-        Vq = (waveform - yoff1) * ymult1 + yzero1
-        Tq = np.arange(len(Vq)) * xincr1
+def acquire_pulses(pipe):
+    #Instrument thread: step the pulser and queue the raw scope blocks of every amplitude
+    for j in range(0,19):
+        HPwrite(':SOUR:VOLT '+str(Vp[j]))
+        scope.set('CH1:SCALE',CH1scale[j])
+        scope.set('TRIGGER:A:LEVEL:CH1',-CH1scale[j])
+        pipe.wait()     # The settling shots and the next blocks reuse the scope buffer
+        SCOPESETTLE.wait(pulse_area)
+        count = SHOTRULE.more()
+        N0 = 0
+        while(count > 0):
+            if(FASTFRAME):
+                #All shots of the batch in one FastFrame acquisition (the stack reuses the same buffer)
+                if(WINDOW):
+                    Vstack,xincr1 = scope.frames(count,5000)
+                else:
+                    Vstack,xincr1 = scope.frames(count)
+                pipe.put((j,Vstack,xincr1,None))
+            else:
+                for N in range(N0,N0+count):
+                    if(WINDOW and N==0):
+                        scope.transfer('CH1',0,5000)
+                    Vq,xincr1 = scope.waveform()
+                    if(WINDOW and N==0):
+                        lo,hi = locate(Vq)
+                        scope.window(lo,hi)
+                        Vq = Vq[lo:hi]
+                    pipe.put((j,Vq[np.newaxis],xincr1,None))
+            N0 += count
+            pipe.wait()     # The worker has the statistics of every shot so far
+            count = SHOTRULE.more(Qstats[j])
+        pipe.put((j,None,xincr1,None))     # End of amplitude j
 
+Nshot = {}
+Istats = {}     #Running integral and charge statistics of every amplitude
+Qstats = {}
+Last = {}       #Last shot result of every amplitude
+def integrate_pulses(block):
+    #Worker thread: baseline, clip and integrate the shots of one block and log them
+    j,Vstack,xincr1,Astack = block
+    if(Vstack is None and Astack is None):
+        #End of amplitude j: log its statistics and hand its averages to the GUI
+        SHOTRULE.done(Qstats[j])
+        f.write(Istats[j].record('I',j,Vp[j])+"\n")
+        f.write(Qstats[j].record('Q',j,Vp[j])+"\n")
+        return [Last[j][0:6]+(None,xincr1,True)]
+    if(Vstack is not None):
+        if(SAVEWAVES):
+            save(waves,j,Vstack,xincr1)
+        A = integrate(Vstack,xincr1,-1,kernel=KERNEL)     #All shots of the block in one pass
+        if(Astack is None):
+            Astack = A
+    Integrals = np.abs(Astack)*1000000000
+    Qs = np.abs(charge(Astack))
+    R = []
+    for k in range(0,len(Astack)):
+        N = Nshot.get(j,0)
+        Nshot[j] = N+1
+        if(N==0):
+            Istats[j] = RunningStats()
+            Qstats[j] = RunningStats()
+        Integral = Integrals[k]
+        Q = Qs[k]
+        Istats[j].add(Integral)
+        Qstats[j].add(Q)
+        line = str(j)+","+str(N)+","+str(Vp[j])+","+str(round(Integral,3))+","+str(round(Q,4))+"\n"
+        f.write(line)
+        Vq = None
+        if(Vstack is not None and k==len(Astack)-1):
+            Vq = Vstack[k].copy()   #Only the last shot of a block is plotted
+        R.append((j,N,Integral,Q,Istats[j].mean,Qstats[j].mean,Vq,xincr1,False))
+    Last[j] = R[-1]
+    return R
 
-        BL = sum(Vq[0:50])/50.0
-        Vq = np.subtract(Vq,BL)
-        for i in range(0,len(Vq)):
-            if(Vq[i]>0): Vq[i] = 0
-        axq[0][0].plot(Tq,Vq)
+pipe = Pipeline(acquire_pulses,integrate_pulses).start()
+Vlast = np.zeros(0)
+Tlast = np.zeros(0)
+while(True):
+    running = pipe.alive()
+    R = pipe.results()
+    for (j,N,Integral,Q,Iavg,Qavg,Vq,xincr1,done) in R:
+        if(Vq is not None):
+            Vlast = Vq
+            Tlast = np.arange(len(Vq)) * xincr1
+        if(done):
+            Vtest.append(Vp[j])
+            Qtest.append(Qavg)
+            Itest.append(Iavg)
+            axq[0][1].clear()
+            axq[0][1].plot(Vtest,Qtest,'-o',markersize=4)
+            axq[0][1].grid(color='lightgray',linestyle='-',linewidth=1)
+            axq[0][1].set_xlabel("Pulser Amplitude (Volts)")
+            axq[0][1].set_ylabel("Measured Test Charge (nC)") 
+    if(len(R)>0):
+        axq[0][0].clear()
+        axq[0][0].plot(Tlast,Vlast,label='Scope Data')
         axq[0][0].grid(color='lightgray',linestyle='-',linewidth=1)
         axq[0][0].set_xlabel("Time (nSec)")
-        axq[0][0].set_ylabel("Voltage") 
-        Integral = abs(sum(Vq)*xincr1*1000000000)
-        Ihist.append(Integral)
-        Q = abs(sum(Vq)*xincr1*2e7)
-        Qhist.append(Q)
-        Qavg = sum(Qhist)/len(Qhist)
-        Iavg = sum(Ihist)/len(Ihist)
-        line = str(j)+","+str(N)+","+str(Vp[j])+","+str(round(Integral,3))+","+str(round(Q,4))+"\n"
-        f.write(line)
+        axq[0][0].set_ylabel("Voltage")
         axq[0][0].text(0.6, 0.93, 'N:'+str(N),
                 transform=axq[0][0].transAxes, fontsize=12,verticalalignment='top', bbox=props)
         axq[0][0].text(0.6, 0.85, 'Qavg:'+str(round(Qavg,4))+"nC",
@@ -186,15 +223,10 @@ for j in range(0,19):
                 transform=axq[0][0].transAxes, fontsize=12,verticalalignment='top', bbox=props)   
         axq[0][0].text(0.6, 0.57, 'Ilast:'+str(round(Integral,3))+"nVS",
                 transform=axq[0][0].transAxes, fontsize=12,verticalalignment='top', bbox=props)      
-        plt.pause(0.1)
-    Qtest.append(Qavg)
-    Itest.append(Iavg)
-    axq[0][1].clear()
-    axq[0][1].plot(Vtest,Qtest,'-o',markersize=4)
-    axq[0][1].grid(color='lightgray',linestyle='-',linewidth=1)
-    axq[0][1].set_xlabel("Pulser Amplitude (Volts)")
-    axq[0][1].set_ylabel("Measured Test Charge (nC)") 
-    plt.pause(0.1)
+    if(not running):
+        break
+    plt.pause(GUIPERIOD)
+
 #################################################################################    
 # Part Two: HP8114A Pulser connected directly to the ICT Test Input with the 6dB attenuator.
 # The ICT Charge Output is now connected to the scope.  Measurement of the charge for
@@ -212,76 +244,55 @@ Qict = []
 Iict = []
 Vict = []
 f.write("Raw Data for ICT Charge Measurement:\n")
-for j in range(0,19):
-    HPwrite(':SOUR:VOLT '+str(Vp[j]))
-    sleep(1)
-    Vict.append(Vp[j])
-    Qhist=[]
-    Ihist=[]
-    scope.write('CH1:SCALE '+str(CH1scale[j]))
-    scope.write('TRIGGER:A:LEVEL:CH1 '+str(-CH1scale[j]))
-    for N in range(0,25):
-        scope.write('ACQUIRE:STOPAFTER SEQUENCE')
-        scope.write('ACQUIRE:STATE 1')
-        scope.write('*WAI')
-
+Nshot.clear()   #Same acquisition and integration as Part One with the ICT scales
+if(SAVEWAVES):
+    waves.close()
+    waves = open("/ACMICal" + year + "/"+fname+"ict.wav","wb")
+pipe = Pipeline(acquire_pulses,integrate_pulses).start()
+Vlast = np.zeros(0)
+Tlast = np.zeros(0)
+while(True):
+    running = pipe.alive()
+    R = pipe.results()
+    for (j,N,Integral,Q,Iavg,Qavg,Vq,xincr1,done) in R:
+        if(Vq is not None):
+            Vlast = Vq
+            Tlast = np.arange(len(Vq)) * xincr1
+        if(done):
+            Vict.append(Vp[j])
+            Qict.append(Qavg)
+            Iict.append(Iavg)
+            axq[1][1].clear()
+            axq[1][1].plot(Vict,Qict,'-o',markersize=4)
+            axq[1][1].grid(color='lightgray',linestyle='-',linewidth=1)
+            axq[1][1].set_xlabel("Pulser Amplitude (Volts)")
+            axq[1][1].set_ylabel("ICT Output Charge (nC)") 
+            Ratio = np.divide(Qtest[0:len(Qict)],Qict)
+            FitCoef = np.corrcoef(Qtest[0:len(Qict)],Qict)
+            axr[0].clear()
+            axr[0].plot(Qict,Qtest[0:len(Qict)],'-o',markersize=6)
+            axr[0].grid(color='lightgray',linestyle='-',linewidth=1)
+            axr[0].set_xlabel("ICT Output Charge (nC)")
+            axr[0].set_ylabel("ICT Test Charge (nC)")
+            if(len(Qict)>2):
+                pfit = np.polyfit(Qict,Qtest[0:len(Qict)],1)
+                axr[0].text(0.6, 0.93, 'Slope:'+str(round(pfit[0],1)),
+                    transform=axr[0].transAxes, fontsize=12,verticalalignment='top', bbox=props)
+                axr[0].text(0.6, 0.85, 'Intercept:'+str(round(pfit[1],2)),
+                    transform=axr[0].transAxes, fontsize=12,verticalalignment='top', bbox=props)
+                axr[0].text(0.6, 0.77, 'Correlation:'+str(round(FitCoef[0][1],3)),
+                    transform=axr[0].transAxes, fontsize=12,verticalalignment='top', bbox=props)
+            axr[1].clear()
+            axr[1].plot(Qtest[0:len(Qict)],Ratio,'-o',markersize=6)
+            axr[1].grid(color='lightgray',linestyle='-',linewidth=1)
+            axr[1].set_xlabel("ICT Output Charge (nC)")
+            axr[1].set_ylabel("Ratio Qtest/Qict")
+    if(len(R)>0):
         axq[1][0].clear()
-    
-        good=0
-        while(good==0):
-            try:
-                scope.write('ACQUIRE:STOPAFTER SEQUENCE')
-                scope.write('ACQUIRE:STATE 1')
-                scope.write('*WAI')
-                scope.write('DATA:SOU CH1')
-                scope.write('DATA:START 0')
-                scope.write('DATA:STOP 5000')
-                scope.write('DATA:WIDTH 2')
-                scope.write('DATA:ENC RIB')
-                scope.write('WFMOUTPRE:BYT_NR 2')
-
-                scope.query('*OPC?')
-    
-                ymult1 = float(scope.query('WFMPRE:YMULT?'))
-                yzero1 = float(scope.query('WFMPRE:YZERO?'))
-                yoff1 = float(scope.query('WFMPRE:YOFF?'))
-                xincr1 = float(scope.query('WFMPRE:XINCR?'))
-
-                scope.write('CURVE?')
-
-                data1 = scope.read_raw()
-                sleep(0.1)
-                good = 1
-            except:
-                good = 0
-        header_len_digits = int(data1[1:2])
-        num_bytes = int(data1[2:2+ header_len_digits])
-        bin_start = 2 + header_len_digits
-        bin_end = bin_start + num_bytes
-        ADC_wave1 = data1[bin_start:bin_end]
-        print(len(ADC_wave1))
-        CH1 = []
-
-        waveform = np.frombuffer(ADC_wave1, dtype='>i2')   
-        Vq = (waveform - yoff1) * ymult1 + yzero1
-        Tq = np.arange(len(Vq)) * xincr1
-
-        BL = sum(Vq[0:50])/50.0
-        Vq = np.subtract(Vq,BL)
-        for i in range(0,len(Vq)):
-            if(Vq[i]>0): Vq[i] = 0
+        axq[1][0].plot(Tlast,Vlast,label='Scope Data')
         axq[1][0].grid(color='lightgray',linestyle='-',linewidth=1)
         axq[1][0].set_xlabel("Time (nSec)")
-        axq[1][0].set_ylabel("Voltage") 
-        Integral = abs(sum(Vq)*xincr1*1000000000)
-        Ihist.append(Integral)
-        Q = abs(sum(Vq)*xincr1*2e7)
-        Qhist.append(Q)
-        line = str(j)+","+str(N)+","+str(Vp[j])+","+str(round(Integral,3))+","+str(round(Q,4))+"\n"
-        f.write(line)
-        Qavg = sum(Qhist)/len(Qhist)
-        Iavg = sum(Ihist)/len(Ihist)
-        axq[1][0].plot(Tq,Vq)
+        axq[1][0].set_ylabel("Voltage")
         axq[1][0].text(0.6, 0.93, 'N:'+str(N),
                 transform=axq[1][0].transAxes, fontsize=12,verticalalignment='top', bbox=props)
         axq[1][0].text(0.6, 0.85, 'Qavg:'+str(round(Qavg,4))+"nC",
@@ -292,37 +303,11 @@ for j in range(0,19):
                 transform=axq[1][0].transAxes, fontsize=12,verticalalignment='top', bbox=props)   
         axq[1][0].text(0.6, 0.57, 'Ilast:'+str(round(Integral,3))+"nVS",
                 transform=axq[1][0].transAxes, fontsize=12,verticalalignment='top', bbox=props)      
-        plt.pause(0.1)
-    Qict.append(Qavg)
-    Iict.append(Iavg)
-    axq[1][1].clear()
-    axq[1][1].plot(Vict,Qict,'-o',markersize=4)
-    axq[1][1].grid(color='lightgray',linestyle='-',linewidth=1)
-    axq[1][1].set_xlabel("Pulser Amplitude (Volts)")
-    axq[1][1].set_ylabel("ICT Output Charge (nC)") 
-    plt.pause(0.1)
-    
-    Ratio = np.divide(Qtest[0:len(Qict)],Qict)
-    FitCoef = np.corrcoef(Qtest[0:len(Qict)],Qict)
-    axr[0].clear()
-    axr[0].plot(Qict,Qtest[0:len(Qict)],'-o',markersize=6)
-    axr[0].grid(color='lightgray',linestyle='-',linewidth=1)
-    axr[0].set_xlabel("ICT Output Charge (nC)")
-    axr[0].set_ylabel("ICT Test Charge (nC)")
-    if(len(Qict)>2):
-        pfit = np.polyfit(Qict,Qtest[0:len(Qict)],1)
-        axr[0].text(0.6, 0.93, 'Slope:'+str(round(pfit[0],1)),
-            transform=axr[0].transAxes, fontsize=12,verticalalignment='top', bbox=props)
-        axr[0].text(0.6, 0.85, 'Intercept:'+str(round(pfit[1],2)),
-            transform=axr[0].transAxes, fontsize=12,verticalalignment='top', bbox=props)
-        axr[0].text(0.6, 0.77, 'Correlation:'+str(round(FitCoef[0][1],3)),
-            transform=axr[0].transAxes, fontsize=12,verticalalignment='top', bbox=props)
-    axr[1].clear()
-    axr[1].plot(Qtest[0:len(Qict)],Ratio,'-o',markersize=6)
-    axr[1].grid(color='lightgray',linestyle='-',linewidth=1)
-    axr[1].set_xlabel("ICT Output Charge (nC)")
-    axr[1].set_ylabel("Ratio Qtest/Qict")
-    plt.pause(0.1)
+    if(not running):
+        break
+    plt.pause(GUIPERIOD)
+
+report(["Scope trigger wait: "+str(round(np.mean(scope.waits),4))+" Sec avg, "+str(round(np.max(scope.waits),4))+" Sec max over "+str(len(scope.waits))+" acquisitions"],runlog)
 print(Ratio)
 print(Qict)
 print(Iict)
@@ -337,4 +322,9 @@ for k in range(0,len(Qict)):
 
 fq.savefig(fname+'RatioTestPulseQ.png')
 fr.savefig(fname+'RatioIctQ.png')
+scope.retry.write(scope.retry.summary())
+report([SCOPESETTLE.summary(),SHOTRULE.summary('Scope'),pulser.summary()],runlog)
+if(SAVEWAVES):
+    waves.close()
+runlog.close()
 plt.show(block=True)
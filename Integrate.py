@@ -0,0 +1,160 @@
+import numpy as np
+from time import perf_counter
+
+#############################################################################################
+# Charge integration shared by PosACMI.py, NegACMI.py, VerifyACMI.py and ICTRatio.py.  A
+# block of shots arrives as a shots x samples array in Volts (one row for a single shot, 25
+# for a FastFrame stack).  integrate() takes the baseline off every row, keeps only the
+# samples on the pulse side of it (polarity -1 for a negative pulse, +1 for a positive one,
+# 0 to keep all) and integrates each row with one of the KERNELS, all in place in one
+# vectorised pass over the block.  charge() turns the integrals into the charge the pulse
+# put into the 50 Ohm scope input.
+#
+#   rect     sum of the samples times the sample spacing (what the scripts always did)
+#   trapz    trapezoidal rule
+#   simpson  composite Simpson rule (trapezoid on the last interval of an even record)
+#   gated    rectangular sum over a gate from GATEPAD samples before the first to GATEPAD
+#            samples after the last sample above GATEFRAC of the first shot's peak, so the noise
+#            of the rest of the record is left out and fewer samples are summed
+#
+# Run this file to compare the kernels on waveforms saved by the scripts with SAVEWAVES set
+# (python Integrate.py /ACMICal2026/posacmi.wav), or on simulated ones without arguments.
+#############################################################################################
+
+BASELINE = 50      # Samples ahead of the pulse used for the baseline
+OHMS = 50.0        # Scope input termination
+GATEFRAC = 0.02    # Fraction of the peak that opens the gate
+GATEPAD = 25       # Samples kept on either side of the gate (1 nSec at 25 GS/s)
+
+def rectangular(V, xincr):
+    return V.sum(axis=1)*xincr
+
+def trapezoid(V, xincr):
+    return (V.sum(axis=1) - 0.5*(V[:,0]+V[:,-1]))*xincr
+
+def simpson(V, xincr):
+    n = V.shape[1]
+    if(n < 3):
+        return trapezoid(V, xincr)
+    m = n if n % 2 == 1 else n-1        # Odd number of samples for the Simpson part
+    S = V[:,0] + V[:,m-1] + 4.0*V[:,1:m-1:2].sum(axis=1) + 2.0*V[:,2:m-1:2].sum(axis=1)
+    A = S*xincr/3.0
+    if(m < n):
+        A += 0.5*(V[:,-2]+V[:,-1])*xincr
+    return A
+
+def gate(V, frac=GATEFRAC, pad=GATEPAD):
+    """Sample range (lo,hi) of the pulse in a baselined block: the samples of the first shot
+    above frac of its peak, with pad samples on either side.  The shots of a block are all
+    on the same trigger, so one shot is enough to place the gate."""
+    env = np.abs(V[0])
+    idx = np.nonzero(env > frac*env.max())[0]
+    if(len(idx) == 0):
+        return 0, V.shape[1]
+    return max(0, idx[0]-pad), min(V.shape[1], idx[-1]+pad+1)
+
+def gated(V, xincr):
+    lo,hi = gate(V)
+    return V[:,lo:hi].sum(axis=1)*xincr
+
+KERNELS = {'rect':rectangular, 'trapz':trapezoid, 'simpson':simpson, 'gated':gated}
+
+def integrate(V, xincr, polarity=-1, baseline=BASELINE, kernel='rect'):
+    """Baseline, mask and integrate every shot of V (shots x samples, or one shot) in place.
+    Returns the integral of every shot in V*Sec."""
+    if(kernel not in KERNELS):
+        raise ValueError('Unknown integration kernel '+repr(kernel)+', use one of '+', '.join(KERNELS))
+    V = np.atleast_2d(V)
+    V -= V[:,0:baseline].mean(axis=1,keepdims=True)
+    if(polarity < 0):
+        np.minimum(V,0,out=V)
+    elif(polarity > 0):
+        np.maximum(V,0,out=V)
+    return KERNELS[kernel](V, xincr)
+
+def charge(A, ohms=OHMS):
+    """Charge in nC of integrals A in V*Sec across ohms."""
+    return np.asarray(A)*1e9/ohms
+
+def save(f, j, V, xincr):
+    """Append the block V of amplitude j to the open binary file f."""
+    np.save(f, np.array([j, xincr]))
+    np.save(f, V)
+
+def load(fname):
+    """Read back the blocks written by save(), joining the blocks of an amplitude that have
+    the same length.  Returns {(j,samples): (shots x samples, xincr)}."""
+    blocks = {}
+    with open(fname, 'rb') as f:
+        while(True):
+            try:
+                head = np.load(f)
+            except (EOFError, ValueError):
+                break
+            j,xincr = int(head[0]), float(head[1])
+            V = np.atleast_2d(np.load(f))
+            key = (j, V.shape[1])
+            if(key in blocks):
+                V = np.vstack([blocks[key][0], V])
+            blocks[key] = (V, xincr)
+    return blocks
+
+def simulate(amplitudes=(1,5,10,15,20), shots=25):
+    """Blocks of simulated scope shots (see Simulator) at the pulser amplitudes."""
+    from Simulator import Lab, FakeMSO64B
+    lab = Lab({'rate':1e6}, tau=1e-9, noise=0.0, seed=1)     # Only the scope noise
+    scope = FakeMSO64B(lab)
+    scope.command('HORIZONTAL:FASTFRAME:STATE ON')
+    scope.command('HORIZONTAL:FASTFRAME:COUNT '+str(shots))
+    scope.command('CH1:POS 4.5')
+    blocks = {}
+    for j in range(0,len(amplitudes)):
+        lab.set_volts(amplitudes[j])
+        scope.command('CH1:SCALE '+str(max(0.2, amplitudes[j]/4.0)))
+        scope.acquire()
+        blocks[j] = ((scope.mem.astype(float) - float(scope.get('CH1:POS'))*6553.6)*scope.ymult(), scope.xincr())
+    return blocks
+
+def bench(blocks, polarity=-1, repeat=20):
+    """Time every kernel on the blocks and measure its shot to shot spread.  Returns
+    {kernel: (uSec per waveform, mean relative std over the blocks, mean charge in nC)}."""
+    if(not any(len(V) > 1 for V,xincr in blocks.values())):
+        raise ValueError('No block with more than one shot to compare the kernels on')
+    results = {}
+    for kernel in KERNELS:
+        t = 0.0
+        n = 0
+        rel = []
+        Q = []
+        for key in sorted(blocks):
+            V,xincr = blocks[key]
+            if(len(V) < 2):
+                continue            # No shot to shot spread in a single shot
+            for r in range(0,repeat):
+                W = V.copy()
+                t0 = perf_counter()
+                A = integrate(W, xincr, polarity, kernel=kernel)
+                t += perf_counter()-t0
+                n += len(W)
+            q = np.abs(charge(A))
+            rel.append(np.std(q)/np.mean(q))
+            Q.append(np.mean(q))
+        results[kernel] = (1e6*t/n, float(np.mean(rel)), float(np.mean(Q)))
+    return results
+
+if __name__ == '__main__':
+    # Compare the kernels:  python Integrate.py [file.wav ...] [--pos]
+    import sys
+    polarity = 1 if '--pos' in sys.argv else -1
+    files = [a for a in sys.argv[1:] if not a.startswith('--')]
+    if(len(files) == 0):
+        print('No waveform files given, using simulated shots')
+        blocks = simulate()
+    else:
+        blocks = {}
+        for fname in files:
+            for key,block in load(fname).items():
+                blocks[(fname,)+key] = block
+    print(str(len(blocks))+' blocks, '+str(sum(len(b[0]) for b in blocks.values()))+' waveforms')
+    for kernel,(us,rel,Q) in bench(blocks, polarity).items():
+        print('%-8s %8.1f uSec/waveform   shot to shot std %7.4f%%   mean charge %8.4f nC' % (kernel, us, 100.0*rel, Q))
@@ -1,14 +1,38 @@
-from pylogix import PLC
 from math import sqrt
 import numpy as np
 import matplotlib.pyplot as plt
 import serial
 from time import sleep
-import pyvisa as visa
+from ScopeDriver import MSO64B
+from Pipeline import Pipeline
+from Stats import Sequential, report
+from AmpScheduler import AmpScheduler
+from bisect import bisect
+from Sweep import Sweep, saturated, CH1scale, Vp, ACMIPERIOD, NEGNOISE, scope_settler, acmi_settler
+from ACMIPlc import read_tags, Sampler, PLCSession
+from concurrent.futures import ThreadPoolExecutor
 import socket
-import telnetlib3 as tn
+from Prologix import Prologix
 
 props = dict(boxstyle='round', facecolor='wheat', alpha=0.5)
+FASTFRAME = True   # Capture the 25 shots of each amplitude in one FastFrame acquisition
+WINDOW = False     # Transfer only the pulse window located in the first shot (leaves the rest of the record out of the charge)
+GUIPERIOD = 0.2    # Sec between plot updates while the acquisition runs in the background
+KERNEL = 'rect'     # Integration kernel of the shots: 'rect', 'trapz', 'simpson' or 'gated' (see Integrate.py)
+SAVEWAVES = False  # Also save the shots (Volts) to <fname>.wav for comparing the kernels offline
+SEQUENTIAL = False # Average every amplitude only until its mean charge is known to QTARGET (see Stats.Sequential)
+QTARGET = [0.5,0.1] # Target standard error of the mean charge: pC, or % of the charge when that is larger
+SHOTS = [8,100]    # Fewest and most scope shots per amplitude with SEQUENTIAL (25 without)
+SAMPLES = [6,48]   # Fewest and most ACMI samples per amplitude with SEQUENTIAL (16 without)
+ADAPTIVE = False   # Let AmpScheduler choose the ACMI amplitudes from Vp, the fit range and the saturation checks instead of taking all 23
+FITTOL = 15.0      # pC uncertainty of the ACMI charge fit at which ADAPTIVE stops adding amplitudes
+SCOPESETTLE = scope_settler()   # Wait for stable scope integrals after an amplitude step
+ACMISETTLE = acmi_settler(NEGNOISE)   # Wait for two ACMI updates past the step that agree within the ACMI noise (see Sweep.py)
+SCOPEAREA = False  # Let the scope measure the pulse AREA and transfer only the results
+DEBUG = False      # With SCOPEAREA, also transfer the full waveforms for plotting
+AREAgate = [-10e-9,70e-9] # Gate for the scope AREA measurement (Sec from the trigger)
+SPLITTER = False   # Single pass: pulser through the ZFSC-2-1W-S+ splitter to the scope and the ICT at the same time
+SPLITdB = [3.2,3.2] # Loss (dB) of the splitter arm to the scope and of the arm to the ICT test input
 
 plt.ion()
 
@@ -22,21 +46,15 @@ plt.ion()
 # )
 # sleep(0.5)  # Give the port time to settle
 
-tnet = tn.Telnet('10.0.128.150','1234')
+pulser = Prologix('10.0.128.150',14)   # HP8114A at GPIB address 14, controller mode with *OPC? handshakes
 
 def HPwrite(cmd):
-    tnet.write((cmd + "\n").encode("ascii"))
-    sleep(0.1)
+    pulser.write(cmd)
 
 def HPread():
-    return tnet.read_until(b'\n',7)
+    return pulser.read()
 
-# Put Prologix in controller mode and set GPIB address
-HPwrite("++mode 1")      # Controller mode
-HPwrite("++addr 14")      # Change to HP8114A's GPIB address
-HPwrite("++auto 1")      # Automatically read response after write
-HPwrite("*IDN?")
-response = HPread()
+response = pulser.query("*IDN?")
 print(response)
 model = int(response[18:22])
 if(model != 8114):
@@ -44,19 +62,9 @@ if(model != 8114):
     exit()
 else:
     print('HP8114A Pusle Generator FOUND.')   
-    HPwrite(':SOUR:VOLT 0.0')
-    sleep(0.5)
-    HPwrite(':OUTP:POL POS')
-    sleep(0.5)
-    HPwrite(':SOUR:PULS:DEL 5US')
-    sleep(0.5)
-    HPwrite(':SOUR:PULS:WIDT 50.0NS')
-    sleep(0.5)
-    HPwrite(':SOUR:VOLT 1.0')
-    sleep(0.5)
+    pulser.batch([':SOUR:VOLT 0.0',':OUTP:POL POS',':SOUR:PULS:DEL 5US',':SOUR:PULS:WIDT 50.0NS',':SOUR:VOLT 1.0'])
     
-rm = visa.ResourceManager()
-scope = rm.open_resource('TCPIP0::10.0.128.110::inst0::INSTR')
+scope = MSO64B('TCPIP0::10.0.128.110::inst0::INSTR')   # or 'TCPIP0::10.0.128.110::4000::SOCKET' (raw socket server)
 response = scope.query('*IDN?')
 serial_number = int(response[18:24])
 if(serial_number != 13046):
@@ -66,29 +74,30 @@ else:
     print('Tektronix MSO64B Scope FOUND.')
     
 #Set up the scope:
-scope.write('HOR:RECO 5000')
-scope.write('TRIGGER:A:MODE NORM')
-scope.write('TRIGGER:A:TYPE EDGE')
-scope.write('TRIGGER:A:EDGE:SOURCE CH1')
-scope.write('TRIGGER:A:EDGE:SLOPE RISE')
-scope.write('TRIGGER:A:EDGE:COUPLING DC')
-scope.write('HORIZONTAL:MODE MANUAL')
-scope.write('HORIZONTAL:MODE:SAMPLERATE 25.0E9')
-scope.write('HORIZONTAL:SCALE 4e-8')
-scope.write('HORIZONTAL:POS 10')
+scope.set('HOR:RECO','5000')
+scope.set('TRIGGER:A:MODE','NORM')
+scope.set('TRIGGER:A:TYPE','EDGE')
+scope.set('TRIGGER:A:EDGE:SOURCE','CH1')
+scope.set('TRIGGER:A:EDGE:SLOPE','RISE')
+scope.set('TRIGGER:A:EDGE:COUPLING','DC')
+scope.set('HORIZONTAL:MODE','MANUAL')
+scope.set('HORIZONTAL:MODE:SAMPLERATE','25.0E9')
+scope.set('HORIZONTAL:SCALE','4e-8')
+scope.set('HORIZONTAL:POS','10')
 scope.write('*WAI')
-scope.write('CH1:SCALE 0.200')
-scope.write('CH1:POS -4.5')
+scope.set('CH1:SCALE','0.200')
+scope.set('CH1:POS','-4.5')
+scope.transfer('CH1',0,5000)
+if(SCOPEAREA):
+    scope.area_setup(AREAgate[0],AREAgate[1])
     
-with PLC() as comm:
-    comm.IPAddress = '10.0.128.47'
-    
-    device = comm.GetModuleProperties(0).Value
-    if(device.ProductName != "1768-L43S/B LOGIX5343SAFETY"):
-        print("1768-L43S/B PLC NOT FOUND...exiting")
-        exit()
-    else:
-        print("1768-L43S/B PLC FOUND.\n\n")
+comm = PLCSession('10.0.128.47')    # One connection for the whole sweep, reconnected if it drops
+device = comm.connect()
+if(device.ProductName != "1768-L43S/B LOGIX5343SAFETY"):
+    print("1768-L43S/B PLC NOT FOUND...exiting")
+    exit()
+else:
+    print("1768-L43S/B PLC FOUND.\n\n")
         
 # Declare the PLC Tags for this test:
 BmAtag = 'Program:Main_Loop.Beam_ADCA'
@@ -102,13 +111,13 @@ Quad2tag = 'Program:Main_Loop.Fit_Quad_2'
 Lin1tag = 'Program:Main_Loop.Fit_Linear_1'
 Lin2tag = 'Program:Main_Loop.Fit_Linear_2'
 Offtag = 'Program:Main_Loop.Fit_Off'
+ADCtags = [BmAtag,BmBtag,STABAtag,STABBtag,STBAAtag,STBABtag]
+Counttag = None     # ACMI update counter tag if the PLC program has one; without it an update is seen as a change of the ADC values
+ACMI = Sampler(comm,ADCtags,Counttag,period=ACMIPERIOD)
 
 #Get the Current ACMI Calibration Parameters:
-Quad1 = int(comm.Read(Quad1tag).Value)
-Quad2 = int(comm.Read(Quad2tag).Value)
-Lin1 = int(comm.Read(Lin1tag).Value)
-Lin2 = int(comm.Read(Lin2tag).Value)
-ACMIoff = int(comm.Read(Offtag).Value)
+t,CAL = read_tags(comm,[Quad1tag,Quad2tag,Lin1tag,Lin2tag,Offtag])
+Quad1,Quad2,Lin1,Lin2,ACMIoff = [int(x) for x in CAL]
 ACMIquad = float(Quad1)/float(Quad2)
 ACMIlin = float(Lin1)/float(Lin2)
 
@@ -118,95 +127,82 @@ print(ACMIquad,ACMIlin,ACMIoff)
 # each of 24 different pulse amplitudes from 1V to 24V in 1V steps.  The pulse width is fixed
 # at 50.3nSec for all pulse amplitudes.
 #############################################################################################
-input("Connect cable from HP8114A Pulser to Oscilloscope Channel 1.  Hit <CR> when done.")
+if(SPLITTER):
+    input("Connect HP8114A Pulser to the splitter input and splitter port 1 to Oscilloscope Channel 1.  Hit <CR> when done.")
+    input("Connect splitter port 2 through the 6Db attenuator to the ICT test input.  Hit <CR> when done.")
+    input("Connect ICT Charge Output to ACMI input.  Hit <CR> when done.")
+else:
+    input("Connect cable from HP8114A Pulser to Oscilloscope Channel 1.  Hit <CR> when done.")
 year = input("\nEnter Year : ")
 if(int(year)<2024 or int(year)>2064):
     print("Bad Year Input... Exiting.")
     exit()
 fname = input("Enter file name for data (No Extension): ")
+runlog = open("/ACMICal" + year + "/"+fname+".log","w")
+scope.retry.log = runlog
+comm.retry.log = runlog
 
 fq,axq = plt.subplots(1,2,figsize=(12,6))
 
-CH1scale=[0.2,0.5,0.5,0.5,1,1,1,1,1,2,2,2,2,2,2,2,2,2,5,5,5,5,5] #in Volts/Division on Scope
-Vp = [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23] #in Volts for Pulse Amplitude
-
 Qtest = []
 Itest = []
+Jtest = []  #Amplitude index of every entry
 Vtest= []   
 f = open("/ACMICal" + year + "/"+fname+".raw","w")
+waves = None
+if(SAVEWAVES):
+    waves = open("/ACMICal" + year + "/"+fname+".wav","wb")
 f.write("Raw Data for Test Pulse Charge Measurement:\n")
 
-for j in range(0,23):
-    HPwrite(':SOUR:VOLT '+str(Vp[j]))
-    sleep(1)
-    Vtest.append(Vp[j])
-    Qhist=[]
-    Ihist=[]
-    for N in range(0,25):
-        scope.write('CH1:SCALE '+str(CH1scale[j]))
-        scope.write('TRIGGER:A:LEVEL:CH1 '+str(CH1scale[j]))
-        scope.write('ACQUIRE:STOPAFTER SEQUENCE')
-        scope.write('ACQUIRE:STATE 1')
-        scope.write('*WAI')
-    
-        good=0
-        while(good==0):
-            try:
-                scope.write('ACQUIRE:STOPAFTER SEQUENCE')
-                scope.write('ACQUIRE:STATE 1')
-                scope.write('*WAI')
-                scope.write('DATA:SOU CH1')
-                scope.write('DATA:START 0')
-                scope.write('DATA:STOP 5000')
-                scope.write('DATA:WIDTH 2')
-                scope.write('DATA:ENC RIB')
-                scope.write('WFMOUTPRE:BYT_NR 2')
-
-                scope.query('*OPC?')
-    
-                ymult1 = float(scope.query('WFMPRE:YMULT?'))
-                yzero1 = float(scope.query('WFMPRE:YZERO?'))
-                yoff1 = float(scope.query('WFMPRE:YOFF?'))
-                xincr1 = float(scope.query('WFMPRE:XINCR?'))
-
-                scope.write('CURVE?')
-
-                data1 = scope.read_raw()
-                sleep(0.1)
-                good = 1
-            except:
-                good = 0
-        header_len_digits = int(data1[1:2])
-        num_bytes = int(data1[2:2+ header_len_digits])
-        bin_start = 2 + header_len_digits
-        bin_end = bin_start + num_bytes
-        ADC_wave1 = data1[bin_start:bin_end]
-        print(len(ADC_wave1))
-        CH1 = []
+# With the splitter the scope sees the pulse through one arm and the ICT through the other, so
+# the scope integral and charge are both scaled to what the pulser puts into the ICT path.
+SPLITK = 1.0
+if(SPLITTER):
+    SPLITK = 10**((SPLITdB[0]-SPLITdB[1])/20.0)
+pool = ThreadPoolExecutor(1)
+SHOTRULE = Sequential(25,25)    #Scope shots per amplitude
+if(SEQUENTIAL):
+    SHOTRULE = Sequential(SHOTS[0],SHOTS[1],QTARGET[0]/1000.0,QTARGET[1]/100.0,batch=scope.buf.shots)
+ACMIRULE = Sequential(16,16)    #ACMI samples per amplitude, on the beam ADC counts
+if(SEQUENTIAL):
+    ACMIRULE = Sequential(SAMPLES[0],SAMPLES[1],abs(QTARGET[0]/ACMIlin),QTARGET[1]/100.0)
+SCHED = AmpScheduler(Vp,tol=FITTOL)
+AMPS = range(0,23)
+if(ADAPTIVE and SPLITTER):
+    AMPS = SCHED    #The single pass follows the scheduler
 
-        waveform = np.frombuffer(ADC_wave1, dtype='>i2')   
-        Vq = (waveform - yoff1) * ymult1 + yzero1
-        Tq = np.arange(len(Vq)) * xincr1
-        
-        BL = sum(Vq[0:50])/50.0
-        Vq = np.subtract(Vq,BL)
-        for i in range(0,len(Vq)):
-            if(Vq[i]<0): Vq[i] = 0
+sweep = Sweep(scope,HPwrite,ACMI,f,polarity=1,trigger=1.0,amps=AMPS,fastframe=FASTFRAME,window=WINDOW,
+              area=SCOPEAREA,debug=DEBUG,kernel=KERNEL,waves=waves,splitter=SPLITTER,splitk=SPLITK,
+              adaptive=ADAPTIVE,sched=SCHED,pool=pool,shotrule=SHOTRULE,acmirule=ACMIRULE,
+              scopesettle=SCOPESETTLE,acmisettle=ACMISETTLE)
+pipe = Pipeline(sweep.acquire_pulses,sweep.integrate_pulses).start()
+Vlast = np.zeros(0)
+Tlast = np.zeros(0)
+while(True):
+    running = pipe.alive()
+    R = pipe.results()
+    for (j,N,Integral,Q,Iavg,Qavg,Vq,xincr1,done) in R:
+        if(Vq is not None):
+            Vlast = Vq
+            Tlast = np.arange(len(Vq)) * xincr1
+        if(done):
+            m = bisect(Vtest,Vp[j])     #In amplitude order, also when the scheduler sweeps out of order
+            Vtest.insert(m,Vp[j])
+            Qtest.insert(m,Qavg)
+            Itest.insert(m,Iavg)
+            Jtest.insert(m,j)
+            axq[1].clear()
+            axq[1].plot(Vtest,Qtest,'-o',markersize=4)
+            axq[1].grid(color='lightgray',linestyle='-',linewidth=1)
+            axq[1].set_xlabel("Pulser Amplitude (Volts)")
+            axq[1].set_ylabel("Measured Test Charge (nC)") 
+    if(len(R)>0):
         axq[0].clear()
-        
-        axq[0].plot(Tq,Vq,label='Scope Data')
+        axq[0].plot(Tlast,Vlast,label='Scope Data')
         axq[0].grid(color='lightgray',linestyle='-',linewidth=1)
         axq[0].set_xlabel("Time (nSec)")
-        axq[0].set_ylabel("Voltage") 
+        axq[0].set_ylabel("Voltage")
         axq[0].legend(loc='lower right')
-        Integral = sum(Vq)*xincr1*-1000000000
-        Ihist.append(Integral)
-        Q = sum(Vq)*xincr1*-2e7
-        Qhist.append(Q)
-        Qavg = sum(Qhist)/len(Qhist)
-        Iavg = sum(Ihist)/len(Ihist)
-        line = str(j)+","+str(N)+","+str(Vp[j])+","+str(round(Integral,3))+","+str(round(Q,4))+"\n"
-        f.write(line)
         axq[0].text(0.6, 0.93, 'N:'+str(N),
                 transform=axq[0].transAxes, fontsize=12,verticalalignment='top', bbox=props)
         axq[0].text(0.6, 0.85, 'Qavg:'+str(round(Qavg,4))+"nC",
@@ -217,16 +213,11 @@ for j in range(0,23):
                 transform=axq[0].transAxes, fontsize=12,verticalalignment='top', bbox=props)   
         axq[0].text(0.6, 0.57, 'Ilast:'+str(round(Integral,3))+"nVS",
                 transform=axq[0].transAxes, fontsize=12,verticalalignment='top', bbox=props)      
-        plt.pause(0.1)
-    Qtest.append(Qavg)
-    Itest.append(Iavg)
-    axq[1].clear()
-    axq[1].plot(Vtest,Qtest,'-o',markersize=4)
-    axq[1].grid(color='lightgray',linestyle='-',linewidth=1)
-    axq[1].set_xlabel("Pulser Amplitude (Volts)")
-    axq[1].set_ylabel("Measured Test Charge (nC)") 
-    plt.pause(0.1)
+    if(not running):
+        break
+    plt.pause(GUIPERIOD)
 
+report(["Scope trigger wait: "+str(round(np.mean(scope.waits),4))+" Sec avg, "+str(round(np.max(scope.waits),4))+" Sec max over "+str(len(scope.waits))+" acquisitions"],runlog)
 HPwrite(':SOUR:VOLT 1.0\n')
 fq.savefig(fname+'testpulse.png')
 sleep(5)  
@@ -236,83 +227,106 @@ sleep(5)
 # each of 24 different pulse amplitudes from 1V to 24V in 1V steps.  The pulse width is fixed
 # at 50.3nSec for all pulse amplitudes.
 
+# With the splitter the ACMI samples were already taken during Part One and are only processed here.
+
 "Remove cable from Oscilloscope and add a 6Db attenuator to the end of the cable"
-input("Remove cable from Oscilloscope and add a 6Db attenuator to the end of the cable.  Hit <CR> when done.")
-input("Connect attenuator to the ICT test input.  Hit <CR> when done.")
-input("Connect ICT Charge Output to ACMI input.  Hit <CR> when done.")
+if(not SPLITTER):
+    input("Remove cable from Oscilloscope and add a 6Db attenuator to the end of the cable.  Hit <CR> when done.")
+    input("Connect attenuator to the ICT test input.  Hit <CR> when done.")
+    input("Connect ICT Charge Output to ACMI input.  Hit <CR> when done.")
     
-Vp = [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23] #in Volts for Pulse Amplitude
-
 fst,axst = plt.subplots(2,2,figsize=(11,9))
 fbm,axbm = plt.subplots(2,2,figsize=(11,9))
 
 Vtest = []
+Qin = []    #Scope charge of every ACMI amplitude, in amplitude order
 BM = []
 STA = []
 STB = []
 f.write("Raw Data for ACMI Charge Measurement:\n")
-for j in range(0,23):
-    HPwrite(':SOUR:VOLT '+str(Vp[j]))
-    sleep(3)
-    Vtest.append(Vp[j])
+if(SPLITTER):
+    fs = open("/ACMICal" + year + "/"+fname+".split","w")
+    fs.write("Splitter Data (j,Vp,Qscope,Qtest,Beam,ST1AB,ST1BA) with the scope arm at "+str(SPLITdB[0])+"dB and the ICT arm at "+str(SPLITdB[1])+"dB:\n")
+AMPS = range(0,23)
+if(SPLITTER):
+    AMPS = sorted(sweep.ACMIsamples)  #The amplitudes of the single pass
+elif(ADAPTIVE):
+    AMPS = SCHED
+for j in AMPS:
+    Qj = Qtest[Jtest.index(j)]
+    if(SPLITTER):
+        S,Bstats = sweep.ACMIsamples[j]
+    else:
+        HPwrite(':SOUR:VOLT '+str(Vp[j]))
+        S,Bstats = sweep.sample_acmi(j)
+        print(comm.Read(BmAtag).Value)
     B=[]
     TA=[]
     TB=[]
-    print(comm.Read(BmAtag).Value)
-    for n in range(0,16):
-        ADCA = int(comm.Read(BmAtag).Value)
-        ADCB = int(comm.Read(BmBtag).Value)
-        line = str(j)+","+str(n)+","+str(round(Qtest[j],3))+","+str(ADCA)+","+str(ADCB)+","
+    for n in range(0,len(S)):
+        ADC = S[n]
+        ADCA = ADC[0]
+        ADCB = ADC[1]
+        line = str(j)+","+str(n)+","+str(round(Qj,3))+","+str(ADCA)+","+str(ADCB)+","
         if(ADCA==2047):
             B.append(ADCA)
         else:
             B.append(ADCA-ADCB)
             
-        ADCA = int(comm.Read(STABAtag).Value)
-        ADCB = int(comm.Read(STABBtag).Value)
+        ADCA = ADC[2]
+        ADCB = ADC[3]
         line = line+str(ADCA)+","+str(ADCB)+","
         if(ADCA==2047):
             TA.append(ADCA)
         else:
             TA.append(ADCA-ADCB)
             
-        ADCA = int(comm.Read(STBAAtag).Value)
-        ADCB = int(comm.Read(STBABtag).Value)
+        ADCA = ADC[4]
+        ADCB = ADC[5]
         line = line+str(ADCA)+","+str(ADCB)+"\n"
         if(ADCB==2047):
             TB.append(ADCB)
         else:
             TB.append(ADCB-ADCA)
 
-        print(n,round(Qtest[j],3),B[n],TA[n],TB[n])
+        print(n,round(Qj,3),B[n],TA[n],TB[n])
         f.write(line)
-        sleep(2.2)
+    f.write(Bstats.record('B',j,Vp[j])+"\n")
         
-    BM.append(np.mean(B))
-    STA.append(np.mean(TA))
-    STB.append(np.mean(TB))
-    print("Averages:",j,Vp[j],Qtest[j],BM[j],STA[j],STB[j])
+    m = bisect(Vtest,Vp[j])
+    Vtest.insert(m,Vp[j])
+    Qin.insert(m,Qj)
+    BM.insert(m,np.mean(B))
+    STA.insert(m,np.mean(TA))
+    STB.insert(m,np.mean(TB))
+    if(ADAPTIVE and not SPLITTER):
+        SCHED.add(j,1000*Qj,BM[m],saturated(S))
+    print("Averages:",j,Vp[j],Qj,BM[m],STA[m],STB[m])
+    if(SPLITTER):
+        fs.write(str(j)+","+str(Vp[j])+","+str(round(Qj/SPLITK,4))+","+str(round(Qj,4))+","+str(round(BM[m],3))+","+str(round(STA[m],3))+","+str(round(STB[m],3))+"\n")
     
     axbm[0][0].clear()
     axbm[0][1].clear()
     axbm[1][0].clear()
     axbm[1][1].clear()    
-    axbm[0][0].plot(Qtest[0:len(BM)],BM,'-o',markersize=6)
+    axbm[0][0].plot(Qin[0:len(BM)],BM,'-o',markersize=6)
     axbm[0][0].grid(True)
     axbm[0][0].set_xlabel("Test Pulse Charge (nC)")
     axbm[0][0].set_ylabel("Beam (A-B) (ADC Cnts)")
 
-    if(len(BM)>3):
-        #Do not include the saturated ADC data in the calibration calculations
-        L = len(BM)
-        if(L>19): L=19
+    #Do not include the saturated ADC data in the calibration calculations
+    L = len(BM)
+    if(ADAPTIVE):
+        L = SCHED.fitcount(Vtest)   #Amplitudes below the predicted saturation
+    elif(L>19): L=19
+    if(L>3):    #Enough points below saturation for the quadratic fit
          
-        axbm[1][0].plot(BM[0:L],np.multiply(Qtest[0:L],1000),'-o',markersize=6)
+        axbm[1][0].plot(BM[0:L],np.multiply(Qin[0:L],1000),'-o',markersize=6)
         axbm[1][0].grid(True)
         axbm[1][0].set_ylabel("Test Pulse Charge (pC)")
         axbm[1][0].set_xlabel("Beam (A-B) (ADC Cnts)")
-        pfit = np.polyfit(BM[0:L],np.multiply(Qtest[0:L],1000),2)
-        FitCoef = np.corrcoef(BM[0:L],Qtest[0:L])
+        pfit = np.polyfit(BM[0:L],np.multiply(Qin[0:L],1000),2)
+        FitCoef = np.corrcoef(BM[0:L],Qin[0:L])
         mess = 'Quadratic: '+str(round(pfit[0],6))+'pC/Cnt/Cnt\nLinear: '+str(round(pfit[1],4))+'pC/Cnt\nOffset:'+str(round(pfit[2],3))+'pC\nCorrelation:'+str(round(FitCoef[0][1],4))
         axbm[1][0].text(0.05, 0.93, mess,
             transform=axbm[1][0].transAxes, fontsize=12,verticalalignment='top', bbox=props)
@@ -322,9 +336,9 @@ for j in range(0,23):
         Qold = []
         for k in range(0,L):
             Qcal.append(pfit[2]+pfit[1]*BM[k]+pfit[0]*BM[k]*BM[k])
-            Qerr.append(1000.0*Qtest[k] - Qcal[k])
+            Qerr.append(1000.0*Qin[k] - Qcal[k])
             Qold.append(ACMIoff+ACMIlin*BM[k]+ACMIquad*BM[k]*BM[k])
-        axbm[0][1].plot(BM[0:L],np.multiply(Qtest[0:L],1000),'o',markersize=6,label="Data")
+        axbm[0][1].plot(BM[0:L],np.multiply(Qin[0:L],1000),'o',markersize=6,label="Data")
         axbm[0][1].plot(BM[0:L],Qcal,'-',label="New Fit")
         axbm[0][1].plot(BM[0:L],Qold,'-',label="Old Fit")
         axbm[0][1].grid(True)
@@ -349,46 +363,61 @@ for j in range(0,23):
     axst[0][1].clear()
     axst[1][0].clear()
     axst[1][1].clear()    
-    axst[0][0].plot(Qtest[0:len(STA)],STA,'-o',markersize=6)
+    axst[0][0].plot(Qin[0:len(STA)],STA,'-o',markersize=6)
     axst[0][0].grid(True)
     axst[0][0].set_xlabel("Test Pulse Charge (nC)")
     axst[0][0].set_ylabel("Self Test (A-B) (Cnts)")
     
-    axst[0][1].plot(Qtest[0:len(STB)],STB,'-o',markersize=6)
+    axst[0][1].plot(Qin[0:len(STB)],STB,'-o',markersize=6)
     axst[0][1].grid(True)
     axst[0][1].set_xlabel("Test Pulse Charge (nC)")
     axst[0][1].set_ylabel("Self T(B-A) (Cnts)")
     
-    if(len(STA)>3):
-        #Do not include the saturated ADC data in the calibration calculations
-        L = len(STA)
-        if(L>19): L=19
+    #Do not include the saturated ADC data in the calibration calculations
+    L = len(STA)
+    if(ADAPTIVE):
+        L = SCHED.fitcount(Vtest)
+    elif(L>19): L=19
+    if(L>3):    #Enough points below saturation for the quadratic fit
          
-        axst[1][0].plot(STA[0:L],np.multiply(Qtest[0:L],1000),'-o',markersize=6)
+        axst[1][0].plot(STA[0:L],np.multiply(Qin[0:L],1000),'-o',markersize=6)
         axst[1][0].grid(True)
         axst[1][0].set_ylabel("Test Pulse Charge (pC)")
         axst[1][0].set_xlabel("Self Test (A-B) (ADC Cnts)")
-        pfit = np.polyfit(STA[0:L],np.multiply(Qtest[0:L],1000),2)
-        FitCoef = np.corrcoef(STA[0:L],Qtest[0:L])
+        pfit = np.polyfit(STA[0:L],np.multiply(Qin[0:L],1000),2)
+        FitCoef = np.corrcoef(STA[0:L],Qin[0:L])
         mess = 'Quadratic: '+str(round(pfit[0],6))+'pC/Cnt/Cnt\nLinear: '+str(round(pfit[1],4))+'pC/Cnt\nOffset:'+str(round(pfit[2],3))+'pC\nCorrelation:'+str(round(FitCoef[0][1],4))
         axst[1][0].text(0.05, 0.93, mess,
             transform=axst[1][0].transAxes, fontsize=12,verticalalignment='top', bbox=props)
         
-        axst[1][1].plot(STB[0:L],np.multiply(Qtest[0:L],1000),'-o',markersize=6)
+        axst[1][1].plot(STB[0:L],np.multiply(Qin[0:L],1000),'-o',markersize=6)
         axst[1][1].grid(True)
         axst[1][1].set_ylabel("Test Pulse Charge (pC)")
         axst[1][1].set_xlabel("Self Test (B-A) (ADC Cnts)")
-        pfit = np.polyfit(STB[0:L],np.multiply(Qtest[0:L],1000),2)
-        FitCoef = np.corrcoef(STB[0:L],Qtest[0:L])
+        pfit = np.polyfit(STB[0:L],np.multiply(Qin[0:L],1000),2)
+        FitCoef = np.corrcoef(STB[0:L],Qin[0:L])
         mess = 'Quadratic: '+str(round(pfit[0],6))+'pC/Cnt/Cnt\nLinear: '+str(round(pfit[1],4))+'pC/Cnt\nOffset:'+str(round(pfit[2],3))+'pC\nCorrelation:'+str(round(FitCoef[0][1],4))
         axst[1][1].text(0.05, 0.93, mess,
             transform=axst[1][1].transAxes, fontsize=12,verticalalignment='top', bbox=props) 
 
     plt.pause(0.1)
+if(ADAPTIVE):
+    f.write("Fit,"+",".join([str(j) for j in SCHED.fitted()])+"\n")    #Amplitudes of the fit, for ProcessReport
 
 HPwrite(':SOUR:VOLT 0.0\n')
 sleep(1)  
 fbm.savefig(fname+'beam.png')
 fst.savefig(fname+'selftest.png')
 
+scope.retry.write(scope.retry.summary())
+summaries = [SCOPESETTLE.summary(),ACMISETTLE.summary(),ACMI.summary(),SHOTRULE.summary('Scope'),ACMIRULE.summary('ACMI')]
+if(ADAPTIVE):
+    summaries += [SCHED.summary(),"Amplitudes in the order measured: "+str([Vp[j] for j in SCHED.order])]
+report(summaries+[comm.summary(),pulser.summary()],runlog)
+if(SPLITTER):
+    fs.close()
+comm.close()
+if(SAVEWAVES):
+    waves.close()
+runlog.close()
 plt.show(block=True)
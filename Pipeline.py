@@ -0,0 +1,84 @@
+import threading
+import queue
+
+#############################################################################################
+# Producer-consumer pipeline for the acquisition scripts.  One thread drives the instruments
+# and queues the raw blocks, a worker thread turns each block into integrals and charges and
+# appends them to the raw data file, and the main thread collects the results and redraws the
+# plots at its own rate.  Plotting and file I/O are therefore no longer part of the instrument
+# dead time.
+#
+#   produce(pipe) runs on the instrument thread and calls pipe.put(item) for every raw block.
+#   consume(item) runs on the worker thread and returns a list of results for the GUI.
+#
+# The raw blocks are views into the scope driver's ring buffer, so the queue depth must stay
+# below the number of ring slots.  A producer that reuses the same memory for every item
+# (FastFrame stacks) calls pipe.wait() before the next transfer.
+#############################################################################################
+
+class Pipeline:
+
+    def __init__(self, produce, consume, depth=16):
+        self.produce = produce
+        self.consume = consume
+        self.blocks = queue.Queue(depth)
+        self.out = queue.Queue()
+        self.error = None
+        self.acq = threading.Thread(target=self.run_produce, daemon=True)
+        self.work = threading.Thread(target=self.run_consume, daemon=True)
+
+    def start(self):
+        self.acq.start()
+        self.work.start()
+        return self
+
+    def put(self, item):
+        """Queue one raw block (blocks while the worker is depth blocks behind).  Once the
+        worker has failed this raises its error, which stops the producer."""
+        if(self.error is not None):
+            raise self.error
+        self.blocks.put(item)
+
+    def wait(self):
+        """Block until the worker has processed everything queued so far.  Raises the error
+        of a failed worker like put()."""
+        self.blocks.join()
+        if(self.error is not None):
+            raise self.error
+
+    def run_produce(self):
+        try:
+            self.produce(self)
+        except BaseException as e:
+            if(self.error is None):     # Keep the worker's error that stopped the producer
+                self.error = e
+        self.blocks.put(None)
+
+    def run_consume(self):
+        while(True):
+            item = self.blocks.get()
+            try:
+                if(item is None):
+                    break
+                if(self.error is None):
+                    for result in self.consume(item):
+                        self.out.put(result)
+            except BaseException as e:
+                if(self.error is None):
+                    self.error = e
+            finally:
+                self.blocks.task_done()
+
+    def alive(self):
+        """True while blocks are still being acquired, processed or waiting for the GUI."""
+        return self.acq.is_alive() or self.work.is_alive() or not self.out.empty()
+
+    def results(self):
+        """Return every result produced since the last call.  Re-raises a failure of either
+        thread in the caller."""
+        if(self.error is not None):
+            raise self.error
+        R = []
+        while(not self.out.empty()):
+            R.append(self.out.get())
+        return R
@@ -7,9 +7,61 @@ from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib import colors
 import os
 from time import sleep
+from Stats import read_record
 
 props = dict(boxstyle='round', facecolor='wheat', alpha=0.5)
 
+###############################################################################################
+# The data files are read by content: a line that starts with a letter begins a new section,
+# data lines are grouped by their amplitude index j, and the Stats records written after the
+# shots of every amplitude give the averages and spreads without reparsing the shots.  Files
+# from before the Stats records were added are averaged from their shot lines instead.
+###############################################################################################
+
+def read_raw(fname):
+    """Return the sections of a data file in order.  Each is a dict with the header line
+    ('' for data ahead of any header), the split data lines by j, the Stats records by
+    (quantity,j) as (pulser V, RunningStats) and, from an ADAPTIVE sweep, the amplitudes of
+    its fit ('fit')."""
+    sections = []
+    sec = None
+    with open(fname) as f:
+        for line in f:
+            line = line.strip()
+            if(line == ''):
+                continue
+            if(line.startswith('Stats,')):
+                q,j,V,st = read_record(line)
+                sec['stats'][(q,j)] = (V,st)
+            elif(line.startswith('Fit,')):
+                sec['fit'] = [int(z) for z in line.split(",")[1:] if z != '']
+            elif(line[0].isalpha()):
+                sec = {'name':line,'lines':{},'stats':{}}
+                sections.append(sec)
+            else:
+                if(sec is None):
+                    sec = {'name':'','lines':{},'stats':{}}
+                    sections.append(sec)
+                Z = line.split(",")
+                sec['lines'].setdefault(int(Z[0]),[]).append(Z)
+    return sections
+
+def scope_stats(sec, j):
+    """Pulser V, integral avg and std (nVS) and charge avg and std (nC) of amplitude j of a
+    test pulse section."""
+    if(('I',j) in sec['stats'] and ('Q',j) in sec['stats']):
+        V,I = sec['stats'][('I',j)]
+        V,Q = sec['stats'][('Q',j)]
+        return V, I.mean, I.std(), Q.mean, Q.std()
+    Z = [z for z in sec['lines'].get(j,[]) if len(z)==5]
+    if(len(Z)==0):
+        print("Error: no shots for amplitude "+str(j)+" in '"+sec['name']+"'")
+        exit()
+    V = [float(z[2]) for z in Z]
+    I = [float(z[3]) for z in Z]
+    Q = [float(z[4]) for z in Z]
+    return np.mean(V), np.mean(I), np.std(I), np.mean(Q), np.std(Q)
+
 ###############################################################################################
 # Setup Parameters for ACMI Calibration Report (Adjust these Parameters as Needed)
 ###############################################################################################
@@ -266,9 +318,7 @@ elements.append(PageBreak())
 ###############################################################################################
 #  Start Processing the Ratio Raw Data File
 ###############################################################################################
-with open(fratio) as f:
-    L = f.readlines()
-    L = [x.strip('\n') for x in L]
+S = read_raw(fratio)
 
 Ratio = []
 tdata = []
@@ -282,20 +332,12 @@ Vpulser = []
 Itest = []
 Qtest = []
 for i in range(0,18):
-    Qscope = []
-    Iscope = []
-    Vscope = []
-    for j in range(0,25):
-        Z = L[i*25 + j + 1].split(",")
-        if(len(Z)==5):
-            Vscope.append(float(Z[2]))
-            Iscope.append(float(Z[3]))
-            Qscope.append(float(Z[4]))
-    tdata.append([round(np.mean(Vscope),3),round(np.mean(Iscope),3),round(np.std(Iscope),4),round(np.mean(Qscope),3),round(np.std(Qscope),4)])
+    Vscope,Iavg,Istd,Qavg,Qstd = scope_stats(S[0],i)
+    tdata.append([round(Vscope,3),round(Iavg,3),round(Istd,4),round(Qavg,3),round(Qstd,4)])
     rowH.append(0.22*inch)
-    Vpulser.append(round(np.mean(Vscope),3))
-    Itest.append(round(np.mean(Iscope),3))
-    Qtest.append(round(np.mean(Qscope),3))
+    Vpulser.append(round(Vscope,3))
+    Itest.append(round(Iavg,3))
+    Qtest.append(round(Qavg,3))
 mess = "HP8114A Pulse Generator was setup to produce 50 nSec\n"
 mess +="wide pulses at the indicated voltages.  Pulses measured\n"
 mess +="directly by the MSO64B Scope with sample rate 3.125GS/S\n"
@@ -343,21 +385,10 @@ Qict = []
 Iict = []
 Vpul = []
 for i in range(0,18):
-    Qscope = []
-    Iscope = []
-    Vscope = []
-    for j in range(0,25):
-        Z = L[477 + i*25 + j].split(",")
-        if(len(Z)==5):
-            Vscope.append(float(Z[2]))
-            Iscope.append(float(Z[3]))
-            Qscope.append(float(Z[4]))
-        else:
-            print("Error")
-            exit()
-    Qict.append(round(np.mean(Qscope),3))
-    Iict.append(round(np.mean(Iscope),3))
-    tdata.append([round(np.mean(Vscope),3),round(np.mean(Iscope),3),round(np.std(Iscope),4),round(np.mean(Qscope),3),round(np.std(Qscope),4)])
+    Vscope,Iavg,Istd,Qavg,Qstd = scope_stats(S[1],i)
+    Qict.append(round(Qavg,3))
+    Iict.append(round(Iavg,3))
+    tdata.append([round(Vscope,3),round(Iavg,3),round(Istd,4),round(Qavg,3),round(Qstd,4)])
     rowH.append(0.22*inch)
 mess = "HP8114A Pulse Generator was setup to produce 50 nSec\n"
 mess +="wide pulses at the indicated voltages.  ICT Output Pulses\n"
@@ -500,9 +531,7 @@ print("Hello...2")
 ###########################################################################################
 # Start Processing the ACMI Calibration Raw Data File for Normal Beam
 ###########################################################################################
-with open(facmi) as f:
-    L = f.readlines()
-    L = [x.strip('\n') for x in L]
+S = read_raw(facmi)
 
 tdata = []
 rowH = []
@@ -515,21 +544,17 @@ Vpulser = []
 Itest = []
 Qtest = []
 for i in range(0,23):
-    Qscope = []
-    Iscope = []
-    Vscope = []
-    for j in range(0,25):
-        Z = L[i*25 + j + 1].split(",")
-        if(len(Z)==5):
-            Vscope.append(float(Z[2]))
-            Iscope.append(float(Z[3]))
-            Qscope.append(float(Z[4]))
-            #print(Z[2],float(Z[3]),float(Z[4]))
-    tdata.append([round(np.mean(Vscope),3),round(np.mean(Iscope),3),round(np.std(Iscope),4),round(np.mean(Qscope),3),round(np.std(Qscope),4)])
+    if(i not in S[0]['lines'] and ('Q',i) not in S[0]['stats']):
+        #Amplitude left out by an ADAPTIVE splitter sweep (see AmpScheduler.py)
+        tdata.append([(i+1),'-','-','-','-'])
+        rowH.append(0.22*inch)
+        continue
+    Vscope,Iavg,Istd,Qavg,Qstd = scope_stats(S[0],i)
+    tdata.append([round(Vscope,3),round(Iavg,3),round(Istd,4),round(Qavg,3),round(Qstd,4)])
     rowH.append(0.22*inch)
-    Vpulser.append(round(np.mean(Vscope),3))
-    Itest.append(round(np.mean(Iscope),3))
-    Qtest.append(round(np.mean(Qscope),3))
+    Vpulser.append(round(Vscope,3))
+    Itest.append(round(Iavg,3))
+    Qtest.append(round(Qavg,3))
 print("Hello...3")
 mess = "HP8114A Pulse Generator was setup to produce 50 nSec\n"
 mess +="wide pulses at the indicated voltages.  Pulses measured\n"
@@ -594,8 +619,7 @@ for i in range(0,23):
     STBAAn = []
     STBABn = []
     Vpulser.append(i+1)
-    for j in range(0,16):
-        Z = L[i*16 + j + 577].split(",")
+    for Z in S[1]['lines'].get(i,[]):
         if(len(Z)==9):
             Qn.append(float(Z[2]))
             BAn.append(float(Z[3]))
@@ -604,6 +628,13 @@ for i in range(0,23):
             STABBn.append(float(Z[6]))
             STBAAn.append(float(Z[7]))
             STBABn.append(float(Z[8]))
+    if(len(Qn)==0):
+        #Amplitude left out by an ADAPTIVE sweep (see AmpScheduler.py)
+        tdata.append([(i+1),'-','-','-','-','-','-','-'])
+        rowH.append(0.22*inch)
+        for X in (Qtest,BeamA,BeamB,STABA,STABB,STBAA,STBAB):
+            X.append(np.nan)
+        continue
     tdata.append([(i+1),round(np.mean(Qn),3),round(np.mean(BAn),1),round(np.mean(BBn),1),round(np.mean(STABAn),1),round(np.mean(STABBn),1),round(np.mean(STBAAn),1),round(np.mean(STBABn),1)])
     rowH.append(0.22*inch)
 
@@ -728,10 +759,11 @@ f = open(reportdir + "/Positive2.png",'rb')
 elements.append(Image(f,width=7*inch, height=4*inch))
 elements.append(PageBreak())
 
-Beam = np.subtract(BeamA[0:18],BeamB[0:18])
-STAB = np.subtract(STABA[0:18],STABB[0:18])
-STBA = np.subtract(STBAB[0:18],STBAA[0:18])
-Qtest = Qtest[0:18]
+M = [k for k in S[1].get('fit',range(0,18)) if not np.isnan(Qtest[k])]     #The measured amplitudes of the fit range (AmpScheduler's from an ADAPTIVE sweep)
+Beam = np.subtract(np.take(BeamA,M),np.take(BeamB,M))
+STAB = np.subtract(np.take(STABA,M),np.take(STABB,M))
+STBA = np.subtract(np.take(STBAB,M),np.take(STBAA,M))
+Qtest = list(np.take(Qtest,M))
 print("Hello...8")
 fr,ax = plt.subplots(1,1,figsize=(5,5))
 ax.plot(Beam,Qtest,'-o',linewidth=3,markersize=6,label='ADC Data')
@@ -742,7 +774,7 @@ pfit = np.polyfit(Beam,np.multiply(Qtest,1000),2)
 FitCoef = np.corrcoef(Beam,Qtest)
 Qcal = []
 Qerr = []
-for k in range(0,18):
+for k in range(0,len(M)):
     Qcal.append(pfit[2] + pfit[1]*Beam[k] + pfit[0]*Beam[k]*Beam[k])
     Qerr.append(1000.0*Qtest[k] - Qcal[k])
 Qcal = np.divide(Qcal,1000) #Convert from pC to nC
@@ -784,7 +816,7 @@ pfit = np.polyfit(STAB,np.multiply(Qtest,1000),2)
 FitCoef = np.corrcoef(STAB,Qtest)
 Qcal = []
 Qerr = []
-for k in range(0,18):
+for k in range(0,len(M)):
     Qcal.append(pfit[2] + pfit[1]*STAB[k] + pfit[0]*STAB[k]*STAB[k])
     Qerr.append(1000.0*Qtest[k] - Qcal[k])
 Qcal = np.divide(Qcal,1000) #Convert from pC to nC
@@ -816,7 +848,7 @@ pfit = np.polyfit(STBA,np.multiply(Qtest,1000),2)
 FitCoef = np.corrcoef(STBA,Qtest)
 Qcal = []
 Qerr = []
-for k in range(0,18):
+for k in range(0,len(M)):
     Qcal.append(pfit[2] + pfit[1]*STBA[k] + pfit[0]*STBA[k]*STBA[k])
     Qerr.append(1000.0*Qtest[k] - Qcal[k])
 Qcal = np.divide(Qcal,1000) #Convert from pC to nC
@@ -848,9 +880,7 @@ elements.append(PageBreak())
 ###########################################################################################
 # Start Processing the ACMI Calibration Raw Data File for Negative Beam Polarity
 ###########################################################################################
-with open(fnegative) as f:
-    L = f.readlines()
-    L = [x.strip('\n') for x in L]
+S = read_raw(fnegative)
 
 tdata = []
 rowH = []
@@ -863,20 +893,18 @@ Vpulser = []
 Itest = []
 Qtest = []
 for i in range(0,23):
-    Qscope = []
-    Iscope = []
-    Vscope = []
-    for j in range(0,25):
-        Z = L[i*25 + j + 1].split(",")
-        if(len(Z)==5):
-            Vscope.append(-float(Z[2]))
-            Iscope.append(float(Z[3]))
-            Qscope.append(float(Z[4]))
-    tdata.append([round(np.mean(Vscope),3),round(np.mean(Iscope),3),round(np.std(Iscope),4),round(np.mean(Qscope),3),round(np.std(Qscope),4)])
+    if(i not in S[0]['lines'] and ('Q',i) not in S[0]['stats']):
+        #Amplitude left out by an ADAPTIVE splitter sweep (see AmpScheduler.py)
+        tdata.append([-(i+1),'-','-','-','-'])
+        rowH.append(0.22*inch)
+        continue
+    Vscope,Iavg,Istd,Qavg,Qstd = scope_stats(S[0],i)
+    Vscope = -Vscope
+    tdata.append([round(Vscope,3),round(Iavg,3),round(Istd,4),round(Qavg,3),round(Qstd,4)])
     rowH.append(0.22*inch)
-    Vpulser.append(round(np.mean(Vscope),3))
-    Itest.append(round(np.mean(Iscope),3))
-    Qtest.append(round(np.mean(Qscope),3))
+    Vpulser.append(round(Vscope,3))
+    Itest.append(round(Iavg,3))
+    Qtest.append(round(Qavg,3))
 
 mess = "HP8114A Pulse Generator was setup to produce 50 nSec\n"
 mess +="wide pulses at the indicated voltages.  Pulses measured\n"
@@ -941,8 +969,7 @@ for i in range(0,23):
     STBAAn = []
     STBABn = []
     Vpulser.append(-(i+1))
-    for j in range(0,16):
-        Z = L[i*16 + j + 577].split(",")
+    for Z in S[1]['lines'].get(i,[]):
         if(len(Z)==9):
             Qn.append(float(Z[2]))
             BAn.append(float(Z[3]))
@@ -951,6 +978,13 @@ for i in range(0,23):
             STABBn.append(float(Z[6]))
             STBAAn.append(float(Z[7]))
             STBABn.append(float(Z[8]))
+    if(len(Qn)==0):
+        #Amplitude left out by an ADAPTIVE sweep (see AmpScheduler.py)
+        tdata.append([-(i+1),'-','-','-','-','-','-','-'])
+        rowH.append(0.22*inch)
+        for X in (Qtest,BeamA,BeamB,STABA,STABB,STBAA,STBAB):
+            X.append(np.nan)
+        continue
     tdata.append([-(i+1),round(np.mean(Qn),3),round(np.mean(BAn),1),round(np.mean(BBn),1),round(np.mean(STABAn),1),round(np.mean(STABBn),1),round(np.mean(STBAAn),1),round(np.mean(STBABn),1)])
     rowH.append(0.22*inch)
 
@@ -1073,10 +1107,11 @@ plt.savefig(reportdir + "/Negative2.png")
 elements.append(Image(reportdir + "/Negative2.png",width=7*inch, height=4*inch))
 elements.append(PageBreak())
 
-Beam = np.subtract(BeamA[0:18],BeamB[0:18])
-STAB = np.subtract(STABA[0:18],STABB[0:18])
-STBA = np.subtract(STBAB[0:18],STBAA[0:18])
-Qtest = Qtest[0:18]
+M = [k for k in S[1].get('fit',range(0,18)) if not np.isnan(Qtest[k])]     #The measured amplitudes of the fit range (AmpScheduler's from an ADAPTIVE sweep)
+Beam = np.subtract(np.take(BeamA,M),np.take(BeamB,M))
+STAB = np.subtract(np.take(STABA,M),np.take(STABB,M))
+STBA = np.subtract(np.take(STBAB,M),np.take(STBAA,M))
+Qtest = list(np.take(Qtest,M))
 
 fr,ax = plt.subplots(1,1,figsize=(5,5))
 ax.plot(Beam,Qtest,'-o',linewidth=3,markersize=6,label='ADC Data')
@@ -1087,7 +1122,7 @@ pfit = np.polyfit(Beam,np.multiply(Qtest,1000),2)
 FitCoef = np.corrcoef(Beam,Qtest)
 Qcal = []
 Qerr = []
-for k in range(0,18):
+for k in range(0,len(M)):
     Qcal.append(pfit[2] + pfit[1]*Beam[k] + pfit[0]*Beam[k]*Beam[k])
     Qerr.append(1000.0*Qtest[k] - Qcal[k])
 Qcal = np.divide(Qcal,1000) #Convert from pC to nC
@@ -1123,7 +1158,7 @@ pfit = np.polyfit(STAB,np.multiply(Qtest,1000),2)
 FitCoef = np.corrcoef(STAB,Qtest)
 Qcal = []
 Qerr = []
-for k in range(0,18):
+for k in range(0,len(M)):
     Qcal.append(pfit[2] + pfit[1]*STAB[k] + pfit[0]*STAB[k]*STAB[k])
     Qerr.append(1000.0*Qtest[k] - Qcal[k])
 Qcal = np.divide(Qcal,1000) #Convert from pC to nC
@@ -1155,7 +1190,7 @@ pfit = np.polyfit(STBA,np.multiply(Qtest,1000),2)
 FitCoef = np.corrcoef(STBA,Qtest)
 Qcal = []
 Qerr = []
-for k in range(0,18):
+for k in range(0,len(M)):
     Qcal.append(pfit[2] + pfit[1]*STBA[k] + pfit[0]*STBA[k]*STBA[k])
     Qerr.append(1000.0*Qtest[k] - Qcal[k])
 Qcal = np.divide(Qcal,1000) #Convert from pC to nC
@@ -1188,9 +1223,7 @@ elements.append(PageBreak())
 ###########################################################################################
 # Start Processing the ACMI Verification Data File for Normal Beam Polarity
 ###########################################################################################
-with open(fverify) as f:
-    L = f.readlines()
-    L = [x.strip('\n') for x in L]
+S = read_raw(fverify)
 
 tdata = []
 rowH = []
@@ -1203,20 +1236,12 @@ Vpulser = []
 Itest = []
 Qtest = []
 for i in range(0,23):
-    Qscope = []
-    Iscope = []
-    Vscope = []
-    for j in range(0,25):
-        Z = L[i*25 + j].split(",")
-        if(len(Z)==5):
-            Vscope.append(float(Z[2]))
-            Iscope.append(float(Z[3]))
-            Qscope.append(float(Z[4]))
-    tdata.append([round(np.mean(Vscope),3),round(np.mean(Iscope),3),round(np.std(Iscope),4),round(np.mean(Qscope),3),round(np.std(Qscope),4)])
+    Vscope,Iavg,Istd,Qavg,Qstd = scope_stats(S[0],i)
+    tdata.append([round(Vscope,3),round(Iavg,3),round(Istd,4),round(Qavg,3),round(Qstd,4)])
     rowH.append(0.22*inch)
-    Vpulser.append(round(np.mean(Vscope),3))
-    Itest.append(round(np.mean(Iscope),3))
-    Qtest.append(round(np.mean(Qscope),3))
+    Vpulser.append(round(Vscope,3))
+    Itest.append(round(Iavg,3))
+    Qtest.append(round(Qavg,3))
 
 mess = "HP8114A Pulse Generator was setup to produce 50 nSec\n"
 mess +="wide pulses at the indicated voltages.  Pulses measured\n"
@@ -1267,14 +1292,14 @@ Beam = []
 STAB = []
 STBA = []
 for i in range(0,23):
-    Z = L[i+575].split(",")
-    if(len(Z)==6):
-        Vpulser.append(float(Z[1]))
-        Qtest.append(float(Z[2]))
-        Beam.append(float(Z[3]))
-        STAB.append(float(Z[4]))
-        STBA.append(float(Z[5]))
-        tdata.append([Vpulser[i],Qtest[i],Beam[i],STAB[i],STBA[i]])
+    for Z in S[0]['lines'].get(i,[]):
+        if(len(Z)==6):     #The summary line, not the test pulse shots of the same amplitude
+            Vpulser.append(float(Z[1]))
+            Qtest.append(float(Z[2]))
+            Beam.append(float(Z[3]))
+            STAB.append(float(Z[4]))
+            STBA.append(float(Z[5]))
+            tdata.append([Vpulser[i],Qtest[i],Beam[i],STAB[i],STBA[i]])
     rowH.append(0.22*inch)
 
 mess = "HP8114A Pulse Generator was setup to produce 50 nSec\n"
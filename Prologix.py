@@ -0,0 +1,207 @@
+import asyncio
+import socket
+import threading
+from collections import deque
+from time import perf_counter
+
+#############################################################################################
+# Driver for an instrument behind a Prologix GPIB-Ethernet controller (TCP port 1234), used
+# for the HP8114A pulser.  The controller is put in controller mode with ++auto 0, so nothing
+# is read back unless asked for, and ++eoi 1 so every message ends with EOI.  A write is
+# followed by *OPC? and '++read eoi', so it returns as soon as the instrument has executed the
+# command instead of after a fixed sleep.  The time every command takes is recorded per
+# command header and reported by summary().  batch() sends a list of setting commands as one
+# semicolon separated program message and checks all of them with a single SYST:ERR?;*OPC?
+# round trip.
+#
+# AsyncPrologix is the asyncio stream client.  Every request is queued with a future that the
+# receive task completes from the replies, which the controller sends back in order, so
+# requests from several coroutines are pipelined on the one connection.  A request that times
+# out may still get its reply later, so the client then sends ++ver and drops every line up
+# to the controller's version string, which puts the replies back in step.  Prologix is the
+# blocking facade used by the scripts: it runs AsyncPrologix on an event loop in a background
+# thread (or on a loop passed in), so other coroutines can share that loop with the pulser.
+#############################################################################################
+
+class PrologixError(Exception):
+    """The instrument did not acknowledge a command."""
+    pass
+
+class AsyncPrologix:
+
+    def __init__(self, host, addr, port=1234, timeout=7.0, opc=True):
+        self.host = host
+        self.addr = addr
+        self.port = port
+        self.timeout = timeout      # Sec to wait for a connection or a reply
+        self.opc = opc              # Wait for *OPC? after every write
+        self.reader = None
+        self.writer = None
+        self.pending = deque()      # Futures of the requests still waiting for a reply, in order
+        self.syncs = 0              # ++ver replies still to come after timeouts
+        self.dropped = 0            # Late replies dropped after timeouts
+        self.error = None
+        self.latency = {}           # Command header -> list of Sec per command
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host,self.port), self.timeout)
+        self.writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.task = asyncio.get_running_loop().create_task(self.receive())
+        self.send('++mode 1')       # Controller mode
+        self.send('++addr '+str(self.addr))
+        self.send('++auto 0')       # Only read back on ++read
+        self.send('++eoi 1')        # Assert EOI with the last byte of every command
+        self.send('++eos 2')        # Terminate commands to the instrument with LF
+        self.send('++read_tmo_ms '+str(int(min(self.timeout,3.0)*1000)))
+        await self.writer.drain()
+        return self
+
+    def send(self, line):
+        self.writer.write((line.rstrip('\r\n')+'\n').encode('ascii'))
+
+    async def receive(self):
+        """Hand every reply line to the oldest waiting request.  After a timeout the lines
+        before the reply to ++ver are late replies of requests that gave up, and are dropped."""
+        try:
+            while(True):
+                line = await self.reader.readline()
+                if(not line):
+                    raise ConnectionError('Prologix at '+self.host+' closed the connection')
+                line = line.decode('ascii').strip()
+                if(self.syncs > 0):
+                    if(line.startswith('Prologix')):
+                        self.syncs -= 1
+                    else:
+                        self.dropped += 1
+                    continue
+                if(len(self.pending) > 0):
+                    fut = self.pending.popleft()
+                    if(not fut.done()):
+                        fut.set_result(line)
+        except Exception as e:
+            self.error = e
+            while(len(self.pending) > 0):
+                fut = self.pending.popleft()
+                if(not fut.done()):
+                    fut.set_exception(e)
+
+    async def request(self, cmd=None):
+        """Send cmd (if any) and '++read eoi', and return the reply.  A request that times out
+        fails the requests still waiting with it, whose replies can no longer be told from a
+        late one, and resynchronises the replies with ++ver."""
+        if(self.error is not None):
+            raise self.error
+        fut = asyncio.get_running_loop().create_future()
+        self.pending.append(fut)
+        if(cmd is not None):
+            self.send(cmd.strip())
+        self.send('++read eoi')
+        await self.writer.drain()
+        try:
+            return await asyncio.wait_for(asyncio.shield(fut), self.timeout)
+        except asyncio.TimeoutError:
+            fut.cancel()
+            self.resync(str(cmd))
+            await self.writer.drain()
+            raise PrologixError(str(cmd)+': no reply within '+str(self.timeout)+' Sec')
+
+    def resync(self, cmd):
+        """Drop the waiting requests and ask for the version string, whose reply ends the
+        lines that still belong to them."""
+        self.syncs += 1
+        self.send('++ver')
+        while(len(self.pending) > 0):
+            fut = self.pending.popleft()
+            if(not fut.done()):
+                fut.set_exception(PrologixError('reply lost when '+cmd+' timed out'))
+
+    def record(self, cmd, t0):
+        header = cmd.strip().split(' ')[0]
+        self.latency.setdefault(header, []).append(perf_counter()-t0)
+
+    async def write(self, cmd):
+        """Send a command and, with opc set, wait until the instrument has executed it."""
+        t0 = perf_counter()
+        cmd = cmd.strip()
+        if(self.opc):
+            reply = await self.request(cmd+';*OPC?')
+            if(reply != '1'):
+                raise PrologixError(cmd+': *OPC? returned '+repr(reply))
+        else:
+            self.send(cmd)
+            await self.writer.drain()
+        self.record(cmd, t0)
+
+    async def batch(self, cmds):
+        """Send setting commands as one program message, e.g. [':SOUR:VOLT 0.0',':OUTP:POL NEG'],
+        and raise PrologixError if the instrument reports an error for any of them."""
+        msg = []
+        for cmd in cmds:
+            cmd = cmd.strip()
+            if(cmd.endswith('?')):
+                raise ValueError('Queries cannot be batched: '+cmd)
+            if(not cmd.startswith((':','*'))):
+                cmd = ':'+cmd       # Absolute header, so the previous command does not change its path
+            msg.append(cmd)
+        t0 = perf_counter()
+        reply = await self.request(';'.join(msg)+';:SYST:ERR?;*OPC?')
+        err, _, done = reply.rpartition(';')
+        self.record('batch', t0)
+        if(done != '1' or err.split(',')[0].strip().lstrip('+') != '0'):
+            raise PrologixError(';'.join(msg)+': '+reply)
+
+    async def read(self):
+        """Read one response from the instrument (up to EOI)."""
+        return await self.request()
+
+    async def query(self, cmd):
+        t0 = perf_counter()
+        reply = await self.request(cmd)
+        self.record(cmd, t0)
+        return reply
+
+    def summary(self):
+        mess = 'GPIB '+str(self.addr)+' at '+self.host+':'
+        for header in sorted(self.latency):
+            t = self.latency[header]
+            mess += '\n  '+header+': '+str(len(t))+' cmds, '+str(round(1000*sum(t)/len(t),1))+' mSec avg, '+str(round(1000*max(t),1))+' mSec max'
+        if(self.dropped > 0):
+            mess += '\n  '+str(self.dropped)+' late replies dropped'
+        return mess
+
+    async def close(self):
+        self.task.cancel()
+        self.writer.close()
+
+class Prologix:
+    """Blocking facade over AsyncPrologix for the scripts.  Do not call it from a coroutine
+    running on its own loop; await the aio client there instead."""
+
+    def __init__(self, host, addr, port=1234, timeout=7.0, opc=True, loop=None):
+        if(loop is None):
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, daemon=True).start()
+        self.loop = loop
+        self.aio = AsyncPrologix(host, addr, port, timeout, opc)
+        self.call(self.aio.connect())
+
+    def call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def write(self, cmd):
+        self.call(self.aio.write(cmd))
+
+    def batch(self, cmds):
+        self.call(self.aio.batch(cmds))
+
+    def read(self):
+        return self.call(self.aio.read())
+
+    def query(self, cmd):
+        return self.call(self.aio.query(cmd))
+
+    def summary(self):
+        return self.aio.summary()
+
+    def close(self):
+        self.call(self.aio.close())
@@ -0,0 +1,57 @@
+from time import sleep, strftime
+
+#############################################################################################
+# Bounded retry with capped exponential backoff for the instrument I/O.  Each failure is
+# classified by the instrument driver (e.g. 'timeout', 'io', 'short_block'); unclassified
+# exceptions are not retried.  Every retry is counted per class and written to the run log,
+# so a lost trigger shows up as a handful of logged timeouts and then a clear error instead
+# of a silent hot loop.
+#############################################################################################
+
+class RetryPolicy:
+
+    def __init__(self, classify, recover=None, attempts=10, base=0.05, cap=2.0, name='', log=None):
+        self.classify = classify    # Exception -> error class name, or None to re-raise
+        self.recover = recover      # Called as recover(kind, attempt) before the next try
+        self.attempts = attempts
+        self.base = base            # First backoff delay in Sec, doubled on every retry
+        self.cap = cap              # Longest backoff delay in Sec
+        self.name = name
+        self.log = log              # Open run log file (or None to only print)
+        self.counts = {}            # Error class -> number of retries
+        self.calls = 0
+        self.failed = 0
+
+    def write(self, mess):
+        mess = strftime('%H:%M:%S')+' '+self.name+': '+mess
+        print(mess)
+        if(self.log is not None):
+            self.log.write(mess+'\n')
+            self.log.flush()
+
+    def run(self, fn):
+        """Call fn() until it succeeds, retrying classified errors at most attempts times."""
+        self.calls += 1
+        for attempt in range(0,self.attempts):
+            try:
+                return fn()
+            except Exception as e:
+                kind = self.classify(e)
+                if(kind is None):
+                    raise
+                self.counts[kind] = self.counts.get(kind,0) + 1
+                if(attempt == self.attempts-1):
+                    self.failed += 1
+                    self.write('giving up after '+str(self.attempts)+' attempts ('+kind+': '+str(e)+')')
+                    raise
+                delay = min(self.cap, self.base*2**attempt)
+                self.write(kind+' on attempt '+str(attempt+1)+', retrying in '+str(round(delay,3))+' Sec ('+str(e)+')')
+                sleep(delay)
+                if(self.recover is not None):
+                    self.recover(kind, attempt)
+
+    def summary(self):
+        mess = str(self.calls)+' calls, '+str(sum(self.counts.values()))+' retries'
+        for kind in sorted(self.counts):
+            mess += ', '+kind+': '+str(self.counts[kind])
+        return mess+', '+str(self.failed)+' failed'
@@ -0,0 +1,430 @@
+import numpy as np
+from time import sleep, perf_counter
+import pyvisa as visa
+from Retry import RetryPolicy
+from Integrate import gate
+
+#############################################################################################
+# Shared driver for the Tektronix MSO64B used by PosACMI.py, NegACMI.py, VerifyACMI.py and
+# ICTRatio.py.  The driver remembers every setting it has sent to the scope and only sends
+# a command again when the value really changes, so the transfer setup (DATA:SOU, DATA:START,
+# DATA:STOP, DATA:WIDTH, DATA:ENC, WFMOUTPRE:BYT_NR), CH1:SCALE and the trigger level go out
+# once per sweep or amplitude instead of once per shot.  The waveform preamble is fetched in
+# a single WFMOUTPRE? query and kept until a setting that changes it (vertical scale, record
+# length, transfer setup) is sent.
+#
+# The scope can be opened over VXI-11 ('TCPIP0::host::inst0::INSTR') or over the raw socket
+# server ('TCPIP0::host::4000::SOCKET').  Run this file with the scope address to compare the
+# query latency and CURVE? throughput of both on the local network.
+#############################################################################################
+
+# Field order of the WFMOUTPRE? response with HEADER OFF (MSO 4/5/6 Series)
+PREAMBLE_FIELDS = ['BYT_NR','BIT_NR','ENCDG','BN_FMT','BYT_OR','WFID','NR_PT','PT_FMT','PT_ORDER',
+                   'XUNIT','XINCR','XZERO','PT_OFF','YUNIT','YMULT','YOFF','YZERO']
+
+# Settings that change the waveform scaling in the preamble when they are sent.  DATA:START and
+# DATA:STOP only move the transfer window and leave YMULT/YOFF/YZERO/XINCR alone.
+PREAMBLE_KEYS = ('CH1:SCALE','CH1:POS','CH1:OFFSET','HOR','DATA:SOU','DATA:WIDTH','DATA:ENC','WFMOUTPRE:')
+
+def preamble_name(token):
+    """Full PREAMBLE_FIELDS name of a header token (':WFMOUTPRE:YMULT', 'YMU', ...), None when
+    the token is not a preamble field."""
+    name = token.split(':')[-1].upper()
+    if(name in PREAMBLE_FIELDS):
+        return name
+    match = [f for f in PREAMBLE_FIELDS if f.startswith(name)] if len(name) > 0 else []
+    return match[0] if len(match) == 1 else None
+
+def parse_preamble(text):
+    """Parse a WFMOUTPRE? response into a dict.  With HEADER OFF the fields are taken in the
+    order of PREAMBLE_FIELDS.  With HEADER ON every field is 'NAME value' (long or short form
+    names) and is split at the name before its value is converted."""
+    fields = []
+    field = ''
+    quoted = False
+    for c in text.strip():
+        if(c == '"'):
+            quoted = not quoted
+        if(c == ';' and not quoted):
+            fields.append(field.strip())
+            field = ''
+        else:
+            field += c
+    fields.append(field.strip())
+
+    first = fields[0].split(None, 1)
+    headers = fields[0].startswith(':') or (len(first) == 2 and preamble_name(first[0]) is not None)
+    pre = {}
+    for i in range(0,len(fields)):
+        if(headers):
+            Z = fields[i].split(None, 1)
+            if(len(Z) < 2):
+                continue
+            name = preamble_name(Z[0]) or Z[0].split(':')[-1].upper()
+            value = Z[1]
+        elif(i < len(PREAMBLE_FIELDS)):
+            name,value = PREAMBLE_FIELDS[i],fields[i]
+        else:
+            continue
+        pre[name] = value.strip().strip('"')
+    return {'ymult':float(pre['YMULT']),'yzero':float(pre['YZERO']),'yoff':float(pre['YOFF']),
+            'xincr':float(pre['XINCR'])}
+
+def locate(V, baseline=50, pad=250, frac=0.1):
+    """Find the pulse in a full record shot with the same gate() the integration uses.
+    Returns the (first,last) indices of a window that starts with baseline samples ahead of
+    the pulse and keeps pad samples on either side of it (the whole record if it is flat)."""
+    lo,hi = gate(np.atleast_2d(V - np.mean(V[0:baseline])), frac, pad)
+    return max(0, lo - baseline), hi
+
+class WaveBuffer:
+    """Preallocated shots x samples ring of raw '>i2' ADC codes and the same samples in Volts.
+    Blocks are copied once from the received bytes into a slot of the ring and scaled in
+    place, so an amplitude step does not allocate any waveform arrays."""
+
+    def __init__(self, shots=25, samples=5000):
+        self.raw = np.zeros((shots,samples), dtype='>i2')
+        self.volts = np.zeros((shots,samples))
+        self.first = np.zeros(samples, dtype='>i2')   # Scratch for a full record used to locate the pulse
+        self.shots = shots
+        self.samples = samples
+        self.next = 0
+
+    def slot(self):
+        """Return the raw and Volts rows of the next slot in the ring."""
+        k = self.next % self.shots
+        self.next += 1
+        return self.raw[k], self.volts[k]
+
+    def stack(self, count, samples):
+        """Return count x samples raw and Volts views over the start of the ring."""
+        n = count*samples
+        return self.raw.reshape(-1)[0:n].reshape(count,samples), self.volts.reshape(-1)[0:n].reshape(count,samples)
+
+class BlockError(Exception):
+    """A CURVE? response that is not a complete definite length block."""
+    pass
+
+def classify(e):
+    """Retry class of an exception raised while talking to the scope (None: do not retry)."""
+    if(isinstance(e, visa.errors.VisaIOError)):
+        if(e.error_code == visa.constants.StatusCode.error_timeout):
+            return 'timeout'
+        return 'io'
+    if(isinstance(e, BlockError)):
+        return 'short_block'
+    if(isinstance(e, OSError)):
+        return 'io'
+    return None
+
+def scale(raw, volts, pre):
+    """Convert ADC codes to Volts in place: volts = (raw - yoff)*ymult + yzero."""
+    np.multiply(raw, pre['ymult'], out=volts)
+    volts += pre['yzero'] - pre['yoff']*pre['ymult']
+    return volts
+
+class MSO64B:
+
+    def __init__(self, resource, rm=None, shots=25, samples=5000, completion='poll', poll=0.002):
+        if(rm is None):
+            rm = visa.ResourceManager()
+        self.rm = rm
+        self.resource = resource
+        self.socket = resource.upper().endswith('::SOCKET')
+        if(self.socket and completion == 'srq'):
+            completion = 'esr'      # No service requests over a raw socket
+        self.inst = self.open()
+        self.state = {}     # Settings currently in effect on the scope: header -> value
+        self.sent = 0       # Number of setting commands actually sent
+        self.skipped = 0    # Number of setting commands skipped because nothing changed
+        self.pre = None     # Cached waveform preamble
+        self.buf = WaveBuffer(shots, samples)
+        self.completion = completion  # 'poll' (ACQUIRE:STATE?), 'esr' (*OPC + *ESR?), 'srq' or 'opc' (*WAI + *OPC?)
+        self.poll = poll              # Seconds between completion polls
+        self.waits = []               # Seconds each acquisition waited for its trigger(s)
+        self.retry = RetryPolicy(classify, self.recover, name='MSO64B')
+        self.set('HEADER', 'OFF')     # Bare responses, which parse_preamble takes by position
+
+    def open(self):
+        """Open the VISA session.  A raw socket has no message framing, so both termination
+        characters are set to newline.  A large chunk size lets a CURVE? block arrive in one
+        read on either transport."""
+        inst = self.rm.open_resource(self.resource)
+        if(self.socket):
+            inst.read_termination = '\n'
+            inst.write_termination = '\n'
+        inst.chunk_size = 1024*1024
+        return inst
+
+    def recover(self, kind, attempt):
+        """Get the session back into a known state before the next retry.  A timeout or a
+        short block leaves unread output behind, which a device clear discards.  An I/O
+        error, or a clear that did not help, closes and reopens the VISA session.  A raw
+        socket has no device clear, so it is always reopened."""
+        if(kind == 'io' or attempt >= 2 or self.socket):
+            timeout = self.inst.timeout
+            try:
+                self.inst.close()
+            except Exception:
+                pass
+            self.inst = self.open()
+            self.inst.timeout = timeout
+            self.retry.write('reconnected to '+self.resource)
+        if(not self.socket):
+            self.inst.clear()
+        self.pre = None
+
+    def write(self, cmd):
+        self.inst.write(cmd)
+
+    def query(self, cmd):
+        return self.inst.query(cmd)
+
+    def read_raw(self):
+        return self.inst.read_raw()
+
+    def set(self, header, value):
+        """Send 'header value' only if the scope is not already at that value."""
+        value = str(value)
+        if(self.state.get(header) == value):
+            self.skipped += 1
+            return False
+        self.inst.write(header + ' ' + value)
+        self.state[header] = value
+        self.sent += 1
+        if(header.startswith(PREAMBLE_KEYS)):
+            self.pre = None
+        return True
+
+    def invalidate(self, header=None):
+        """Forget what is on the scope (after *RST or a front panel change)."""
+        if(header is None):
+            self.state.clear()
+        else:
+            self.state.pop(header, None)
+        self.pre = None
+
+    def preamble(self):
+        """Return the waveform preamble, querying the scope only when the cache is stale."""
+        if(self.pre is None):
+            self.pre = parse_preamble(self.inst.query('WFMOUTPRE?'))
+        return self.pre
+
+    def transfer(self, source='CH1', start=0, stop=5000, width=2, enc='RIB'):
+        self.set('DATA:SOU', source)
+        self.set('DATA:START', start)
+        self.set('DATA:STOP', stop)
+        self.set('DATA:WIDTH', width)
+        self.set('DATA:ENC', enc)
+        self.set('WFMOUTPRE:BYT_NR', width)
+
+    def window(self, first, last, source='CH1'):
+        """Transfer only record samples first..last-1 (DATA:START/STOP count from 1)."""
+        self.transfer(source, first+1, last)
+
+    def acquire(self):
+        """Arm a single sequence acquisition and wait for it to complete.  The time spent
+        waiting for the trigger is appended to self.waits."""
+        self.set('ACQUIRE:STOPAFTER', 'SEQUENCE')
+        limit = self.inst.timeout/1000.0
+        t0 = perf_counter()
+        if(self.completion == 'srq'):
+            # Operation complete sets ESB in the status byte, which raises SRQ
+            self.set('*ESE', 1)
+            self.set('*SRE', 32)
+            self.inst.write('*CLS')
+            self.inst.write('ACQUIRE:STATE 1;*OPC')
+            self.inst.wait_for_srq(self.inst.timeout)
+            self.inst.query('*ESR?')
+        elif(self.completion == 'esr'):
+            self.set('*ESE', 1)
+            self.inst.write('*CLS')
+            self.inst.write('ACQUIRE:STATE 1;*OPC')
+            while((int(self.inst.query('*ESR?')) & 1) == 0):
+                if(perf_counter()-t0 > limit):
+                    raise visa.errors.VisaIOError(visa.constants.StatusCode.error_timeout)
+                sleep(self.poll)
+        elif(self.completion == 'poll'):
+            self.inst.write('ACQUIRE:STATE 1')
+            while(int(self.inst.query('ACQUIRE:STATE?')) != 0):
+                if(perf_counter()-t0 > limit):
+                    raise visa.errors.VisaIOError(visa.constants.StatusCode.error_timeout)
+                sleep(self.poll)
+        else:
+            self.inst.write('ACQUIRE:STATE 1')
+            self.inst.write('*WAI')
+            self.inst.query('*OPC?')
+        self.waits.append(perf_counter()-t0)
+
+    def read_block(self, out):
+        """Read an IEEE-488.2 definite length block of '>i2' samples into out.  Returns the
+        number of samples received.  Over VXI-11 the whole block, header included, arrives in
+        one read_raw() (a single device read with the 1 MB chunk size).  A raw socket has no
+        END to stop at and its termination character may occur in the data, so there the
+        header and then the payload with its newline are read with read_bytes().  The header
+        is parsed in the received bytes and the samples are copied once, from there into out."""
+        if(self.socket):
+            head = self.inst.read_bytes(2)
+            digits = self.inst.read_bytes(int(head[1:2])) if head[1:2].isdigit() else b''
+            nbytes = self.block_length(head, digits)
+            self.block_fits(nbytes, out)
+            data = memoryview(self.inst.read_bytes(nbytes+1))
+            start = 0
+        else:
+            data = memoryview(self.inst.read_raw())
+            head = bytes(data[0:2])
+            nd = int(head[1:2]) if head[1:2].isdigit() else 0
+            nbytes = self.block_length(head, bytes(data[2:2+nd]))
+            self.block_fits(nbytes, out)
+            start = 2+nd
+        if(len(data)-start < nbytes):
+            raise BlockError('Short block: '+str(len(data)-start)+' of '+str(nbytes)+' bytes')
+        out.view(np.uint8)[0:nbytes] = np.frombuffer(data, dtype=np.uint8, count=nbytes, offset=start)
+        return nbytes//2
+
+    def block_length(self, head, digits):
+        """Payload length of a block from its '#n' header and the n length digits."""
+        if(head[0:1] != b'#' or not head[1:2].isdigit()):
+            raise BlockError('Bad block header '+repr(head))
+        try:
+            return int(digits)
+        except ValueError:
+            raise BlockError('Bad block length in header')
+
+    def block_fits(self, nbytes, out):
+        if(nbytes > out.nbytes):
+            raise ValueError('Block of '+str(nbytes)+' bytes does not fit the waveform buffer')
+
+    def curve(self, out):
+        """Transfer the current waveform into out.  Returns the filled part and the preamble."""
+        pre = self.preamble()
+        self.inst.write('CURVE?')
+        n = self.read_block(out)
+        return out[0:n], pre
+
+    def waveform(self):
+        """Acquire one shot into the next slot of the ring buffer.  Returns a view of the
+        waveform in Volts and the sample spacing."""
+        self.set('HORIZONTAL:FASTFRAME:STATE', 'OFF')
+        raw, volts = self.buf.slot()
+
+        def shot():
+            self.acquire()
+            return self.curve(raw)
+
+        raw, pre = self.retry.run(shot)
+        return scale(raw, volts[0:len(raw)], pre), pre['xincr']
+
+    def frames(self, count, record=None):
+        """Capture count triggers in one FastFrame acquisition and transfer them in one block.
+        Returns a count x samples view of the ring buffer in Volts and the sample spacing.
+        When the record length is given, frame 1 is transferred in full to locate the pulse
+        and frames 2..count are transferred over the pulse window only."""
+        self.set('HORIZONTAL:FASTFRAME:STATE', 'ON')
+        self.set('HORIZONTAL:FASTFRAME:COUNT', count)
+        source = self.state.get('DATA:SOU','CH1')
+
+        def stack():
+            if(record is None):
+                self.set('DATA:FRAMESTART', 1)
+                self.set('DATA:FRAMESTOP', count)
+                self.acquire()
+                flat, pre = self.curve(self.buf.raw.reshape(-1))
+                raw, volts = self.buf.stack(count, len(flat)//count)
+            else:
+                self.window(0, record, source)
+                self.set('DATA:FRAMESTART', 1)
+                self.set('DATA:FRAMESTOP', 1)
+                self.acquire()
+                first, pre = self.curve(self.buf.first)
+                lo,hi = locate(scale(first, self.buf.volts[0,0:len(first)], pre))
+                self.window(lo, hi, source)
+                self.set('DATA:FRAMESTART', 2)
+                self.set('DATA:FRAMESTOP', count)
+                raw, volts = self.buf.stack(count, hi-lo)
+                self.curve(raw[1:].reshape(-1))
+                raw[0] = first[lo:hi]
+            return raw, volts, pre
+
+        raw, volts, pre = self.retry.run(stack)
+        return scale(raw, volts, pre), pre['xincr']
+
+    def area_setup(self, start, stop, source='CH1', meas=1):
+        """Set up a scope-side AREA measurement gated from start to stop (Sec from the trigger)."""
+        m = 'MEASUREMENT:MEAS'+str(meas)
+        self.set(m+':TYPE', 'AREA')
+        self.set(m+':SOURCE1', source)
+        self.set(m+':GATING', 'TIME')
+        self.set(m+':GATING:STARTTIME', start)
+        self.set(m+':GATING:ENDTIME', stop)
+
+    def area(self, meas=1):
+        """Acquire one shot and read back only its scope-side AREA (in V*Sec), e.g. to see when
+        the pulser output has settled without a CURVE? transfer."""
+        m = 'MEASUREMENT:MEAS'+str(meas)
+        self.set('HORIZONTAL:FASTFRAME:STATE', 'OFF')
+
+        def shot():
+            self.acquire()
+            return float(self.inst.query(m+':RESULTS:CURRENTACQ:MEAN?'))
+
+        return self.retry.run(shot)
+
+    def areas(self, count, curves=False, meas=1):
+        """Acquire count shots and read back only the scope-side AREA of each one (in V*Sec).
+        Returns the per-shot areas, the scope's mean and standard deviation over them, and
+        the count x samples waveforms in Volts when curves is set (None otherwise)."""
+        m = 'MEASUREMENT:MEAS'+str(meas)
+        self.set('HORIZONTAL:FASTFRAME:STATE', 'OFF')
+        A = np.zeros(count)
+
+        # A retry starts the count shots again, so that the ALLACQS statistics hold each
+        # shot once and not the shots of the failed attempt as well
+        def shots():
+            self.inst.write('CLEAR')    # Restart the measurement statistics
+            V = None
+            for N in range(0,count):
+                self.acquire()
+                A[N] = float(self.inst.query(m+':RESULTS:CURRENTACQ:MEAN?'))
+                if(curves):
+                    raw, pre = self.curve(self.buf.raw[N])
+                    scale(raw, self.buf.volts[N,0:len(raw)], pre)
+                    V = self.buf.volts[0:count,0:len(raw)]
+            mean = float(self.inst.query(m+':RESULTS:ALLACQS:MEAN?'))
+            std = float(self.inst.query(m+':RESULTS:ALLACQS:STDDEV?'))
+            return A, mean, std, V
+
+        return self.retry.run(shots)
+
+    def probe(self, count=20, source='CH1', record=5000):
+        """Measure the transport: the round trip time of count *IDN? queries and the CURVE?
+        throughput of count full record transfers of the waveform already on the scope.
+        Returns the list of query times in Sec and the transfer rate in MB/s."""
+        self.set('HORIZONTAL:FASTFRAME:STATE', 'OFF')
+        self.transfer(source, 0, record)
+        self.preamble()
+        latency = []
+        for i in range(0,count):
+            t0 = perf_counter()
+            self.inst.query('*IDN?')
+            latency.append(perf_counter()-t0)
+        raw = np.zeros(record, dtype='>i2')
+        nbytes = 0
+        t0 = perf_counter()
+        for i in range(0,count):
+            self.inst.write('CURVE?')
+            nbytes += 2*self.read_block(raw)
+        return latency, nbytes/(perf_counter()-t0)/1e6
+
+if __name__ == '__main__':
+    # Compare the VXI-11 and raw socket transports:  python ScopeDriver.py 10.0.128.110
+    import sys
+    host = '10.0.128.110'
+    if(len(sys.argv) > 1):
+        host = sys.argv[1]
+    for resource in ['TCPIP0::'+host+'::inst0::INSTR', 'TCPIP0::'+host+'::4000::SOCKET']:
+        scope = MSO64B(resource)
+        latency, rate = scope.probe()
+        print(resource+':  query',round(np.median(latency)*1000,2),'mSec median,',
+              round(max(latency)*1000,2),'mSec max,  CURVE?',round(rate,2),'MB/s')
+        scope.inst.close()
@@ -0,0 +1,98 @@
+import numpy as np
+from time import sleep, perf_counter
+
+#############################################################################################
+# Settling detector used after every pulser amplitude step instead of a fixed sleep.  The
+# readings (a scope integral, or a tuple of PLC ADC values) are polled until the last count
+# of them agree within tol (relative) plus absolute, and at least dwell Sec have passed since
+# the step.  With change set, a reading that differs from the first one after the step must
+# also have been seen, so a slowly updating PLC value is not taken as settled before it has
+# picked up the new amplitude.  After timeout Sec the averaging starts anyway and the step is
+# counted as timed out.
+#
+# Polling only works for a reading that can change between polls.  The ACMI values change
+# once per ACMI update (about 2.2 Sec), so polling them faster reads the same update several
+# times and takes it as stable.  updates() waits on successive updates of an ACMIPlc.Sampler
+# or ACMIEpics.MonitorSampler instead, and takes the step as settled when the last count
+# distinct updates agree.  The ACMI noise is larger than 1% of the small charges, so its
+# tolerance is an absolute one from the measured update to update noise.  The settled updates
+# are kept in settled, so they count as the first samples of the amplitude.
+#############################################################################################
+
+class Settler:
+
+    def __init__(self, tol=0.005, absolute=0.0, count=3, dwell=0.1, timeout=5.0, period=0.05, change=False, name=''):
+        self.tol = tol
+        self.absolute = absolute
+        self.count = count
+        self.dwell = dwell          # Minimum Sec after the step
+        self.timeout = timeout      # Longest Sec to wait for the readings to settle
+        self.period = period        # Sec between readings
+        self.change = change
+        self.name = name
+        self.times = []             # Sec each step took to settle
+        self.timeouts = 0
+        self.settled = []           # The updates that agreed at the last updates() step
+
+    def stable(self, X):
+        X = np.array(X[-self.count:], dtype=float)
+        if(len(X) < self.count):
+            return False
+        spread = X.max(axis=0) - X.min(axis=0)
+        return bool(np.all(spread <= self.tol*np.abs(X.mean(axis=0)) + self.absolute))
+
+    def wait(self, read):
+        """Poll read() until its readings settle.  Returns the Sec waited."""
+        t0 = perf_counter()
+        X = [read()]
+        changed = not self.change
+        while(True):
+            t = perf_counter()-t0
+            if(t >= self.dwell and changed and self.stable(X)):
+                break
+            if(t >= self.timeout):
+                self.timeouts += 1
+                break
+            sleep(self.period)
+            X.append(read())
+            if(not changed and np.any(np.array(X[-1]) != np.array(X[0]))):
+                changed = True
+                X = X[-1:]          # Only readings taken after the change count
+        t = perf_counter()-t0
+        self.times.append(t)
+        return t
+
+    def updates(self, sampler, value=None):
+        """Take successive new updates from sampler.next() until the value() of the last count
+        of them agree.  With change set, the first update after the step is not used, since it
+        may have been measured before the step.  Returns the Sec waited; the count updates that
+        agreed are left in settled (none after a timeout), and sampler.next() carries on with
+        the updates after them."""
+        t0 = perf_counter()
+        sampler.start()
+        X = []
+        U = []
+        skip = 1 if self.change else 0
+        self.settled = []
+        while(True):
+            t,V = sampler.next()
+            if(skip > 0):
+                skip -= 1
+            else:
+                U.append(V)
+                X.append(V if value is None else value(V))
+            t = perf_counter()-t0
+            if(t >= self.dwell and self.stable(X)):
+                self.settled = U[-self.count:]
+                break
+            if(t >= self.timeout):
+                self.timeouts += 1
+                break
+        self.times.append(t)
+        return t
+
+    def summary(self):
+        if(len(self.times) == 0):
+            return self.name+' settling: no steps'
+        return (self.name+' settling: '+str(len(self.times))+' steps, '+str(round(np.mean(self.times),3))+' Sec avg, '
+                +str(round(max(self.times),3))+' Sec max, '+str(self.timeouts)+' timed out')
@@ -0,0 +1,128 @@
+import io
+import sys
+import argparse
+from time import sleep, perf_counter
+
+from ScopeDriver import MSO64B
+from Prologix import Prologix
+from Sweep import Sweep, saturated, Vp, POSNOISE, scope_settler, acmi_settler
+from Pipeline import Pipeline
+from Integrate import KERNELS
+from Stats import Sequential, report
+from ACMIPlc import Sampler, PLCSession
+from Simulator.Lab import Lab
+from Simulator.Scope import FakeResourceManager
+from Simulator.Pulser import PulserServer
+from Simulator.Plc import FakeACMI
+
+#############################################################################################
+# Offline throughput benchmark of the calibration procedure.  Runs the scope part (pulser
+# step, scope settling, 25 shots through the acquisition/integration pipeline) and the ACMI
+# part (pulser step, ACMI settling, 16 samples) of PosACMI.py for the first --points
+# amplitudes, against the simulated scope, pulser and PLC, and prints where the time goes.
+# The sweep is the Sweep.Sweep of PosACMI.py, with its settings, run with the simulated
+# instruments in place of the real ones: the benchmark times the same code and the same
+# Integrate.integrate() the calibration runs.  The latencies default to what was
+# measured on the bench, except the ACMI update period, which is shortened so a run fits in
+# CI.  With --budget the exit status is 1 when the run takes longer than that.
+#
+#     python -m Simulator.Benchmark --points 5 --mode frames --acmi-period 0.05 --budget 30
+#############################################################################################
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ACMI calibration sweep against the simulator')
+    parser.add_argument('--points', type=int, default=len(Vp), help='Amplitudes to sweep (from 1V up)')
+    parser.add_argument('--mode', default='frames', choices=['frames','window','single','area'], help='Scope acquisition mode')
+    parser.add_argument('--kernel', default='rect', choices=list(KERNELS), help='Integration kernel')
+    parser.add_argument('--completion', default='poll', choices=['poll','esr','srq','opc'], help='Scope completion method')
+    parser.add_argument('--rate', type=float, default=100.0, help='Pulser repetition rate in Hz')
+    parser.add_argument('--acmi-period', type=float, default=0.05, help='ACMI update period in Sec (2.2 on the bench)')
+    parser.add_argument('--scope-query', type=float, default=0.0005, help='Scope query round trip in Sec')
+    parser.add_argument('--scope-mbps', type=float, default=40.0, help='CURVE? transfer rate in MB/s')
+    parser.add_argument('--gpib', type=float, default=0.002, help='Sec per GPIB message')
+    parser.add_argument('--plc', type=float, default=0.003, help='Sec per PLC request')
+    parser.add_argument('--drop', type=float, default=0.0, help='Fraction of PLC requests that lose the connection')
+    parser.add_argument('--tau', type=float, default=0.05, help='Pulser settling time constant in Sec')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--budget', type=float, default=None, help='Fail when the run takes longer (Sec)')
+    args = parser.parse_args(argv)
+
+    lab = Lab({'rate':args.rate,'acmi_period':args.acmi_period,'scope_query':args.scope_query,
+               'scope_mbps':args.scope_mbps,'gpib':args.gpib,'plc':args.plc}, tau=args.tau, seed=args.seed)
+    server = PulserServer(lab)
+    port = server.start()
+    acmi = FakeACMI(lab, drop=args.drop)
+
+    T = {}
+    def clock(name, t0):
+        T[name] = T.get(name,0.0) + perf_counter()-t0
+
+    t0 = perf_counter()
+    pulser = Prologix('127.0.0.1', 14, port=port)
+    pulser.batch([':SOUR:VOLT 0.0',':OUTP:POL NEG',':SOUR:PULS:DEL 5US',':SOUR:PULS:WIDT 50.0NS',':SOUR:VOLT 1.0'])
+    scope = MSO64B('TCPIP0::127.0.0.1::inst0::INSTR', rm=FakeResourceManager(lab), completion=args.completion)
+    scope.set('HOR:RECO','5000')
+    scope.set('HORIZONTAL:MODE:SAMPLERATE','25.0E9')
+    scope.set('HORIZONTAL:POS','10')
+    scope.set('CH1:POS','4.5')
+    scope.transfer('CH1',0,5000)
+    comm = PLCSession('10.0.128.47', driver=acmi.PLC)
+    comm.connect()
+    ADCtags = ['Program:Main_Loop.'+t for t in ['Beam_ADCA','Beam_ADCB','ST1AB_ADCA','ST1AB_ADCB','ST1BA_ADCA','ST1BA_ADCB']]
+    clock('setup', t0)
+
+    def HPwrite(cmd):
+        t0 = perf_counter()
+        pulser.write(cmd)
+        clock('pulser', t0)
+
+    # The sweep of PosACMI.py with its settling, over the first --points amplitudes and with
+    # a fixed 25 shots and 16 samples per amplitude
+    ACMI = Sampler(comm, ADCtags, poll=min(0.05,args.acmi_period/4.0), period=args.acmi_period)
+    SCOPESETTLE = scope_settler()
+    ACMISETTLE = acmi_settler(POSNOISE)
+    SHOTRULE = Sequential(25,25)
+    ACMIRULE = Sequential(16,16)
+    sweep = Sweep(scope, HPwrite, ACMI, io.StringIO(), polarity=-1, trigger=-0.5, amps=range(0,args.points),
+                  fastframe=args.mode in ('frames','window'), window=args.mode == 'window', area=args.mode == 'area',
+                  kernel=args.kernel, shotrule=SHOTRULE, acmirule=ACMIRULE, scopesettle=SCOPESETTLE, acmisettle=ACMISETTLE)
+
+    # Part One: the scope shots of every amplitude through the acquisition/integration pipeline
+    t0 = perf_counter()
+    pipe = Pipeline(sweep.acquire_pulses,sweep.integrate_pulses).start()
+    while(pipe.alive()):
+        pipe.results()
+        sleep(0.01)
+    pipe.results()
+    T['scope settle'] = sum(SCOPESETTLE.times)
+    T['scope shots'] = perf_counter()-t0 - T['scope settle'] - T.get('pulser',0.0)
+
+    # Part Two: the ACMI samples of every amplitude
+    t0 = perf_counter()
+    pulse = T.get('pulser',0.0)
+    for j in range(0,args.points):
+        HPwrite(':SOUR:VOLT '+str(Vp[j]))
+        S,Bstats = sweep.sample_acmi(j)
+        print('%3d V  Qscope %7.3f nC  ACMI %7.1f counts%s' % (Vp[j], sweep.Qstats[j].mean, Bstats.mean, '  (saturated)' if saturated(S) else ''))
+    T['ACMI settle'] = sum(ACMISETTLE.times)
+    T['ACMI samples'] = perf_counter()-t0 - T['ACMI settle'] - (T['pulser']-pulse)
+
+    total = sum(T.values())
+    print('\nTime per stage:')
+    for name in T:
+        print('  %-13s %8.3f Sec  %5.1f%%' % (name, T[name], 100.0*T[name]/total))
+    print('  %-13s %8.3f Sec' % ('total', total))
+    print()
+    report(['Scope retries: '+scope.retry.summary(), SCOPESETTLE.summary(), ACMISETTLE.summary(), ACMI.summary(),
+            SHOTRULE.summary('Scope'), ACMIRULE.summary('ACMI'),
+            comm.summary(), 'PLC retries: '+comm.retry.summary(), acmi.summary(), pulser.summary()])
+    comm.close()
+    pulser.close()
+    server.stop()
+    if(args.budget is not None and total > args.budget):
+        print('Over budget: '+str(round(total,3))+' > '+str(args.budget)+' Sec')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,54 @@
+import numpy as np
+from time import perf_counter
+
+#############################################################################################
+# Shared state of the simulated bench.  The Prologix/HP8114A emulator sets the pulser output
+# here, and the fake scope and PLC read back what they would see from it.  A new amplitude is
+# approached exponentially with time constant tau, so the settling detectors have something
+# to settle on.  latency holds the configurable delays (Sec) of every simulated interface.
+#############################################################################################
+
+LATENCY = {'scope_query':0.0005,    # Round trip of one SCPI query to the scope
+           'scope_mbps':40.0,       # CURVE? transfer rate in MB/s
+           'gpib':0.002,            # One GPIB message through the Prologix adapter
+           'plc':0.003,             # One CIP request to the PLC
+           'rate':100.0,            # Pulser repetition rate in Hz (one scope trigger per pulse)
+           'acmi_period':2.2}       # ACMI update period in Sec
+
+class Lab:
+
+    def __init__(self, latency=None, tau=0.05, width=50e-9, attenuator=6.0, gain=180.0, noise=0.002, seed=None):
+        self.latency = dict(LATENCY)
+        if(latency is not None):
+            self.latency.update(latency)
+        self.tau = tau                  # Sec for the pulser output to settle after a change
+        self.width = width              # Pulse width in Sec
+        self.attenuator = attenuator    # dB between the pulser and the ICT test input
+        self.gain = gain                # ACMI ADC counts per nC at the ICT test input
+        self.noise = noise              # Relative pulse to pulse amplitude noise
+        self.polarity = -1.0
+        self.volts = 0.0
+        self.start = 0.0
+        self.t = perf_counter()
+        self.rng = np.random.default_rng(seed)
+
+    def set_volts(self, volts):
+        self.start = self.amplitude()
+        self.volts = float(volts)
+        self.t = perf_counter()
+
+    def set_polarity(self, pol):
+        self.polarity = -1.0 if pol.upper().startswith('NEG') else 1.0
+
+    def amplitude(self):
+        """Signed pulse amplitude in Volts into 50 Ohm right now."""
+        a = self.volts + (self.start-self.volts)*np.exp(-(perf_counter()-self.t)/self.tau)
+        return self.polarity*a
+
+    def pulse(self):
+        """Amplitude of the next pulse, with pulse to pulse noise."""
+        return self.amplitude()*(1.0 + self.noise*self.rng.standard_normal())
+
+    def charge(self, volts):
+        """Charge in nC of a pulse of volts into 50 Ohm."""
+        return volts*self.width/50.0*1e9
@@ -0,0 +1,149 @@
+from time import sleep, time, perf_counter
+
+#############################################################################################
+# pylogix-compatible fake of the 1768-L43S PLC running the ACMI program.  FakeACMI models the
+# ACMI electronics: once per lab.latency['acmi_period'] it takes the charge of the pulse the
+# simulated pulser is putting into the ICT test input and converts it into A channel ADC
+# counts over the B channel baseline, saturating at 2047, plus the two self-test pairs, the
+# charges in pC from the fit constants, and an update counter.  The ADC noise is fitted to
+# the bench run in ACMI2026_Mar/Results/posacmi.raw: 6.2 counts rms on ADCA, 6.5 on ADCB and
+# 5.5 on A-B, so the A and B channels of a pair share part of it.  FakeACMI.PLC() returns a
+# FakePLC, an object with the pylogix PLC interface (Read of one tag or a list,
+# GetModuleProperties, GetPLCTime, Close) on which every request costs lab.latency['plc']
+# Sec.  Use it as the driver of a PLCSession:
+#
+#     comm = PLCSession('10.0.128.47', driver=FakeACMI(lab).PLC)
+#
+# A fraction drop of the requests fails with 'Connection lost' to exercise the reconnects.
+#############################################################################################
+
+FULLSCALE = 2047
+PREFIX = 'Program:Main_Loop.'
+
+class Response:
+    """Same fields as pylogix.lgx_response.Response."""
+
+    def __init__(self, tag, value, status):
+        self.TagName = tag
+        self.Value = value
+        self.Status = status
+
+class Device:
+    """The fields of pylogix.lgx_device.Device the scripts look at."""
+
+    def __init__(self, name):
+        self.ProductName = name
+        self.Vendor = 'Rockwell Automation/Allen-Bradley'
+        self.DeviceType = 'Programmable Logic Controller'
+        self.Revision = '20.13'
+
+class FakeACMI:
+
+    def __init__(self, lab, offset=20.0, nonlinear=0.02, noise=3.9, common=5.0, selftest=(1480.0,1510.0), drop=0.0):
+        self.lab = lab
+        self.offset = offset        # ADC counts with no charge
+        self.nonlinear = nonlinear  # Fractional loss of gain at full scale
+        self.noise = noise          # ADC counts rms of every channel on its own
+        self.common = common        # ADC counts rms shared by the A and B channels of a pair
+        self.selftest = selftest    # ADC counts of the ST1AB and ST1BA self-test pulses
+        self.drop = drop
+        self.t0 = perf_counter()
+        self.tick = -1
+        self.count = 0              # Update counter
+        self.saturated = 0          # Updates with a beam ADC at full scale
+        self.requests = 0
+        self.tags = {}
+        lin = 1000.0/self.lab.gain  # pC per count
+        self.fit = {'Fit_Quad_1':0,'Fit_Quad_2':1,'Fit_Linear_1':int(round(lin*1000)),'Fit_Linear_2':1000,
+                    'Fit_Off':int(round(-self.offset*lin))}
+
+    def adc(self, q, common=0.0):
+        """ADC counts of q nC at the ICT test input, with the noise common to its pair."""
+        counts = self.offset + self.lab.gain*q*(1.0 - self.nonlinear*q*self.lab.gain/FULLSCALE)
+        counts += common + self.noise*self.lab.rng.standard_normal()
+        return int(min(FULLSCALE, max(0, round(counts))))
+
+    def charge(self, counts):
+        """Charge in pC from ADC counts with the fit constants."""
+        f = self.fit
+        return f['Fit_Off'] + counts*f['Fit_Linear_1']/f['Fit_Linear_2'] + counts*counts*f['Fit_Quad_1']/f['Fit_Quad_2']
+
+    def update(self):
+        """Take a new ACMI measurement if an update period has passed since the last one."""
+        tick = int((perf_counter()-self.t0)/self.lab.latency['acmi_period'])
+        if(tick == self.tick):
+            return
+        self.tick = tick
+        self.count += 1
+        q = abs(self.lab.charge(self.lab.pulse()))*10.0**(-self.lab.attenuator/20.0)
+        C = self.common*self.lab.rng.standard_normal(3)     # Noise of each pair
+        A = self.adc(q, C[0])
+        B = self.adc(0.0, C[0])     # Baseline channel: the charge is ADCA-ADCB
+        if(A == FULLSCALE):
+            self.saturated += 1
+        STAB = [self.adc(self.selftest[0]/self.lab.gain, C[1]), self.adc(0.0, C[1])]
+        STBA = [self.adc(self.selftest[1]/self.lab.gain, C[2]), self.adc(0.0, C[2])]
+        tags = {'Beam_ADCA':A,'Beam_ADCB':B,'ST1AB_ADCA':STAB[0],'ST1AB_ADCB':STAB[1],
+                'ST1BA_ADCA':STBA[0],'ST1BA_ADCB':STBA[1],'Update_Count':self.count}
+        self.tags = {}
+        for name in tags:
+            self.tags[PREFIX+name] = tags[name]
+        for name in self.fit:
+            self.tags[PREFIX+name] = self.fit[name]
+        self.tags['ACMI_BEAM_Q'] = self.charge(A-B+self.offset)
+        self.tags['ACMI_ST1_QAB'] = self.charge(STAB[0]-STAB[1]+self.offset)
+        self.tags['ACMI_ST1_QBA'] = self.charge(STBA[0]-STBA[1]+self.offset)
+
+    def read(self, tag):
+        self.update()
+        if(tag not in self.tags):
+            return Response(tag, None, 'Path segment error')
+        return Response(tag, self.tags[tag], 'Success')
+
+    def PLC(self):
+        return FakePLC(self)
+
+    def summary(self):
+        return 'Simulated ACMI: '+str(self.count)+' updates, '+str(self.saturated)+' saturated, '+str(self.requests)+' CIP requests'
+
+class FakePLC:
+
+    def __init__(self, acmi):
+        self.acmi = acmi
+        self.IPAddress = ''
+        self.ProcessorSlot = 0
+        self.SocketTimeout = 5.0
+        self.closed = False
+
+    def request(self):
+        """One CIP round trip.  Returns the failure status of a dropped request, else None."""
+        self.acmi.requests += 1
+        sleep(self.acmi.lab.latency['plc'])
+        if(self.closed or self.acmi.lab.rng.random() < self.acmi.drop):
+            self.closed = True
+            return 'Connection lost'
+        return None
+
+    def Read(self, tag, count=None, datatype=None):
+        status = self.request()
+        tags = tag if isinstance(tag, list) else [tag]
+        if(status is not None):
+            R = [Response(t, None, status) for t in tags]
+        else:
+            R = [self.acmi.read(t) for t in tags]
+        return R if isinstance(tag, list) else R[0]
+
+    def GetModuleProperties(self, slot=0):
+        status = self.request()
+        if(status is not None):
+            return Response(None, None, status)
+        return Response(None, Device('1768-L43S/B LOGIX5343SAFETY'), 'Success')
+
+    def GetPLCTime(self, raw=False):
+        status = self.request()
+        if(status is not None):
+            return Response(None, None, status)
+        return Response(None, time(), 'Success')
+
+    def Close(self):
+        self.closed = True
@@ -0,0 +1,190 @@
+import asyncio
+import threading
+from time import sleep
+
+#############################################################################################
+# TCP emulator of a Prologix GPIB-Ethernet controller with an HP8114A pulser at one GPIB
+# address.  It speaks the ++ controller commands Prologix.py sends (++auto, ++addr, ++read
+# eoi, ...), executes the semicolon separated program messages for the pulser (:SOUR:VOLT,
+# :OUTP:POL, :SOUR:PULS:WIDT, *OPC?, :SYST:ERR?, *IDN?) against the shared lab, and queues
+# the replies until the next ++read.  Every GPIB message costs lab.latency['gpib'] Sec.
+# PulserServer(lab).start() serves it from a background thread on a free local port.
+#############################################################################################
+
+UNITS = {'NS':1e-9,'US':1e-6,'MS':1e-3,'S':1.0,'MV':1e-3,'V':1.0}
+
+def number(value):
+    """Parse an HP8114A numeric value with an optional unit suffix, e.g. '50.0NS'."""
+    value = value.strip().upper()
+    for unit in sorted(UNITS, key=len, reverse=True):
+        if(value.endswith(unit)):
+            try:
+                return float(value[:-len(unit)])*UNITS[unit]
+            except ValueError:
+                break
+    return float(value)
+
+class HP8114A:
+    """The pulser side: executes program messages and keeps the error queue."""
+
+    def __init__(self, lab):
+        self.lab = lab
+        self.errors = []
+        self.messages = 0
+
+    def execute(self, message):
+        """Execute one program message and return the reply (None for no reply)."""
+        self.messages += 1
+        sleep(self.lab.latency['gpib'])
+        replies = []
+        path = ''
+        for unit in message.split(';'):
+            unit = unit.strip()
+            if(unit == ''):
+                continue
+            header, _, value = unit.partition(' ')
+            header = header.upper()
+            if(not header.startswith((':','*'))):
+                header = path+header        # Relative to the previous command
+            elif(header.startswith(':')):
+                path = header[0:header.rfind(':')+1]
+            try:
+                reply = self.unit(header, value)
+            except ValueError:
+                self.errors.append('-224,"Illegal parameter value"')
+                reply = None
+            if(reply is not None):
+                replies.append(reply)
+        if(len(replies) == 0):
+            return None
+        return ';'.join(replies)
+
+    def unit(self, header, value):
+        if(header == '*IDN?'):
+            return 'HEWLETT-PACKARD,HP8114A,0,REV 1.0'
+        if(header == '*OPC?'):
+            return '1'
+        if(header in ('*RST','*CLS','*WAI','*OPC')):
+            if(header == '*CLS'):
+                self.errors = []
+            return None
+        if(header in (':SYST:ERR?',':SYSTEM:ERROR?')):
+            if(len(self.errors) > 0):
+                return self.errors.pop(0)
+            return '+0,"No error"'
+        if(header in (':SOUR:VOLT',':SOURCE:VOLTAGE',':VOLT')):
+            volts = number(value)
+            if(volts < 0.0 or volts > 100.0):
+                raise ValueError(value)
+            self.lab.set_volts(volts)
+            return None
+        if(header in (':SOUR:VOLT?',':VOLT?')):
+            return repr(self.lab.volts)
+        if(header in (':OUTP:POL',':OUTPUT:POLARITY')):
+            if(not value.strip().upper().startswith(('NEG','POS','NORM','INV'))):
+                raise ValueError(value)
+            self.lab.set_polarity('NEG' if value.strip().upper().startswith(('NEG','INV')) else 'POS')
+            return None
+        if(header in (':SOUR:PULS:WIDT',':PULS:WIDT')):
+            self.lab.width = number(value)
+            return None
+        if(header in (':SOUR:PULS:DEL',':PULS:DEL',':OUTP',':OUTP:STAT')):
+            return None
+        self.errors.append('-113,"Undefined header"')
+        return None
+
+class PulserServer:
+
+    def __init__(self, lab, addr=14, host='127.0.0.1', port=0):
+        self.lab = lab
+        self.addr = addr
+        self.host = host
+        self.port = port            # 0: any free port, the one bound is set by start()
+        self.pulser = HP8114A(lab)
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.tasks = {}             # Handler task: writer of every open connection
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        task = asyncio.current_task()
+        self.tasks[task] = writer
+        auto = False
+        addr = None
+        replies = []
+        try:
+            while(True):
+                line = await reader.readline()
+                if(not line):
+                    break
+                line = line.decode('ascii').strip()
+                if(line.startswith('++')):
+                    cmd, _, value = line[2:].partition(' ')
+                    if(cmd == 'addr'):
+                        addr = int(value)
+                    elif(cmd == 'auto'):
+                        auto = value.strip() == '1'
+                    elif(cmd == 'read'):
+                        if(len(replies) > 0):
+                            writer.write((replies.pop(0)+'\n').encode('ascii'))
+                        else:
+                            writer.write(b'\n')     # Read timed out on the bus
+                    elif(cmd == 'ver'):
+                        writer.write(b'Prologix GPIB-ETHERNET Controller version 01.06.06.00 (simulated)\n')
+                    await writer.drain()
+                    continue
+                if(addr != self.addr):
+                    continue                        # Nobody listening at that address
+                reply = await asyncio.get_running_loop().run_in_executor(None, self.pulser.execute, line)
+                if(reply is not None):
+                    if(auto):
+                        writer.write((reply+'\n').encode('ascii'))
+                        await writer.drain()
+                    else:
+                        replies.append(reply)
+        finally:
+            self.tasks.pop(task, None)
+            writer.close()
+
+    def start(self):
+        """Serve from a background thread.  Returns the port."""
+        ready = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, self.host, self.port))
+            self.port = self.server.sockets[0].getsockname()[1]
+            ready.set()
+            self.loop.run_forever()
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self.port
+
+    async def shutdown(self, grace=1.0):
+        """Stop accepting connections and end the handlers of the open ones: closing a
+        connection lets its handler read EOF and return, and a handler still running after
+        grace Sec is cancelled.  All of them are awaited, so no task is left pending when
+        the loop stops."""
+        self.server.close()
+        tasks = list(self.tasks)
+        for task in tasks:
+            self.tasks[task].close()
+        if(len(tasks) > 0):
+            done, pending = await asyncio.wait(tasks, timeout=grace)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await self.server.wait_closed()
+
+    def stop(self):
+        if(self.loop is not None):
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop = None
@@ -0,0 +1,193 @@
+import numpy as np
+from time import sleep, perf_counter
+
+#############################################################################################
+# VISA-compatible fake of the Tektronix MSO64B.  FakeResourceManager().open_resource() returns
+# a FakeMSO64B that answers the SCPI subset ScopeDriver.MSO64B uses: settings, WFMOUTPRE?,
+# CURVE? definite length blocks (single shot or FastFrame), ACQUIRE:STATE?, *OPC/*ESR?, SRQ
+# and the AREA measurement.  Every trigger is one pulse of the simulated pulser in lab, drawn
+# as a 16 bit record at the vertical scale and position that were set, so a pulse that goes
+# off screen clips as it would on the scope.  Acquisitions take one pulser period per trigger
+# and the query round trip and CURVE? transfer rate come from lab.latency.
+#############################################################################################
+
+class FakeMSO64B:
+
+    def __init__(self, lab, resource=''):
+        self.lab = lab
+        self.resource = resource
+        self.timeout = 10000        # mSec, as in pyvisa
+        self.read_termination = None
+        self.write_termination = None
+        self.chunk_size = 20*1024
+        self.state = {'HOR:RECO':'5000','HORIZONTAL:MODE:SAMPLERATE':'25.0E9','HORIZONTAL:POS':'10',
+                      'CH1:SCALE':'0.2','CH1:POS':'0','DATA:START':'1','DATA:STOP':'5000',
+                      'DATA:FRAMESTART':'1','DATA:FRAMESTOP':'1','HORIZONTAL:FASTFRAME:STATE':'OFF',
+                      'HORIZONTAL:FASTFRAME:COUNT':'1'}
+        self.mem = np.zeros((1,5000), dtype='>i2')     # Acquired frames in ADC codes
+        self.ready = 0.0            # perf_counter() when the running acquisition completes
+        self.opc = False            # *OPC pending on the running acquisition
+        self.esr = 0
+        self.out = b''              # Response waiting to be read
+        self.areas = []             # AREA measurement of every acquisition since CLEAR
+        self.area = 0.0
+        self.writes = 0
+        self.queries = 0
+
+    def get(self, header, default=None):
+        return self.state.get(header, default)
+
+    def xincr(self):
+        return 1.0/float(self.get('HORIZONTAL:MODE:SAMPLERATE'))
+
+    def ymult(self):
+        return float(self.get('CH1:SCALE'))*10.0/65536.0
+
+    def frames(self):
+        if(self.get('HORIZONTAL:FASTFRAME:STATE') == 'ON'):
+            return int(self.get('HORIZONTAL:FASTFRAME:COUNT'))
+        return 1
+
+    def acquire(self):
+        """Draw the next frames() pulses of the pulser into mem."""
+        n = self.frames()
+        record = int(self.get('HOR:RECO'))
+        dt = self.xincr()
+        t = (np.arange(record) - record*float(self.get('HORIZONTAL:POS'))/100.0)*dt
+        rise = 1.5e-9
+        shape = 1.0/(1.0+np.exp(-t/rise*4.0)) - 1.0/(1.0+np.exp(-(t-self.lab.width)/rise*4.0))
+        A = np.array([self.lab.pulse() for k in range(0,n)])
+        V = A[:,None]*shape[None,:]
+        V += 0.002*self.lab.rng.standard_normal(V.shape)
+        ymult = self.ymult()
+        codes = V/ymult + float(self.get('CH1:POS'))*6553.6
+        self.mem = np.clip(np.rint(codes), -32768, 32767).astype('>i2')
+        self.area = float(A[-1]*self.lab.width)
+        self.areas.append(self.area)
+        rate = self.lab.latency['rate']
+        self.ready = perf_counter() + n/rate
+        self.opc = False
+
+    def busy(self):
+        return perf_counter() < self.ready
+
+    def curve(self):
+        record = self.mem.shape[1]
+        a = max(1, int(self.get('DATA:START'))) - 1
+        b = min(record, int(self.get('DATA:STOP')))
+        f0, f1 = 0, 1
+        if(self.get('HORIZONTAL:FASTFRAME:STATE') == 'ON'):
+            f0 = int(self.get('DATA:FRAMESTART')) - 1
+            f1 = min(self.mem.shape[0], int(self.get('DATA:FRAMESTOP')))
+        data = self.mem[f0:f1,a:b].tobytes()
+        sleep(len(data)/self.lab.latency['scope_mbps']/1e6)
+        n = str(len(data)).encode('ascii')
+        return b'#'+str(len(n)).encode('ascii')+n+data+b'\n'
+
+    def preamble(self):
+        return ('2;16;BIN;RI;MSB;"Ch1, DC coupling";'+str(int(self.get('HOR:RECO')))+';Y;LINEAR;"s";'
+                +repr(self.xincr())+';0.0;0;"V";'+repr(self.ymult())+';'+repr(float(self.get('CH1:POS'))*6553.6)
+                +';0.0;TIME;ANALOG')
+
+    def command(self, cmd):
+        """Execute one program message unit.  Returns the reply of a query, else None."""
+        cmd = cmd.strip()
+        header, _, value = cmd.partition(' ')
+        header = header.upper()
+        if(header.endswith('?')):
+            self.queries += 1
+            if(header == '*IDN?'):
+                return 'TEKTRONIX,MSO64B,SIM0001,CF:91.1CT FV:2.0'
+            if(header == 'WFMOUTPRE?'):
+                return self.preamble()
+            if(header == 'ACQUIRE:STATE?'):
+                return '1' if self.busy() else '0'
+            if(header == '*ESR?'):
+                if(self.opc and not self.busy()):
+                    self.esr |= 1
+                    self.opc = False
+                esr = self.esr
+                self.esr = 0
+                return str(esr)
+            if(header == '*OPC?'):
+                sleep(max(0.0, self.ready-perf_counter()))
+                return '1'
+            if(header == 'CURVE?'):
+                return self.curve()
+            if(header.endswith(':RESULTS:CURRENTACQ:MEAN?')):
+                return repr(self.area)
+            if(header.endswith(':RESULTS:ALLACQS:MEAN?')):
+                return repr(float(np.mean(self.areas))) if len(self.areas) > 0 else '0.0'
+            if(header.endswith(':RESULTS:ALLACQS:STDDEV?')):
+                return repr(float(np.std(self.areas))) if len(self.areas) > 0 else '0.0'
+            return self.state.get(header[:-1], '0')
+        self.writes += 1
+        if(header == 'ACQUIRE:STATE' and value.strip() in ('1','ON','RUN')):
+            self.acquire()
+        elif(header == '*OPC'):
+            self.opc = True
+        elif(header == '*CLS'):
+            self.esr = 0
+        elif(header == 'CLEAR'):
+            self.areas = []
+        elif(header == '*WAI'):
+            sleep(max(0.0, self.ready-perf_counter()))
+        elif(value != ''):
+            self.state[header] = value.strip()
+        return None
+
+    # pyvisa message based resource interface
+    def write(self, message):
+        sleep(self.lab.latency['scope_query']/2.0)
+        out = []
+        for cmd in message.split(';'):
+            reply = self.command(cmd)
+            if(reply is not None):
+                out.append(reply)
+        if(len(out) > 0):
+            self.out = b';'.join([r if isinstance(r, bytes) else r.encode('ascii') for r in out])
+            if(not self.out.endswith(b'\n')):
+                self.out += b'\n'
+        return len(message)
+
+    def read_bytes(self, count):
+        data = self.out[0:count]
+        self.out = self.out[count:]
+        return data
+
+    def read_raw(self):
+        sleep(self.lab.latency['scope_query']/2.0)
+        data = self.out
+        self.out = b''
+        return data
+
+    def read(self):
+        return self.read_raw().decode('ascii').strip()
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def wait_for_srq(self, timeout=None):
+        sleep(max(0.0, self.ready-perf_counter()))
+
+    def clear(self):
+        self.out = b''
+
+    def close(self):
+        pass
+
+class FakeResourceManager:
+    """Stands in for pyvisa.ResourceManager: MSO64B(resource, rm=FakeResourceManager(lab))."""
+
+    def __init__(self, lab):
+        self.lab = lab
+        self.opened = []
+
+    def open_resource(self, resource):
+        inst = FakeMSO64B(self.lab, resource)
+        self.opened.append(inst)
+        return inst
+
+    def close(self):
+        pass
@@ -0,0 +1,11 @@
+#############################################################################################
+# Hardware-in-the-loop simulator of the ACMI calibration bench: the MSO64B scope (a pyvisa
+# resource manager), the HP8114A pulser behind a Prologix controller (a TCP server) and the
+# ACMI PLC (a pylogix PLC), all driven by one shared Lab with configurable latencies, so the
+# drivers and the sweep can be benchmarked without the hardware.  See Simulator/Benchmark.py.
+#############################################################################################
+
+from Simulator.Lab import Lab, LATENCY
+from Simulator.Scope import FakeMSO64B, FakeResourceManager
+from Simulator.Pulser import HP8114A, PulserServer
+from Simulator.Plc import FakeACMI, FakePLC
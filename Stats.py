@@ -0,0 +1,123 @@
+from math import sqrt, inf, ceil
+
+#############################################################################################
+# Streaming statistics for the shot loops.  RunningStats keeps the count, mean, variance
+# (Welford's update), min and max of the values added so far in O(1) time and memory per
+# value, so the running averages shown while acquiring do not sum the whole history on every
+# shot.  The final state of an amplitude is written to the raw data file as one record,
+#
+#     Stats,<quantity>,<j>,<pulser V>,<count>,<mean>,<std>,<min>,<max>
+#
+# after the shot lines of that amplitude, and read back by ProcessReport.py with read_record()
+# instead of reparsing the shots.  std is the population standard deviation (as np.std).
+#
+# Sequential is the stopping rule of the sequential sampling mode: an amplitude is averaged
+# until the standard error of its mean is within a target, between a minimum and a maximum
+# number of values, so the precise amplitudes are not sampled as long as the noisy ones.
+#
+# report() prints the end of run summaries of the scripts (these, the settling, retry and
+# interface statistics) and writes them to the run log.
+#############################################################################################
+
+class RunningStats:
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0           # Sum of squared deviations from the mean
+        self.min = inf
+        self.max = -inf
+
+    def add(self, x):
+        x = float(x)
+        self.count += 1
+        d = x - self.mean
+        self.mean += d/self.count
+        self.m2 += d*(x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def var(self, ddof=0):
+        if(self.count <= ddof):
+            return 0.0
+        return self.m2/(self.count-ddof)
+
+    def std(self, ddof=0):
+        return sqrt(self.var(ddof))
+
+    def sem(self):
+        """Standard error of the mean (from the sample standard deviation)."""
+        if(self.count < 2):
+            return inf
+        return self.std(1)/sqrt(self.count)
+
+    def record(self, quantity, j, volts):
+        """The Stats record line (without newline) of quantity at amplitude j."""
+        return ','.join(['Stats',quantity,str(j),str(volts),str(self.count)]+[str(round(x,6)) for x in (self.mean,self.std(),self.min,self.max)])
+
+class Sequential:
+    """Keep sampling until the standard error of the mean is within absolute (in the units of
+    the values) or relative (fraction of the mean), whichever is larger, taking at least
+    minimum and at most maximum values.  Sequential(n,n) takes a fixed n."""
+
+    def __init__(self, minimum, maximum, absolute=0.0, relative=0.0, batch=None):
+        self.minimum = max(2, minimum) if maximum > minimum else minimum
+        self.maximum = max(maximum, self.minimum)
+        self.absolute = absolute
+        self.relative = relative
+        self.batch = batch      # Most values to ask for at a time (None: no limit)
+        self.counts = []        # Values taken at every amplitude, from done()
+
+    def target(self, stats):
+        return max(self.absolute, self.relative*abs(stats.mean))
+
+    def more(self, stats=None):
+        """Number of values to take next, 0 when done.  After the minimum it is the number the
+        spread so far says are still needed to reach the target."""
+        count = 0 if stats is None else stats.count
+        if(count >= self.maximum):
+            return 0
+        if(count < self.minimum):
+            n = self.minimum - count
+        else:
+            target = self.target(stats)
+            if(stats.sem() <= target):
+                return 0
+            if(target <= 0.0):
+                n = self.maximum - count
+            else:
+                n = max(1, int(ceil((stats.std(1)/target)**2)) - count)
+        n = min(n, self.maximum - count)
+        if(self.batch is not None):
+            n = min(n, self.batch)
+        return n
+
+    def done(self, stats):
+        """Record the count of a finished amplitude."""
+        self.counts.append(stats.count)
+
+    def summary(self, name=''):
+        if(len(self.counts) == 0):
+            return name+' sampling: no amplitudes'
+        return (name+' sampling: '+str(sum(self.counts))+' values at '+str(len(self.counts))+' amplitudes, '
+                +str(min(self.counts))+' to '+str(max(self.counts))+' per amplitude')
+
+def read_record(line):
+    """Parse a Stats record line.  Returns (quantity, j, pulser V, RunningStats)."""
+    Z = line.strip().split(',')
+    s = RunningStats()
+    s.count = int(Z[4])
+    s.mean = float(Z[5])
+    s.m2 = float(Z[6])**2*s.count
+    s.min = float(Z[7])
+    s.max = float(Z[8])
+    return Z[1], int(Z[2]), float(Z[3]), s
+
+def report(summaries, log=None):
+    """Print every summary line and write it to the open run log."""
+    for mess in summaries:
+        print(mess)
+        if(log is not None):
+            log.write(mess+'\n')
+    if(log is not None):
+        log.flush()
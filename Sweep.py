@@ -0,0 +1,198 @@
+import numpy as np
+from math import sqrt
+from ScopeDriver import locate
+from Integrate import integrate, charge, save
+from Stats import RunningStats, Sequential
+from AmpScheduler import FULLSCALE
+from Settling import Settler
+
+#############################################################################################
+# The amplitude sweep of PosACMI.py and NegACMI.py, and its settings, in one place so the
+# scripts and Simulator/Benchmark.py run the same code.  A Sweep holds the instruments and the
+# options of a run.  acquire_pulses() and integrate_pulses() are the instrument and worker
+# threads of the Pipeline of Part One, sample_acmi() takes the ACMI samples of one amplitude
+# (Part Two, or alongside Part One with the splitter).  The statistics of every amplitude are
+# kept in Nshot, Istats, Qstats and Last, and the ACMI samples taken with the splitter in
+# ACMIsamples.
+#
+#     sweep = Sweep(scope,HPwrite,ACMI,f,polarity=-1,trigger=-0.5)
+#     pipe = Pipeline(sweep.acquire_pulses,sweep.integrate_pulses).start()
+#############################################################################################
+
+CH1scale = [0.2,0.5,0.5,0.5,1,1,1,1,1,2,2,2,2,2,2,2,2,2,5,5,5,5,5] #in Volts/Division on Scope
+Vp = [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23] #in Volts for Pulse Amplitude
+ACMIPERIOD = 2.2    # Sec between ACMI updates, which times the updates that repeat the ADC values when there is no counter tag
+POSNOISE = 5.5      # rms ADC counts of the beam A-B of one ACMI update (ACMI2026_Mar/Results/posacmi.raw)
+NEGNOISE = 4.3      # rms ADC counts of the beam A-B of one ACMI update (ACMI2026_Mar/Results/negacmi.raw)
+
+def scope_settler():
+    #Wait for stable scope integrals after an amplitude step
+    return Settler(tol=0.005,count=3,dwell=0.1,timeout=1.0,name='Scope')
+
+def acmi_settler(noise):
+    #Wait for two ACMI updates after the first one past the step that agree within 4 sigma of the
+    #noise of their difference, from the rms noise of the beam A-B of one update
+    return Settler(tol=0.0,absolute=4*sqrt(2)*noise,count=2,dwell=0.5,timeout=15.0,change=True,name='ACMI')
+
+def beam_counts(ADC):
+    #The beam A-B counts of an ACMI update (ADCA when it is at full scale), which the settling and ACMIRULE are judged on
+    if(ADC[0]==FULLSCALE):
+        return ADC[0]
+    return ADC[0]-ADC[1]
+
+def saturated(S):
+    #Any beam ADCA sample of the amplitude at full scale
+    return any([abs(ADC[0])>=FULLSCALE for ADC in S])
+
+class Sweep:
+    """The scope shots and ACMI samples of the amplitudes amps (indices into Vp).  polarity is
+    that of the pulse on the scope (-1 for PosACMI, +1 for NegACMI) and trigger the scope
+    trigger level in divisions of CH1scale."""
+
+    def __init__(self, scope, HPwrite, ACMI, f, polarity=-1, trigger=-0.5, amps=range(0,23),
+                 fastframe=True, window=False, area=False, debug=False, kernel='rect', waves=None,
+                 splitter=False, splitk=1.0, adaptive=False, sched=None, pool=None,
+                 shotrule=None, acmirule=None, scopesettle=None, acmisettle=None):
+        self.scope = scope
+        self.HPwrite = HPwrite
+        self.ACMI = ACMI            # ACMIPlc.Sampler or ACMIEpics.MonitorSampler of the six ADC values
+        self.f = f                  # Open raw data file
+        self.polarity = polarity
+        self.trigger = trigger
+        self.amps = amps
+        self.fastframe = fastframe  # All shots of a batch in one FastFrame acquisition
+        self.window = window        # Transfer only the pulse window located in the first shot
+        self.area = area            # Scope-side AREA measurement
+        self.debug = debug          # With area, also transfer the full waveforms
+        self.kernel = kernel
+        self.waves = waves          # Open file the shots are saved to, or None
+        self.splitter = splitter    # ACMI samples taken while the scope records the same pulses
+        self.splitk = splitk        # Scope to ICT arm ratio of the splitter
+        self.adaptive = adaptive
+        self.sched = sched          # AmpScheduler of an adaptive splitter sweep
+        self.pool = pool            # Executor the splitter ACMI samples are taken on
+        self.shotrule = shotrule if shotrule is not None else Sequential(25,25)
+        self.acmirule = acmirule if acmirule is not None else Sequential(16,16)
+        self.scopesettle = scopesettle if scopesettle is not None else scope_settler()
+        self.acmisettle = acmisettle if acmisettle is not None else acmi_settler(POSNOISE if polarity < 0 else NEGNOISE)
+        self.ACMIsamples = {}
+        self.Nshot = {}
+        self.Istats = {}            # Running integral and charge statistics of every amplitude
+        self.Qstats = {}
+        self.Last = {}              # Last shot result of every amplitude
+
+    def sample_acmi(self, j):
+        """The ACMI samples of amplitude j and the statistics of the beam A-B counts that the
+        ACMI rule stops on."""
+        self.acmisettle.updates(self.ACMI,beam_counts)
+        S = [[int(x) for x in ADC] for ADC in self.acmisettle.settled]    #The settled updates are the first samples
+        Bstats = RunningStats()
+        for ADC in S:
+            Bstats.add(beam_counts(ADC))
+        count = self.acmirule.more(Bstats)
+        while(count > 0):
+            for n in range(0,count):
+                t,ADC = self.ACMI.next()     #All six ADC values of the next ACMI update, from one request
+                ADC = [int(x) for x in ADC]
+                S.append(ADC)
+                Bstats.add(beam_counts(ADC))
+            count = self.acmirule.more(Bstats)
+        self.acmirule.done(Bstats)
+        return S,Bstats
+
+    def pulse_area(self):
+        """Integral of one single shot, to see when the pulser output has settled."""
+        if(self.area):
+            return self.scope.area()     #The scope's own AREA of the shot, without transferring it
+        Vq,xincr1 = self.scope.waveform()
+        return integrate(Vq,xincr1,0)[0]
+
+    def acquire_pulses(self, pipe):
+        """Instrument thread: step the pulser and queue the raw scope blocks of every amplitude."""
+        scope = self.scope
+        for j in self.amps:
+            self.HPwrite(':SOUR:VOLT '+str(Vp[j]))
+            if(self.splitter):
+                acmi = self.pool.submit(self.sample_acmi,j)
+            scope.set('CH1:SCALE',CH1scale[j])
+            scope.set('TRIGGER:A:LEVEL:CH1',self.trigger*CH1scale[j])
+            pipe.wait()     # The settling shots and the next blocks reuse the scope buffer
+            self.scopesettle.wait(self.pulse_area)
+            count = self.shotrule.more()
+            N0 = 0
+            while(count > 0):
+                if(self.area):
+                    #Scope-side AREA measurement: only the areas and the statistics are transferred
+                    Astack,Amean,Astd,Vstack = scope.areas(count,curves=self.debug)
+                    print("Scope AREA Mean:",Amean,"Std:",Astd)
+                    xincr1 = 0.0
+                    if(self.debug):
+                        xincr1 = scope.preamble()['xincr']
+                    pipe.put((j,Vstack,xincr1,Astack))
+                elif(self.fastframe):
+                    #All shots of the batch in one FastFrame acquisition (the stack reuses the same buffer)
+                    if(self.window):
+                        Vstack,xincr1 = scope.frames(count,5000)
+                    else:
+                        Vstack,xincr1 = scope.frames(count)
+                    pipe.put((j,Vstack,xincr1,None))
+                else:
+                    for N in range(N0,N0+count):
+                        if(self.window and N==0):
+                            scope.transfer('CH1',0,5000)
+                        Vq,xincr1 = scope.waveform()
+                        if(self.window and N==0):
+                            lo,hi = locate(Vq)
+                            scope.window(lo,hi)
+                            Vq = Vq[lo:hi]
+                        pipe.put((j,Vq[np.newaxis],xincr1,None))
+                N0 += count
+                pipe.wait()     # The worker has the statistics of every shot so far
+                count = self.shotrule.more(self.Qstats[j])
+            pipe.put((j,None,xincr1,None))     # End of amplitude j
+            if(self.splitter):
+                self.ACMIsamples[j] = acmi.result()
+                if(self.adaptive):
+                    S,Bstats = self.ACMIsamples[j]
+                    self.sched.add(j,1000*self.Qstats[j].mean,Bstats.mean,saturated(S))
+
+    def integrate_pulses(self, block):
+        """Worker thread: baseline, clip and integrate the shots of one block and log them."""
+        j,Vstack,xincr1,Astack = block
+        if(Vstack is None and Astack is None):
+            #End of amplitude j: log its statistics and hand its averages to the GUI
+            self.shotrule.done(self.Qstats[j])
+            self.f.write(self.Istats[j].record('I',j,Vp[j])+"\n")
+            self.f.write(self.Qstats[j].record('Q',j,Vp[j])+"\n")
+            return [self.Last[j][0:6]+(None,xincr1,True)]
+        if(Vstack is not None):
+            if(self.waves is not None):
+                save(self.waves,j,Vstack,xincr1)
+            A = integrate(Vstack,xincr1,self.polarity,kernel=self.kernel)     #All shots of the block in one pass
+            if(Astack is None):
+                Astack = A
+        if(self.polarity < 0):
+            Integrals = np.abs(Astack)*1000000000*self.splitk
+            Qs = np.abs(charge(Astack))*self.splitk
+        else:
+            Integrals = Astack*-1000000000*self.splitk
+            Qs = -charge(Astack)*self.splitk
+        R = []
+        for k in range(0,len(Astack)):
+            N = self.Nshot.get(j,0)
+            self.Nshot[j] = N+1
+            if(N==0):
+                self.Istats[j] = RunningStats()
+                self.Qstats[j] = RunningStats()
+            Integral = Integrals[k]
+            Q = Qs[k]
+            self.Istats[j].add(Integral)
+            self.Qstats[j].add(Q)
+            line = str(j)+","+str(N)+","+str(Vp[j])+","+str(round(Integral,3))+","+str(round(Q,4))+"\n"
+            self.f.write(line)
+            Vq = None
+            if(Vstack is not None and k==len(Astack)-1):
+                Vq = Vstack[k].copy()   #Only the last shot of a block is plotted
+            R.append((j,N,Integral,Q,self.Istats[j].mean,self.Qstats[j].mean,Vq,xincr1,False))
+        self.Last[j] = R[-1]
+        return R
@@ -1,14 +1,34 @@
-from pylogix import PLC
 from math import sqrt
 import numpy as np
 import matplotlib.pyplot as plt
 import serial
 from time import sleep
-import pyvisa as visa
+from ScopeDriver import MSO64B, locate
+from Pipeline import Pipeline
+from Integrate import integrate, charge, save
+from Stats import RunningStats, Sequential, report
+from Settling import Settler
+from ACMIPlc import Sampler, PLCSession
 import socket
-import telnetlib3 as tn
+from Prologix import Prologix
 
 props = dict(boxstyle='round', facecolor='wheat', alpha=0.5)
+FASTFRAME = True   # Capture the 25 shots of each amplitude in one FastFrame acquisition
+WINDOW = False     # Transfer only the pulse window located in the first shot (leaves the rest of the record out of the charge)
+GUIPERIOD = 0.2    # Sec between plot updates while the acquisition runs in the background
+KERNEL = 'rect'     # Integration kernel of the shots: 'rect', 'trapz', 'simpson' or 'gated' (see Integrate.py)
+SAVEWAVES = False  # Also save the shots (Volts) to <fname>.wav for comparing the kernels offline
+SEQUENTIAL = False # Average every amplitude only until its mean charge is known to QTARGET (see Stats.Sequential)
+QTARGET = [0.5,0.1] # Target standard error of the mean charge: pC, or % of the charge when that is larger
+SHOTS = [8,100]    # Fewest and most scope shots per amplitude with SEQUENTIAL (25 without)
+SAMPLES = [6,48]   # Fewest and most ACMI samples per amplitude with SEQUENTIAL (16 without)
+SCOPESETTLE = Settler(tol=0.005,count=3,dwell=0.1,timeout=1.0,name='Scope')   # Wait for stable scope integrals after an amplitude step
+ACMINOISE = 0.055  # rms nC of the beam charge of one ACMI update (5.5 ADC counts in ACMI2026_Mar/Results/posacmi.raw at about 0.01 nC per count)
+ACMISETTLE = Settler(tol=0.0,absolute=4*sqrt(2)*ACMINOISE,count=2,dwell=0.5,timeout=15.0,change=True,name='ACMI')   # Wait for two ACMI updates after the first one past the step that agree within 4 sigma of the noise of their difference
+EPICS = False      # Take the ACMI charges from EPICS CA monitors on Qpvs instead of polling the PLC tags
+Qpvs = ['ACMI_BEAM_Q','ACMI_ST1_QAB','ACMI_ST1_QBA']
+if(EPICS):
+    from ACMIEpics import MonitorSampler
 
 plt.ion()
 
@@ -22,21 +42,15 @@ plt.ion()
 # )
 # sleep(0.5)  # Give the port time to settle
 
-tnet = tn.Telnet('10.0.128.150','1234')
+pulser = Prologix('10.0.128.150',14)   # HP8114A at GPIB address 14, controller mode with *OPC? handshakes
 
 def HPwrite(cmd):
-    tnet.write((cmd + "\n").encode("ascii"))
-    sleep(0.1)
+    pulser.write(cmd)
 
 def HPread():
-    return tnet.read_until(b'\n',7)
+    return pulser.read()
 
-# Put Prologix in controller mode and set GPIB address
-HPwrite("++mode 1")      # Controller mode
-HPwrite("++addr 14")      # Change to HP8114A's GPIB address
-HPwrite("++auto 1")      # Automatically read response after write
-HPwrite("*IDN?")
-response = HPread()
+response = pulser.query("*IDN?")
 print(response)
 model = int(response[18:22])
 if(model != 8114):
@@ -44,19 +58,9 @@ if(model != 8114):
     exit()
 else:
     print('HP8114A Pusle Generator FOUND.')   
-    HPwrite(':SOUR:VOLT 0.0')
-    sleep(0.5)
-    HPwrite(':OUTP:POL NEG')
-    sleep(0.5)
-    HPwrite(':SOUR:PULS:DEL 5US')
-    sleep(0.5)
-    HPwrite(':SOUR:PULS:WIDT 50.0NS')
-    sleep(0.5)
-    HPwrite(':SOUR:VOLT 1.0')
-    sleep(0.5)
+    pulser.batch([':SOUR:VOLT 0.0',':OUTP:POL NEG',':SOUR:PULS:DEL 5US',':SOUR:PULS:WIDT 50.0NS',':SOUR:VOLT 1.0'])
     
-rm = visa.ResourceManager()
-scope = rm.open_resource('TCPIP0::10.0.128.110::inst0::INSTR')
+scope = MSO64B('TCPIP0::10.0.128.110::inst0::INSTR')   # or 'TCPIP0::10.0.128.110::4000::SOCKET' (raw socket server)
 response = scope.query('*IDN?')
 serial_number = int(response[18:24])
 if(serial_number != 13046):
@@ -65,20 +69,21 @@ if(serial_number != 13046):
 else:
     print('Tektronix MSO64B Scope FOUND.')
     
-with PLC() as comm:
-    comm.IPAddress = '10.0.128.47'
-    
-    device = comm.GetModuleProperties(0).Value
-    if(device.ProductName != "1768-L43S/B LOGIX5343SAFETY"):
-        print("1768-L43S/B PLC NOT FOUND...exiting")
-        exit()
-    else:
-        print("1768-L43S/B PLC FOUND.\n\n")
+comm = PLCSession('10.0.128.47')    # One connection for the whole sweep, reconnected if it drops
+device = comm.connect()
+if(device.ProductName != "1768-L43S/B LOGIX5343SAFETY"):
+    print("1768-L43S/B PLC NOT FOUND...exiting")
+    exit()
+else:
+    print("1768-L43S/B PLC FOUND.\n\n")
         
 # Declare the PLC Tags for this test:
 Bmtag = 'ACMI_BEAM_Q'
 STABtag = 'ACMI_ST1_QAB'
 STBAtag = 'ACMI_ST1_QBA'
+Qtags = [Bmtag,STABtag,STBAtag]
+Counttag = None     # ACMI update counter tag if the PLC program has one; without it an update is seen as a change of the charges
+ACMIPERIOD = 2.2    # Sec between ACMI updates, which times the updates that repeat the charges when there is no counter tag
 
 #Get the Current ACMI Calibration Parameters:
 bm1 = float(comm.Read(Bmtag).Value)
@@ -96,6 +101,9 @@ if(int(year)<2024 or int(year)>2064):
     print("Bad Year Input... Exiting.")
     exit()
 fname = input("Enter file name for data (No Extension): ")
+runlog = open("/ACMICal" + year + "/"+fname+".log","w")
+scope.retry.log = runlog
+comm.retry.log = runlog
 
 fq,axq = plt.subplots(1,2,figsize=(12,6))
 
@@ -103,96 +111,137 @@ CH1scale=[0.2,0.5,0.5,0.5,1,1,1,1,1,2,2,2,2,2,2,2,2,2,5,5,5,5,5] #in Volts/Divis
 Vp = [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23] #in Volts for Pulse Amplitude
 
 #Set up the scope:
-scope.write('HOR:RECO 5000')
-scope.write('TRIGGER:A:MODE NORM')
-scope.write('TRIGGER:A:TYPE EDGE')
-scope.write('TRIGGER:A:EDGE:SOURCE CH1')
-scope.write('TRIGGER:A:EDGE:SLOPE FALL')
-scope.write('TRIGGER:A:EDGE:COUPLING DC')
-scope.write('HORIZONTAL:MODE MANUAL')
-scope.write('HORIZONTAL:MODE:SAMPLERATE 25.0E9')
-scope.write('HORIZONTAL:SCALE 4e-8')
-scope.write('HORIZONTAL:POS 10')
+scope.set('HOR:RECO','5000')
+scope.set('TRIGGER:A:MODE','NORM')
+scope.set('TRIGGER:A:TYPE','EDGE')
+scope.set('TRIGGER:A:EDGE:SOURCE','CH1')
+scope.set('TRIGGER:A:EDGE:SLOPE','FALL')
+scope.set('TRIGGER:A:EDGE:COUPLING','DC')
+scope.set('HORIZONTAL:MODE','MANUAL')
+scope.set('HORIZONTAL:MODE:SAMPLERATE','25.0E9')
+scope.set('HORIZONTAL:SCALE','4e-8')
+scope.set('HORIZONTAL:POS','10')
 scope.write('*WAI')
-scope.write('CH1:SCALE 0.200')
-scope.write('CH1:POS 4.5')
+scope.set('CH1:SCALE','0.200')
+scope.set('CH1:POS','4.5')
+scope.transfer('CH1',0,5000)
 
 Qtest = []
 Itest = []
 Vtest= []   
 f = open("/ACMICal" + year + "/"+fname+".txt","w")
+if(SAVEWAVES):
+    waves = open("/ACMICal" + year + "/"+fname+".wav","wb")
 
-for j in range(0,23):
-    HPwrite(':SOUR:VOLT '+str(Vp[j]))
-    sleep(1)
-    sleep(1)
-    Vtest.append(Vp[j])
-    Qhist=[]
-    Ihist=[]
-    for N in range(0,25):
-        scope.write('CH1:SCALE '+str(CH1scale[j]))
-        scope.write('TRIGGER:A:LEVEL:CH1 '+str(-CH1scale[j]/2.0))
-        scope.write('ACQUIRE:STOPAFTER SEQUENCE')
-        scope.write('ACQUIRE:STATE 1')
-        scope.write('*WAI')
-    
-        good=0
-        while(good==0):
-            try:
-                scope.write('ACQUIRE:STOPAFTER SEQUENCE')
-                scope.write('ACQUIRE:STATE 1')
-                scope.write('*WAI')
-                scope.write('DATA:SOU CH1')
-                scope.write('DATA:START 0')
-                scope.write('DATA:STOP 5000')
-                scope.write('DATA:WIDTH 2')
-                scope.write('DATA:ENC RIB')
-                scope.write('WFMOUTPRE:BYT_NR 2')
+SHOTRULE = Sequential(25,25)    #Scope shots per amplitude
+if(SEQUENTIAL):
+    SHOTRULE = Sequential(SHOTS[0],SHOTS[1],QTARGET[0]/1000.0,QTARGET[1]/100.0,batch=scope.buf.shots)
 
-                scope.query('*OPC?')
-    
-                ymult1 = float(scope.query('WFMPRE:YMULT?'))
-                yzero1 = float(scope.query('WFMPRE:YZERO?'))
-                yoff1 = float(scope.query('WFMPRE:YOFF?'))
-                xincr1 = float(scope.query('WFMPRE:XINCR?'))
+def pulse_area():
+    #Integral of one single shot, to see when the pulser output has settled
+    Vq,xincr1 = scope.waveform()
+    return integrate(Vq,xincr1,0)[0]
 
-                scope.write('CURVE?')
+def acquire_pulses(pipe):
+    #Instrument thread: step the pulser and queue the raw scope blocks of every amplitude
+    for j in range(0,23):
+        HPwrite(':SOUR:VOLT '+str(Vp[j]))
+        scope.set('CH1:SCALE',CH1scale[j])
+        scope.set('TRIGGER:A:LEVEL:CH1',-CH1scale[j]/2.0)
+        pipe.wait()     # The settling shots and the next blocks reuse the scope buffer
+        SCOPESETTLE.wait(pulse_area)
+        count = SHOTRULE.more()
+        N0 = 0
+        while(count > 0):
+            if(FASTFRAME):
+                #All shots of the batch in one FastFrame acquisition (the stack reuses the same buffer)
+                if(WINDOW):
+                    Vstack,xincr1 = scope.frames(count,5000)
+                else:
+                    Vstack,xincr1 = scope.frames(count)
+                pipe.put((j,Vstack,xincr1,None))
+            else:
+                for N in range(N0,N0+count):
+                    if(WINDOW and N==0):
+                        scope.transfer('CH1',0,5000)
+                    Vq,xincr1 = scope.waveform()
+                    if(WINDOW and N==0):
+                        lo,hi = locate(Vq)
+                        scope.window(lo,hi)
+                        Vq = Vq[lo:hi]
+                    pipe.put((j,Vq[np.newaxis],xincr1,None))
+            N0 += count
+            pipe.wait()     # The worker has the statistics of every shot so far
+            count = SHOTRULE.more(Qstats[j])
+        pipe.put((j,None,xincr1,None))     # End of amplitude j
 
-                data1 = scope.read_raw()
-                sleep(0.1)
-                good = 1
-            except:
-                good = 0
-        header_len_digits = int(data1[1:2])
-        num_bytes = int(data1[2:2+ header_len_digits])
-        bin_start = 2 + header_len_digits
-        bin_end = bin_start + num_bytes
-        ADC_wave1 = data1[bin_start:bin_end]
-        print(len(ADC_wave1))
-        CH1 = []
+Nshot = {}
+Istats = {}     #Running integral and charge statistics of every amplitude
+Qstats = {}
+Last = {}       #Last shot result of every amplitude
+def integrate_pulses(block):
+    #Worker thread: baseline, clip and integrate the shots of one block and log them
+    j,Vstack,xincr1,Astack = block
+    if(Vstack is None and Astack is None):
+        #End of amplitude j: log its statistics and hand its averages to the GUI
+        SHOTRULE.done(Qstats[j])
+        f.write(Istats[j].record('I',j,Vp[j])+"\n")
+        f.write(Qstats[j].record('Q',j,Vp[j])+"\n")
+        return [Last[j][0:6]+(None,xincr1,True)]
+    if(Vstack is not None):
+        if(SAVEWAVES):
+            save(waves,j,Vstack,xincr1)
+        A = integrate(Vstack,xincr1,-1,kernel=KERNEL)     #All shots of the block in one pass
+        if(Astack is None):
+            Astack = A
+    Integrals = np.abs(Astack)*1000000000
+    Qs = np.abs(charge(Astack))
+    R = []
+    for k in range(0,len(Astack)):
+        N = Nshot.get(j,0)
+        Nshot[j] = N+1
+        if(N==0):
+            Istats[j] = RunningStats()
+            Qstats[j] = RunningStats()
+        Integral = Integrals[k]
+        Q = Qs[k]
+        Istats[j].add(Integral)
+        Qstats[j].add(Q)
+        line = str(j)+","+str(N)+","+str(Vp[j])+","+str(round(Integral,3))+","+str(round(Q,4))+"\n"
+        f.write(line)
+        Vq = None
+        if(Vstack is not None and k==len(Astack)-1):
+            Vq = Vstack[k].copy()   #Only the last shot of a block is plotted
+        R.append((j,N,Integral,Q,Istats[j].mean,Qstats[j].mean,Vq,xincr1,False))
+    Last[j] = R[-1]
+    return R
 
-        waveform = np.frombuffer(ADC_wave1, dtype='>i2')   
-        Vq = (waveform - yoff1) * ymult1 + yzero1
-        Tq = np.arange(len(Vq)) * xincr1
-        
-        BL = sum(Vq[0:50])/50.0
-        Vq = np.subtract(Vq,BL)
-        for i in range(0,len(Vq)):
-            if(Vq[i]>0): Vq[i] = 0
+pipe = Pipeline(acquire_pulses,integrate_pulses).start()
+Vlast = np.zeros(0)
+Tlast = np.zeros(0)
+while(True):
+    running = pipe.alive()
+    R = pipe.results()
+    for (j,N,Integral,Q,Iavg,Qavg,Vq,xincr1,done) in R:
+        if(Vq is not None):
+            Vlast = Vq
+            Tlast = np.arange(len(Vq)) * xincr1
+        if(done):
+            Vtest.append(Vp[j])
+            Qtest.append(Qavg)
+            Itest.append(Iavg)
+            axq[1].clear()
+            axq[1].plot(Vtest,Qtest,'-o',markersize=4)
+            axq[1].grid(color='lightgray',linestyle='-',linewidth=1)
+            axq[1].set_xlabel("Pulser Amplitude (Volts)")
+            axq[1].set_ylabel("Measured Test Charge (nC)") 
+    if(len(R)>0):
         axq[0].clear()
-        axq[0].plot(Tq,Vq,label='Scope Data')
+        axq[0].plot(Tlast,Vlast,label='Scope Data')
         axq[0].grid(color='lightgray',linestyle='-',linewidth=1)
         axq[0].set_xlabel("Time (nSec)")
         axq[0].set_ylabel("Voltage")
         axq[0].legend(loc='lower right')
-        Integral = abs(sum(Vq)*xincr1*1000000000)
-        Ihist.append(Integral)
-        Q = abs(sum(Vq)*xincr1*2e7)
-        Qhist.append(Q)
-        Qavg = sum(Qhist)/len(Qhist)
-        Iavg = sum(Ihist)/len(Ihist)
-        line = str(j)+","+str(N)+","+str(Vp[j])+","+str(round(Integral,3))+","+str(round(Q,4))+"\n"
-        f.write(line)
         axq[0].text(0.6, 0.93, 'N:'+str(N),
                 transform=axq[0].transAxes, fontsize=12,verticalalignment='top', bbox=props)
         axq[0].text(0.6, 0.85, 'Qavg:'+str(round(Qavg,4))+"nC",
@@ -203,16 +252,11 @@ for j in range(0,23):
                 transform=axq[0].transAxes, fontsize=12,verticalalignment='top', bbox=props)   
         axq[0].text(0.6, 0.57, 'Ilast:'+str(round(Integral,3))+"nVS",
                 transform=axq[0].transAxes, fontsize=12,verticalalignment='top', bbox=props)      
-        plt.pause(0.1)
-    Qtest.append(Qavg)
-    Itest.append(Iavg)
-    axq[1].clear()
-    axq[1].plot(Vtest,Qtest,'-o',markersize=4)
-    axq[1].grid(color='lightgray',linestyle='-',linewidth=1)
-    axq[1].set_xlabel("Pulser Amplitude (Volts)")
-    axq[1].set_ylabel("Measured Test Charge (nC)") 
-    plt.pause(0.1)
+    if(not running):
+        break
+    plt.pause(GUIPERIOD)
 
+report(["Scope trigger wait: "+str(round(np.mean(scope.waits),4))+" Sec avg, "+str(round(np.max(scope.waits),4))+" Sec max over "+str(len(scope.waits))+" acquisitions"],runlog)
 HPwrite(':SOUR:VOLT 1.0\n')
 sleep(5)  
 fq.savefig(fname+'testpulse.png')
@@ -236,22 +280,44 @@ Vtest = []
 BM = []
 STA = []
 STB = []
+if(EPICS):
+    ACMI = MonitorSampler(Qpvs)
+else:
+    ACMI = Sampler(comm,Qtags,Counttag,period=ACMIPERIOD)
+def beam_q(Q):
+    #The beam charge of an ACMI update, which the settling is judged on
+    return float(Q[0])
+ACMIRULE = Sequential(16,16)    #ACMI samples per amplitude, on the beam charge
+if(SEQUENTIAL):
+    ACMIRULE = Sequential(SAMPLES[0],SAMPLES[1],QTARGET[0]/1000.0,QTARGET[1]/100.0)
+
 for j in range(0,23):
     HPwrite(':SOUR:VOLT '+str(Vp[j]))
-    sleep(1)
-    sleep(3)
+    ACMISETTLE.updates(ACMI,beam_q)
     Vtest.append(Vp[j])
     B=[]
     TA=[]
     TB=[]
     Qerr=[]
-    print(comm.Read(Bmtag).Value)
-    for n in range(0,16):
-        B.append(float(comm.Read(Bmtag).Value))
-        TA.append(float(comm.Read(STABtag).Value))
-        TB.append(float(comm.Read(STBAtag).Value))
-        print(n,round(Qtest[j],3),B[n],TA[n],TB[n])
-        sleep(2.2)
+    print(ACMI.latest()[0])     #Beam charge of the last settling update, from the selected backend
+    Bstats = RunningStats()
+    n = 0
+    settled = list(ACMISETTLE.settled)     #The settled updates are the first samples
+    count = ACMIRULE.more()
+    while(count > 0):
+        for k in range(0,count):
+            if(len(settled) > 0):
+                ACMIQ = settled.pop(0)
+            else:
+                t,ACMIQ = ACMI.next()     #Beam and self test charges of the next ACMI update
+            B.append(float(ACMIQ[0]))
+            TA.append(float(ACMIQ[1]))
+            TB.append(float(ACMIQ[2]))
+            Bstats.add(B[n])
+            print(n,round(Qtest[j],3),B[n],TA[n],TB[n])
+            n += 1
+        count = ACMIRULE.more(Bstats)
+    ACMIRULE.done(Bstats)
         
     BM.append(np.mean(B))
     STA.append(np.mean(TA))
@@ -259,6 +325,7 @@ for j in range(0,23):
     print("Averages:",j,Vp[j],Qtest[j],BM[j],STA[j],STB[j])
     mess = str(j)+','+str(Vp[j])+','+str(round(Qtest[j],4))+','+str(round(BM[j],4))+','+str(round(STA[j],4))+','+str(round(STB[j],4))+'\n'
     f.write(mess)
+    f.write(Bstats.record('B',j,Vp[j])+"\n")
     axbm[0][0].clear()
     axbm[0][1].clear()
     axbm[1][0].clear()
@@ -340,4 +407,13 @@ HPwrite(':SOUR:VOLT 0.0\n')
 sleep(1)
 fbm.savefig(fname+'beam.png')
 fst.savefig(fname+'selftest.png')
+scope.retry.write(scope.retry.summary())
+report([SCOPESETTLE.summary(),ACMISETTLE.summary(),ACMI.summary(),SHOTRULE.summary('Scope'),ACMIRULE.summary('ACMI'),
+        comm.summary(),pulser.summary()],runlog)
+comm.close()
+if(EPICS):
+    ACMI.close()
+if(SAVEWAVES):
+    waves.close()
+runlog.close()
 plt.show(block=True)
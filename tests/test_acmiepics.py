@@ -0,0 +1,71 @@
+import os
+import sys
+import subprocess
+from time import time, sleep
+import numpy as np
+import pytest
+
+pytest.importorskip('caproto')
+epics = pytest.importorskip('epics')
+
+from ACMIEpics import MonitorSampler
+
+# The soft IOC of ACMISoftIOC.py in a subprocess, with a prefix of its own and a short update
+# period, reached over the loopback interface only
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PREFIX = 'TEST'+str(os.getpid())+':'
+PERIOD = 0.2
+QPVS = [PREFIX+name for name in ['ACMI_BEAM_Q','ACMI_ST1_QAB','ACMI_ST1_QBA']]
+
+@pytest.fixture(scope='module')
+def ioc():
+    os.environ['EPICS_CA_AUTO_ADDR_LIST'] = 'NO'
+    os.environ['EPICS_CA_ADDR_LIST'] = '127.0.0.1'
+    env = dict(os.environ)
+    env['EPICS_CAS_INTF_ADDR_LIST'] = '127.0.0.1'
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'ACMISoftIOC.py'), '--prefix', PREFIX, '--quiet'], cwd=ROOT, env=env)
+    try:
+        pv = epics.PV(PREFIX+'ACMI_SIM_PERIOD')
+        if(not pv.wait_for_connection(20.0)):
+            pytest.fail('The soft IOC did not come up')
+        pv.put(PERIOD, wait=True)
+        epics.caput(PREFIX+'ACMI_SIM_Q', 2.5, wait=True)
+        yield proc
+    finally:
+        proc.terminate()
+        proc.wait(10.0)
+
+def test_monitor_sampler(ioc):
+    t0 = time()
+    ACMI = MonitorSampler(QPVS, timeout=10.0)
+    try:
+        assert all([n >= 1 for n in ACMI.received])
+        S = [ACMI.next() for n in range(0, 6)]
+        received = list(ACMI.received)
+    finally:
+        ACMI.close()
+    T = np.array([t for t, V in S])
+    # The connect-time values, posted before the sampler was made, are not taken as the first
+    # sample even without a start()
+    assert T[0] > t0
+    # One sample per update: consecutive samples are one period apart, none taken twice (0)
+    # and none skipped (2 periods)
+    assert np.all(np.abs(np.diff(T)-PERIOD) < PERIOD/2.0)
+    assert all([abs(V[0]-2.5) < 0.1 and abs(V[1]-1.0) < 0.1 for t, V in S])
+    assert ACMI.timeouts == 0 and ACMI.dropped == 0
+    assert ACMI.skew < PERIOD/2.0
+    assert min(received) >= 7       # The connect-time value and the six samples
+    assert ACMI.summary().startswith('ACMI monitors: ')
+
+def test_start_drops_buffered(ioc):
+    # Updates that arrive before start() are not samples of the next amplitude
+    ACMI = MonitorSampler(QPVS, timeout=10.0)
+    try:
+        sleep(2.5*PERIOD)
+        assert all([len(q) >= 2 for q in ACMI.updates])
+        ACMI.start()
+        t0 = time()
+        t, V = ACMI.next()
+    finally:
+        ACMI.close()
+    assert t > t0-0.05 and ACMI.timeouts == 0
@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+
+from ACMIPlc import Sampler, PLCSession, PLCError, read_tags
+from Simulator import Lab, FakeACMI
+
+PREFIX = 'Program:Main_Loop.'
+ADCtags = [PREFIX+t for t in ['Beam_ADCA','Beam_ADCB','ST1AB_ADCA','ST1AB_ADCB','ST1BA_ADCA','ST1BA_ADCB']]
+COUNTER = PREFIX+'Update_Count'
+
+@pytest.fixture
+def bench():
+    lab = Lab({'acmi_period':0.02, 'plc':0.0}, seed=1)
+    lab.set_volts(5.0)
+    acmi = FakeACMI(lab)
+    comm = PLCSession('10.0.128.47', driver=acmi.PLC)
+    comm.connect()
+    yield acmi, comm
+    comm.close()
+
+def test_read_tags(bench):
+    acmi, comm = bench
+    t, V = read_tags(comm, ADCtags+[COUNTER])
+    assert len(V) == 7 and V[6] == acmi.count
+    with pytest.raises(PLCError):
+        read_tags(comm, ['Program:Main_Loop.Nope'])
+
+def test_sampler_counter(bench):
+    acmi, comm = bench
+    ACMI = Sampler(comm, ADCtags+[PREFIX+'Fit_Off'], COUNTER, poll=0.001)
+    ACMI.start()
+    counts = []
+    for n in range(0, 5):
+        t, V = ACMI.next()
+        assert len(V) == 7
+        counts.append(acmi.count)
+        assert ACMI.latest() == V
+    assert counts == list(range(counts[0], counts[0]+5))      # Every update once
+    assert len(ACMI.periods) == 4
+    assert min(ACMI.periods) > 0.01
+    assert ACMI.missed == 0 and ACMI.timeouts == 0
+
+def test_sampler_changes(bench):
+    # Without a counter an update is a change of the values (the ADC noise changes them)
+    acmi, comm = bench
+    ACMI = Sampler(comm, ADCtags, poll=0.001, period=0.02)
+    ACMI.start()
+    last = None
+    for n in range(0, 3):
+        t, V = ACMI.next()
+        assert V != last
+        last = V
+    assert ACMI.summary().startswith('ACMI updates: 2 periods')
+
+def test_sampler_timeout(bench):
+    acmi, comm = bench
+    acmi.lab.latency['acmi_period'] = 100.0
+    ACMI = Sampler(comm, ADCtags, COUNTER, poll=0.001, timeout=0.02)
+    ACMI.start()
+    ACMI.next()
+    ACMI.next()
+    assert ACMI.timeouts == 2
+
+def test_session_reconnects():
+    lab = Lab({'acmi_period':0.02, 'plc':0.0}, seed=2)
+    acmi = FakeACMI(lab, drop=0.05)
+    comm = PLCSession('10.0.128.47', driver=acmi.PLC)
+    comm.retry.base = 0.0
+    comm.retry.cap = 0.0
+    for n in range(0, 50):
+        t, V = read_tags(comm, ADCtags)
+        assert len(V) == 6
+    assert comm.connects > 1 and comm.reads == 50
+
+def test_sampler_needs_counter_or_period(bench):
+    acmi, comm = bench
+    with pytest.raises(ValueError):
+        Sampler(comm, ADCtags)
+
+@pytest.mark.parametrize('volts', [30.0, 5.0])
+def test_sampler_repeats(volts):
+    # Without ADC noise every update repeats the values, saturated at 2047 or not.  Without a
+    # counter the repeated updates are timed from the period instead of waiting for the
+    # timeout, and a change half way is taken once: every update once, in turn.
+    lab = Lab({'acmi_period':0.05, 'plc':0.0}, tau=1e-6, noise=0.0, seed=1)
+    lab.set_volts(volts)
+    acmi = FakeACMI(lab, noise=0.0, common=0.0)
+    comm = PLCSession('10.0.128.47', driver=acmi.PLC)
+    comm.connect()
+    ACMI = Sampler(comm, ADCtags, poll=0.002, timeout=1.0, period=0.05)
+    ACMI.start()
+    counts = []
+    values = []
+    for n in range(0, 8):
+        if(n == 4):
+            lab.set_volts(volts+1.0)
+        t, V = ACMI.next()
+        counts.append(acmi.count)
+        values.append(V)
+    comm.close()
+    assert (values[0][0] == 2047) == (volts == 30.0)
+    assert values[1:4] == values[0:3] and values[5:8] == values[4:7]
+    assert counts == list(range(counts[0], counts[0]+8))
+    assert ACMI.timeouts == 0 and ACMI.repeats >= 6
+    assert max([abs(p-0.05) for p in ACMI.periods]) < 0.02
+    assert ACMI.summary().startswith('ACMI updates: 7 periods')
+
+def test_fake_noise():
+    # The simulated ADC noise of the bench run in ACMI2026_Mar/Results/posacmi.raw: 6.2 counts
+    # rms on ADCA, 6.5 on ADCB and 5.5 on A-B
+    lab = Lab({'acmi_period':1e-9}, tau=1e-9, noise=0.0, seed=3)     # A new update on every call
+    lab.set_volts(5.0)
+    acmi = FakeACMI(lab)
+    V = []
+    for n in range(0, 4000):
+        acmi.update()
+        V.append([acmi.tags[tag] for tag in ADCtags[0:2]])
+    V = np.array(V, dtype=float)
+    assert np.std(V[:,0]) == pytest.approx(6.3, rel=0.1)
+    assert np.std(V[:,1]) == pytest.approx(6.3, rel=0.1)
+    assert np.std(V[:,0]-V[:,1]) == pytest.approx(5.5, rel=0.1)
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from AmpScheduler import AmpScheduler, FULLSCALE
+from Simulator import Lab, FakeACMI
+
+Vp = list(range(1,24))
+
+def bench(seed=1, gain=180.0):
+    """Charge (pC) at the ICT test input and ACMI beam counts of the simulator per pulser V."""
+    lab = Lab(gain=gain, seed=seed)
+    acmi = FakeACMI(lab)
+    att = 10.0**(-lab.attenuator/20.0)
+
+    def measure(v):
+        q = lab.charge(v)*att
+        counts = np.mean([acmi.adc(q) - acmi.adc(0.0) for n in range(0, 16)])
+        return 1000.0*q, counts, acmi.adc(q) >= FULLSCALE
+    return measure
+
+def sweep(sched, measure):
+    for j in sched:
+        q, counts, saturated = measure(sched.volts[j])
+        sched.add(j, q, counts, saturated)
+    return sched
+
+def test_sweep():
+    measure = bench()
+    sched = sweep(AmpScheduler(Vp), measure)
+    n = len(sched.order)
+    assert sorted(set(sched.order)) == sorted(sched.order)      # Every amplitude at most once
+    assert n < len(Vp)
+    assert sched.order[0:len(sched.seeds)] == sched.seeds
+    assert sched.order[-len(sched.checks):] == sched.checks == [20, 21, 22]
+    assert all([sched.saturates(j) for j in sched.checks])
+    J = sched.fitted()
+    assert len(J) >= sched.minimum
+    assert not any([sched.saturates(j) for j in J])
+    assert sched.converged()
+    assert sched.uncertainty() <= sched.tol
+    assert 'saturation checks' in sched.summary()
+
+def test_fit_matches_full_sweep():
+    measure = bench(seed=2)
+    sched = sweep(AmpScheduler(Vp), measure)
+    J = sched.fitted()
+    full = [measure(v) for v in Vp[0:J[-1]+1]]
+    pall = np.polyfit([m[1] for m in full], [m[0] for m in full], 2)
+    C = np.linspace(0.0, max([m[1] for m in full]), 50)
+    assert np.max(np.abs(np.polyval(pall, C) - np.polyval(sched.pfit, C))) < 3*sched.tol
+
+def test_fitcount():
+    sched = sweep(AmpScheduler(Vp), bench())
+    V = sorted([sched.volts[j] for j in sched.order])
+    L = sched.fitcount(V)
+    assert V[0:L] == [sched.volts[j] for j in sched.fitted()]
+    assert L >= 3
+
+def test_fitcount_early():
+    # Before the seeds are in there is no fit, and fewer than three points below saturation
+    sched = AmpScheduler(Vp)
+    measure = bench()
+    j = next(iter(sched))
+    sched.add(j, *measure(sched.volts[j]))
+    assert sched.fitcount([sched.volts[j]]) == 1
+    assert sched.pfit is None and sched.uncertainty() == np.inf
+
+def test_saturation_limit():
+    # A larger gain saturates the ADC at a lower amplitude, which moves the fit range down
+    low = sweep(AmpScheduler(Vp), bench(gain=180.0))
+    high = sweep(AmpScheduler(Vp), bench(gain=400.0))
+    assert high.limit() < low.limit()
+    assert max(high.fitted()) < max(low.fitted())
+    assert all([high.volts[j] < high.limit() for j in high.fitted()])
+
+def test_add_required():
+    sched = AmpScheduler(Vp)
+    it = iter(sched)
+    next(it)
+    with pytest.raises(RuntimeError):
+        next(it)
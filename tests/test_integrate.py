@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from Integrate import KERNELS, integrate, gate, charge, save, load, BASELINE, GATEFRAC, GATEPAD
+
+XINCR = 40e-12      # 25 GS/s
+# Relative error of each kernel on the sin^2 pulse.  The gate leaves out the tails of the
+# pulse below GATEFRAC of the peak (about 2e-4 of the area here).
+RTOL = {'rect':1e-9, 'trapz':1e-9, 'simpson':1e-9, 'gated':5e-4}
+
+def sin2(shots=3, samples=5000, start=1000, width=1250, amplitude=-0.8):
+    """Shots of a sin^2 pulse of amplitude (V) and width samples starting at sample start.
+    Its area is amplitude*width*XINCR/2."""
+    V = np.zeros((shots,samples))
+    k = np.arange(width)
+    V[:,start:start+width] = amplitude*np.sin(np.pi*k/width)**2
+    return V, amplitude*width*XINCR/2.0
+
+@pytest.mark.parametrize('kernel', sorted(KERNELS))
+def test_sin2_area(kernel):
+    V, area = sin2()
+    A = integrate(V, XINCR, -1, kernel=kernel)
+    assert A.shape == (3,)
+    assert np.allclose(A, area, rtol=RTOL[kernel], atol=0)
+
+@pytest.mark.parametrize('kernel', sorted(KERNELS))
+def test_positive_pulse(kernel):
+    V, area = sin2(amplitude=0.5)
+    assert np.allclose(integrate(V, XINCR, 1, kernel=kernel), area, rtol=RTOL[kernel], atol=0)
+
+@pytest.mark.parametrize('kernel', sorted(KERNELS))
+def test_baseline_offset(kernel):
+    V, area = sin2()
+    V += 0.03       # DC offset, which the baseline takes off
+    assert np.allclose(integrate(V, XINCR, -1, kernel=kernel), area, rtol=RTOL[kernel], atol=0)
+
+@pytest.mark.parametrize('kernel', sorted(KERNELS))
+def test_flat_record(kernel):
+    V = np.full((2,5000), 0.25)
+    assert np.allclose(integrate(V, XINCR, 0, kernel=kernel), 0.0)
+    assert np.all(V == 0.0)     # Baselined in place
+
+def test_polarity_mask():
+    V, area = sin2()
+    V[:,3000:3100] = 0.4        # Overshoot on the other side of the baseline
+    assert np.allclose(integrate(V.copy(), XINCR, -1), area, rtol=1e-9, atol=0)
+    assert integrate(V.copy(), XINCR, 0)[0] > area      # Both sides kept
+
+def test_single_shot():
+    V, area = sin2(shots=1)
+    A = integrate(V[0], XINCR)
+    assert A.shape == (1,)
+    assert A[0] == pytest.approx(area)
+
+def test_unknown_kernel():
+    V, area = sin2()
+    with pytest.raises(ValueError):
+        integrate(V, XINCR, kernel='boxcar')
+
+def test_simpson_even_record():
+    # Even number of samples: Simpson on all but the last interval, a trapezoid on that one
+    x = np.linspace(0.0, 1.0, 1000)
+    V = np.atleast_2d(x**3)
+    assert KERNELS['simpson'](V, x[1]-x[0])[0] == pytest.approx(0.25, rel=1e-6)
+
+def test_gate():
+    V, area = sin2(start=1000, width=1250)
+    above = np.nonzero(np.abs(V[0]) > GATEFRAC*0.8)[0]
+    assert gate(V) == (above[0]-GATEPAD, above[-1]+GATEPAD+1)
+    V[1:] = 0.0     # Placed on the first shot only
+    assert gate(V) == (above[0]-GATEPAD, above[-1]+GATEPAD+1)
+
+def test_gate_edges():
+    V = np.zeros((1,500))
+    V[0,5:20] = -1.0
+    V[0,490:] = -1.0
+    assert gate(V) == (0, 500)
+
+def test_gate_flat_record():
+    assert gate(np.zeros((2,5000))) == (0, 5000)
+
+def test_charge():
+    # 1 V for 50 nSec into 50 Ohm is 1 nC
+    assert charge(50e-9) == pytest.approx(1.0)
+    assert np.allclose(charge([50e-9, -100e-9], ohms=25.0), [2.0, -4.0])
+
+def test_save_load(tmp_path):
+    fname = tmp_path/'x.wav'
+    A, a = sin2(shots=2)
+    B, b = sin2(shots=1, samples=600, start=BASELINE+10, width=100)
+    with open(fname, 'wb') as f:
+        save(f, 3, A, XINCR)
+        save(f, 3, A[0], XINCR)     # Same amplitude and length: joined to the first block
+        save(f, 4, B, XINCR)
+    blocks = load(fname)
+    assert sorted(blocks) == [(3,5000), (4,600)]
+    V, xincr = blocks[(3,5000)]
+    assert V.shape == (3,5000) and xincr == XINCR
+    assert np.array_equal(V[2], A[0])
+    assert np.array_equal(blocks[(4,600)][0], B)
@@ -0,0 +1,66 @@
+from Pipeline import Pipeline
+
+def run(pipe):
+    """Drain the results like the scripts' GUI loop until both threads are done.  Returns
+    the results and the error left in the pipeline."""
+    R = []
+    try:
+        while(pipe.alive()):
+            R += pipe.results()
+        R += pipe.results()
+    except Exception as e:
+        assert e is pipe.error
+    pipe.acq.join()
+    pipe.work.join()
+    return R, pipe.error
+
+def test_results_in_order():
+    def produce(pipe):
+        for n in range(0, 50):
+            pipe.put(n)
+            if(n % 10 == 9):
+                pipe.wait()
+    pipe = Pipeline(produce, lambda n: [2*n], depth=4).start()
+    R, error = run(pipe)
+    assert error is None and R == [2*n for n in range(0, 50)]
+
+def test_worker_error_stops_producer():
+    # The worker fails on the third block, after which the producer must not take more
+    puts = []
+    def produce(pipe):
+        for n in range(0, 1000):
+            pipe.put(n)
+            puts.append(n)
+            pipe.wait()
+    def consume(n):
+        if(n == 2):
+            raise ValueError('bad block')
+        return [n]
+    pipe = Pipeline(produce, consume).start()
+    R, error = run(pipe)
+    assert isinstance(error, ValueError) and str(error) == 'bad block'
+    assert R == [0, 1][0:len(R)]
+    assert puts == [0, 1, 2]       # The wait() after block 2 raised the worker's error
+
+def test_first_error_kept():
+    # A producer that fails in its own clean up after the worker's error does not hide it
+    def produce(pipe):
+        try:
+            for n in range(0, 1000):
+                pipe.put(n)
+                pipe.wait()
+        finally:
+            raise RuntimeError('scope clean up')
+    def consume(n):
+        raise ValueError('bad block')
+    pipe = Pipeline(produce, consume).start()
+    R, error = run(pipe)
+    assert isinstance(error, ValueError)
+
+def test_producer_error():
+    def produce(pipe):
+        pipe.put(0)
+        raise TimeoutError('lost trigger')
+    pipe = Pipeline(produce, lambda n: [n]).start()
+    R, error = run(pipe)
+    assert isinstance(error, TimeoutError)
@@ -0,0 +1,112 @@
+import asyncio
+import pytest
+
+from Prologix import Prologix, AsyncPrologix, PrologixError
+from Simulator import Lab, PulserServer
+
+@pytest.fixture
+def server():
+    lab = Lab({'gpib':0.0}, seed=1)
+    server = PulserServer(lab)
+    server.start()
+    yield server
+    server.stop()
+
+def pulser(server, **kw):
+    return Prologix(server.host, server.addr, server.port, **kw)
+
+def test_opc_handshake(server):
+    # write() returns once *OPC? has answered, so the pulser has executed the command
+    server.lab.latency['gpib'] = 0.02
+    p = pulser(server)
+    p.write(':SOUR:VOLT 2.5')
+    assert server.lab.volts == 2.5
+    p.write(':OUTP:POL POS')
+    assert server.lab.polarity == 1.0
+    assert sorted(p.aio.latency) == [':OUTP:POL', ':SOUR:VOLT']
+    assert min(p.aio.latency[':SOUR:VOLT']) >= 0.02
+    assert p.summary().startswith('GPIB 14 at 127.0.0.1:')
+    p.close()
+
+def test_opc_no_reply(server):
+    # Nobody at the address: the controller's read times out on the bus with an empty line
+    p = Prologix(server.host, server.addr+1, server.port)
+    with pytest.raises(PrologixError):
+        p.write(':SOUR:VOLT 2.5')
+    p.close()
+
+def test_without_opc(server):
+    p = pulser(server, opc=False)
+    p.write(':SOUR:VOLT 1.5')
+    assert p.query('*IDN?').startswith('HEWLETT-PACKARD,HP8114A')
+    assert server.lab.volts == 1.5
+    p.close()
+
+def test_batch(server):
+    # One program message, with relative headers made absolute, checked by SYST:ERR?;*OPC?
+    p = pulser(server)
+    p.batch([':SOUR:VOLT 3.0', 'OUTP:POL POS', 'SOUR:PULS:WIDT 40NS'])
+    assert server.lab.volts == 3.0 and server.lab.polarity == 1.0
+    assert server.lab.width == pytest.approx(40e-9)
+    assert server.pulser.messages == 1
+    assert list(p.aio.latency) == ['batch']
+    p.close()
+
+@pytest.mark.parametrize('cmd,code', [(':SOUR:VOLT 200', '-224'), (':SOUR:NOPE 1', '-113')])
+def test_batch_error(server, cmd, code):
+    p = pulser(server)
+    with pytest.raises(PrologixError) as e:
+        p.batch([':SOUR:VOLT 1.0', cmd])
+    assert str(e.value).startswith(':SOUR:VOLT 1.0;'+cmd+': '+code+',')
+    p.batch([':SOUR:VOLT 2.0'])     # The error was read out of the queue
+    assert server.lab.volts == 2.0
+    p.close()
+
+def test_batch_query(server):
+    p = pulser(server)
+    with pytest.raises(ValueError):
+        p.batch([':SOUR:VOLT 1.0', '*IDN?'])
+    assert server.pulser.messages == 0
+    p.close()
+
+def test_pipelined_order(server):
+    # Requests of several coroutines on one connection each get their own reply
+    async def main():
+        p = await AsyncPrologix(server.host, server.addr, server.port).connect()
+        Q = ['*IDN?', ':SOUR:VOLT?', ':SYST:ERR?']*10
+        R = await asyncio.gather(*[p.query(q) for q in Q])
+        await p.close()
+        return Q, R
+    server.lab.set_volts(4.0)
+    Q, R = asyncio.run(main())
+    for q, r in zip(Q, R):
+        assert r == {'*IDN?':'HEWLETT-PACKARD,HP8114A,0,REV 1.0', ':SOUR:VOLT?':'4.0', ':SYST:ERR?':'+0,"No error"'}[q]
+
+def test_late_reply(server):
+    # The *OPC? reply of a slow command arrives after its request timed out.  It must not be
+    # taken as the reply of the next request.
+    p = pulser(server, timeout=0.5)
+    server.lab.latency['gpib'] = 0.8
+    with pytest.raises(PrologixError):
+        p.write(':SOUR:VOLT 1.0')
+    server.lab.latency['gpib'] = 0.0     # The next request is sent before the late reply comes
+    assert p.query(':SYST:ERR?') == '+0,"No error"'
+    assert p.query(':SOUR:VOLT?') == '1.0'
+    assert p.aio.dropped == 1
+    assert p.summary().endswith('1 late replies dropped')
+    p.close()
+
+def test_timeout_fails_waiting(server):
+    # Requests queued behind one that timed out fail as well instead of taking a wrong reply
+    async def main():
+        p = await AsyncPrologix(server.host, server.addr, server.port, timeout=0.3).connect()
+        server.lab.latency['gpib'] = 0.2
+        R = await asyncio.gather(*[p.query(q) for q in ['*IDN?', ':SOUR:VOLT?', ':SYST:ERR?']], return_exceptions=True)
+        server.lab.latency['gpib'] = 0.0
+        after = await p.query(':SYST:ERR?')
+        await p.close()
+        return R, after
+    R, after = asyncio.run(main())
+    assert R[0] == 'HEWLETT-PACKARD,HP8114A,0,REV 1.0'
+    assert all([isinstance(r, PrologixError) for r in R[1:]])
+    assert after == '+0,"No error"'
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from Retry import RetryPolicy
+from ScopeDriver import MSO64B, BlockError
+from Simulator import Lab, FakeResourceManager
+
+class Flaky:
+    """fn() for RetryPolicy.run() that raises the errors E in turn, then returns 'done'."""
+
+    def __init__(self, E):
+        self.E = list(E)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if(len(self.E) > 0):
+            raise self.E.pop(0)
+        return 'done'
+
+def classify(e):
+    if(isinstance(e, TimeoutError)):
+        return 'timeout'
+    if(isinstance(e, OSError)):
+        return 'io'
+    return None
+
+def policy(**kw):
+    recovered = []
+    retry = RetryPolicy(classify, lambda kind, attempt: recovered.append((kind, attempt)), base=0.0, cap=0.0, **kw)
+    return retry, recovered
+
+def test_retries_then_succeeds():
+    retry, recovered = policy()
+    fn = Flaky([TimeoutError('t'), OSError('o'), TimeoutError('t')])
+    assert retry.run(fn) == 'done'
+    assert fn.calls == 4
+    assert recovered == [('timeout', 0), ('io', 1), ('timeout', 2)]
+    assert retry.summary() == '1 calls, 3 retries, io: 1, timeout: 2, 0 failed'
+
+def test_bounded():
+    retry, recovered = policy(attempts=3)
+    fn = Flaky([TimeoutError('t')]*10)
+    with pytest.raises(TimeoutError):
+        retry.run(fn)
+    assert fn.calls == 3
+    assert len(recovered) == 2      # No recovery after the last attempt
+    assert retry.failed == 1 and retry.counts == {'timeout':3}
+
+def test_unclassified_not_retried():
+    retry, recovered = policy()
+    fn = Flaky([ValueError('v')])
+    with pytest.raises(ValueError):
+        retry.run(fn)
+    assert fn.calls == 1 and recovered == [] and retry.counts == {}
+
+def test_backoff(monkeypatch):
+    delays = []
+    monkeypatch.setattr('Retry.sleep', delays.append)
+    retry = RetryPolicy(classify, attempts=6, base=0.1, cap=0.5)
+    with pytest.raises(TimeoutError):
+        retry.run(Flaky([TimeoutError('t')]*10))
+    assert delays == pytest.approx([0.1, 0.2, 0.4, 0.5, 0.5])
+
+def test_log():
+    class Log(list):
+        def write(self, mess):
+            self.append(mess)
+        def flush(self):
+            pass
+    log = Log()
+    retry = RetryPolicy(classify, base=0.0, cap=0.0, name='Scope', log=log)
+    retry.run(Flaky([TimeoutError('lost trigger')]))
+    assert len(log) == 1 and 'Scope: timeout on attempt 1' in log[0] and 'lost trigger' in log[0]
+
+def test_areas_retry_clears():
+    # A short block after the third shot has been taken restarts the shots, and the scope's
+    # ALLACQS statistics hold only the shots of the attempt that succeeded
+    lab = Lab({'scope_query':0.0, 'scope_mbps':1e4, 'rate':1e6}, tau=1e-9, seed=1)
+    lab.set_volts(1.0)
+    scope = MSO64B('TCPIP0::sim::inst0::INSTR', rm=FakeResourceManager(lab), completion='opc')
+    scope.retry.base = 0.0
+    scope.retry.cap = 0.0
+    scope.area_setup(0.0, 200e-9)
+    acquire = scope.acquire
+    fail = [3]
+
+    def flaky():
+        acquire()
+        fail[0] -= 1
+        if(fail[0] == 0):
+            raise BlockError('short block')
+    scope.acquire = flaky
+    A, mean, std, V = scope.areas(5)
+    assert scope.retry.counts == {'short_block':1}
+    assert len(scope.inst.areas) == 5
+    assert mean == pytest.approx(np.mean(A))
+    assert std == pytest.approx(np.std(A))
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from ScopeDriver import MSO64B, BlockError, parse_preamble, locate
+from Simulator import Lab, FakeResourceManager
+
+EXPECT = {'ymult':30.5176e-6, 'yzero':1e-3, 'yoff':-6553.6, 'xincr':40e-12}
+
+# The same preamble with HEADER OFF, HEADER ON (VERBOSE ON) and HEADER ON with short names,
+# with a ';' inside the quoted WFID
+PREAMBLES = [
+    '2;16;BIN;RI;MSB;"Ch1, DC coupling; 20.00mV/div";5000;Y;LINEAR;"s";40.0000E-12;-20.0000E-9;0;"V";30.5176E-6;-6553.6;1.0E-3;TIME;ANALOG',
+    ':WFMOUTPRE:BYT_NR 2;BIT_NR 16;ENCDG BINARY;BN_FMT RI;BYT_OR MSB;WFID "Ch1, DC coupling; 20.00mV/div";NR_PT 5000;'
+    'PT_FMT Y;PT_ORDER LINEAR;XUNIT "s";XINCR 40.0000E-12;XZERO -20.0000E-9;PT_OFF 0;YUNIT "V";YMULT 30.5176E-6;'
+    'YOFF -6553.6;YZERO 1.0E-3;DOMAIN TIME;WFMTYPE ANALOG',
+    ':WFMO:BYT_N 2;BIT_N 16;ENC BIN;BN_F RI;BYT_O MSB;WFI "Ch1, DC coupling; 20.00mV/div";NR_P 5000;PT_F Y;PT_OR LINEAR;'
+    'XUN "s";XIN 40.0000E-12;XZE -20.0000E-9;PT_OF 0;YUN "V";YMU 30.5176E-6;YOF -6553.6;YZE 1.0E-3',
+]
+
+@pytest.mark.parametrize('text', PREAMBLES)
+def test_parse_preamble(text):
+    pre = parse_preamble(text+'\n')
+    assert sorted(pre) == sorted(EXPECT)
+    for key in EXPECT:
+        assert pre[key] == pytest.approx(EXPECT[key])
+
+def test_parse_preamble_field_order():
+    # Without headers the fields are taken by position, whatever they contain
+    pre = parse_preamble('1;8;BIN;RI;MSB;"x";100;Y;LINEAR;"s";1e-9;0;0;"V";0.5;2;3')
+    assert pre == {'ymult':0.5, 'yzero':3.0, 'yoff':2.0, 'xincr':1e-9}
+
+def test_locate():
+    V = np.zeros(5000)
+    V[1000:1050] = -0.5
+    assert locate(V) == (1000-250-50, 1050+250)
+    assert locate(V, baseline=10, pad=5) == (1000-5-10, 1050+5)
+
+def test_locate_edges():
+    V = np.zeros(600)
+    V[100:580] = -0.5
+    assert locate(V) == (0, 600)
+
+def test_locate_flat():
+    assert locate(np.zeros(5000)) == (0, 5000)
+    assert locate(np.full(5000, 0.3)) == (0, 5000)
+
+@pytest.fixture(params=['TCPIP0::sim::inst0::INSTR', 'TCPIP0::sim::4000::SOCKET'])
+def scope(request):
+    lab = Lab({'scope_query':0.0, 'scope_mbps':1e4, 'rate':1e6}, tau=1e-9, noise=0.0, seed=1)
+    lab.set_volts(1.0)
+    scope = MSO64B(request.param, rm=FakeResourceManager(lab), completion='opc')
+    scope.set('CH1:POS', '4.5')
+    scope.transfer('CH1', 0, 5000)
+    return scope
+
+def test_header_off(scope):
+    assert scope.inst.state['HEADER'] == 'OFF'
+
+def test_read_block(scope):
+    raw = np.zeros(100, dtype='>i2')
+    data = np.array([10, 2560, -1, 0x0a0a, 3], dtype='>i2')     # Bytes that look like newlines
+    scope.inst.out = b'#210'+data.tobytes()+b'\n'
+    assert scope.read_block(raw) == 5
+    assert np.array_equal(raw[0:5], data)
+
+def test_read_block_errors(scope):
+    raw = np.zeros(4, dtype='>i2')
+    for bad in (b'X210', b'#A10'):
+        scope.inst.out = bad+bytes(10)+b'\n'
+        with pytest.raises(BlockError):
+            scope.read_block(raw)
+    scope.inst.out = b'#210'+bytes(4)+b'\n'
+    with pytest.raises(BlockError):
+        scope.read_block(np.zeros(100, dtype='>i2'))        # Short block
+    scope.inst.out = b'#210'+bytes(10)+b'\n'
+    with pytest.raises(ValueError):
+        scope.read_block(raw)       # Does not fit
+
+def test_waveform_charge(scope):
+    # 1 V for 50 nSec into 50 Ohm: an integral of 50 nVSec in the shot, every frame and the
+    # located window of every frame
+    V, xincr = scope.waveform()
+    assert V.shape == (5000,) and xincr == pytest.approx(40e-12)
+    assert np.sum(V - np.mean(V[0:50]))*xincr == pytest.approx(-50e-9, rel=0.01)
+    lo, hi = locate(V.copy())
+    F, xincr = scope.frames(5)
+    assert F.shape == (5,5000)
+    assert np.allclose((F - F[:,0:50].mean(axis=1,keepdims=True)).sum(axis=1)*xincr, -50e-9, rtol=0.01, atol=0)
+    W, xincr = scope.frames(5, 5000)
+    assert W.shape == (5,hi-lo)
+    assert np.allclose((W - W[:,0:50].mean(axis=1,keepdims=True)).sum(axis=1)*xincr, -50e-9, rtol=0.01, atol=0)
+
+def test_area(scope, monkeypatch):
+    # The settling shot of the AREA mode reads only the measurement, without a CURVE? transfer
+    def curve(raw):
+        raise AssertionError('CURVE? transfer')
+    monkeypatch.setattr(scope, 'curve', curve)
+    scope.area_setup(-10e-9, 70e-9)
+    assert scope.area() == pytest.approx(-50e-9, rel=0.01)
+    assert scope.inst.state['HORIZONTAL:FASTFRAME:STATE'] == 'OFF'
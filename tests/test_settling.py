@@ -0,0 +1,151 @@
+import os
+import numpy as np
+import pytest
+
+from Settling import Settler
+from Sweep import beam_counts, acmi_settler, POSNOISE
+
+class Readings:
+    """read() for Settler.wait(): the values of X in turn, then the last one."""
+
+    def __init__(self, X):
+        self.X = list(X)
+        self.n = 0
+
+    def __call__(self):
+        x = self.X[min(self.n, len(self.X)-1)]
+        self.n += 1
+        return x
+
+class Updates:
+    """A sampler with the start()/next() of ACMIPlc.Sampler over the updates U, which keeps
+    giving the last one."""
+
+    def __init__(self, U):
+        self.U = list(U)
+        self.n = 0
+        self.starts = 0
+
+    def start(self):
+        self.starts += 1
+
+    def next(self):
+        V = self.U[min(self.n, len(self.U)-1)]
+        self.n += 1
+        return float(self.n), V
+
+def test_wait_settles():
+    read = Readings([0.0, 0.5, 0.9, 0.99, 1.0, 1.0, 1.0, 1.0, 1.0])
+    st = Settler(tol=0.005, count=3, dwell=0.0, period=0.0, name='Scope')
+    st.wait(read)
+    assert read.n == 7      # The last three readings are the 1.0s
+    assert st.timeouts == 0 and len(st.times) == 1
+
+def test_wait_change():
+    # A stale value that does not move yet must not be taken as settled
+    read = Readings([550]*5+[1000]*5)
+    st = Settler(tol=0.01, absolute=2, count=2, dwell=0.0, period=0.0, change=True)
+    st.wait(read)
+    assert read.n == 7      # The first two readings after the change
+
+def test_wait_timeout():
+    read = Readings([0.0, 1.0]*1000)
+    st = Settler(tol=0.001, count=3, dwell=0.0, timeout=0.05, period=0.001, name='Scope')
+    st.wait(read)
+    assert st.timeouts == 1
+    assert st.summary().startswith('Scope settling: 1 steps') and st.summary().endswith('1 timed out')
+
+def test_stable_tuple():
+    st = Settler(tol=0.01, absolute=2, count=2)
+    assert st.stable([(100, 50), (101, 51)])
+    assert not st.stable([(100, 50), (101, 60)])
+    assert not st.stable([(100, 50)])
+
+def test_updates_distinct():
+    # The PLC update before the step (550), one taken half way (900), then the new value.
+    # Polling the same update twice would have taken 550 as settled.
+    U = Updates([[550, 20], [900, 20], [1000, 20], [1001, 20], [1000, 20]])
+    st = Settler(tol=0.01, absolute=2, count=2, dwell=0.0, change=True, name='ACMI')
+    st.updates(U, lambda ADC: [ADC[0]])
+    assert U.starts == 1
+    assert U.n == 4         # 550 skipped, 900 and 1000 differ, 1000 and 1001 agree
+    assert U.next()[1] == [1000, 20]    # Sampling carries on after the settled updates
+
+def test_updates_without_change():
+    U = Updates([5.0, 5.0, 5.0])
+    st = Settler(tol=0.01, count=2, dwell=0.0)
+    st.updates(U)
+    assert U.n == 2
+
+def test_updates_timeout():
+    U = Updates([0.0, 1.0]*100000)
+    st = Settler(tol=0.001, count=2, dwell=0.0, timeout=0.02)
+    st.updates(U)
+    assert st.timeouts == 1 and st.times[0] >= 0.02
+
+def test_updates_settled():
+    # The updates that agreed are kept to be counted as samples, none after a timeout
+    U = Updates([[550, 20], [1000, 20], [1001, 20], [999, 20]])
+    st = Settler(tol=0.01, absolute=2, count=2, dwell=0.0, change=True)
+    st.updates(U, lambda ADC: ADC[0])
+    assert st.settled == [[1000, 20], [1001, 20]]
+    st.timeout = 0.0
+    st.updates(Updates([0.0, 1.0]), lambda x: x)
+    assert st.settled == []
+
+# The beam A-B counts of every ACMI update at every unsaturated amplitude of a bench run, and
+# the ACMI settling of PosACMI.py (Sweep.acmi_settler): two updates that agree within 4 sigma
+# of the noise of their difference, from the 5.5 counts rms measured in that run
+RAW = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ACMI2026_Mar', 'Results', 'posacmi.raw')
+NOISE = POSNOISE
+
+def bench_updates():
+    """The six ADC values of every ACMI update in RAW, per unsaturated amplitude."""
+    S = {}
+    with open(RAW) as f:
+        for line in f:
+            Z = line.strip().split(',')
+            if(len(Z) == 9):
+                S.setdefault(int(Z[0]), []).append([int(x) for x in Z[3:9]])
+    return [S[j] for j in sorted(S) if max([ADC[0] for ADC in S[j]]) < 2047]
+
+def bench_settler():
+    st = acmi_settler(NOISE)
+    st.dwell = 0.0
+    return st
+
+def test_bench_noise():
+    B = [np.array([beam_counts(ADC) for ADC in S], dtype=float) for S in bench_updates()]
+    assert len(B) == 21
+    noise = np.sqrt(np.mean([np.var(b, ddof=1) for b in B]))
+    assert noise == pytest.approx(NOISE, rel=0.05)
+    # The former 1% + 2 counts rule passed only part of the pairs of updates at the low amplitudes
+    old = [np.mean(np.abs(np.diff(b)) <= 0.01*abs(b.mean())+2) for b in B]
+    assert min(old) < 0.5
+
+def test_updates_bench_noise():
+    # With the update before the step first, every amplitude settles on its first two updates,
+    # and they are the first samples
+    S = bench_updates()
+    for j in range(1, len(S)):
+        U = Updates([S[j-1][-1]]+S[j])
+        st = bench_settler()
+        st.updates(U, beam_counts)
+        assert U.n == 3 and st.settled == S[j][0:2]
+
+def test_updates_bench_step():
+    # Two updates from before the step: the second is not skipped, and differs from the new
+    # amplitude by far more than the noise
+    S = bench_updates()
+    for j in range(1, len(S)):
+        U = Updates(S[j-1][-2:]+S[j])
+        st = bench_settler()
+        st.updates(U, beam_counts)
+        assert U.n == 4 and st.settled == S[j][0:2]
+
+def test_pairs_within_tolerance():
+    # Consecutive updates of one amplitude agree within the tolerance
+    st = bench_settler()
+    for S in bench_updates():
+        for n in range(1, len(S)):
+            assert st.stable([beam_counts(S[n-1]), beam_counts(S[n])])
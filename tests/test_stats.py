@@ -0,0 +1,117 @@
+from math import inf, sqrt
+import numpy as np
+import pytest
+
+from Stats import RunningStats, Sequential, read_record, report
+
+def running(X):
+    s = RunningStats()
+    for x in X:
+        s.add(x)
+    return s
+
+@pytest.mark.parametrize('n', [2, 3, 25, 1000])
+def test_running_stats_numpy(n):
+    X = np.random.default_rng(n).normal(1e3, 0.5, n)     # Large mean, small spread
+    s = running(X)
+    assert s.count == n
+    assert s.mean == pytest.approx(np.mean(X), rel=1e-12)
+    assert s.std() == pytest.approx(np.std(X), rel=1e-9)
+    assert s.std(1) == pytest.approx(np.std(X, ddof=1), rel=1e-9)
+    assert s.var(1) == pytest.approx(np.var(X, ddof=1), rel=1e-9)
+    assert s.sem() == pytest.approx(np.std(X, ddof=1)/sqrt(n), rel=1e-9)
+    assert (s.min, s.max) == (X.min(), X.max())
+
+def test_running_stats_few():
+    s = RunningStats()
+    assert s.var() == 0.0 and s.sem() == inf
+    s.add(3)
+    assert (s.mean, s.std(), s.std(1), s.sem()) == (3.0, 0.0, 0.0, inf)
+
+def test_record_round_trip():
+    s = running([0.5, 0.52, 0.49, 0.51])
+    q, j, V, r = read_record(s.record('Q', 7, 8.0))
+    assert (q, j, V, r.count) == ('Q', 7, 8.0, 4)
+    assert r.mean == pytest.approx(s.mean, abs=1e-6)
+    assert r.std() == pytest.approx(s.std(), abs=1e-6)
+    assert (r.min, r.max) == (0.49, 0.52)
+
+def sample(rule, X):
+    """Take values of X as rule asks for them.  Returns the RunningStats and the batches."""
+    s = RunningStats()
+    batches = []
+    n = rule.more()
+    while(n > 0):
+        batches.append(n)
+        for k in range(0, n):
+            s.add(X[s.count])
+        n = rule.more(s)
+    rule.done(s)
+    return s, batches
+
+def test_fixed():
+    rule = Sequential(25, 25)
+    s, batches = sample(rule, np.arange(100.0))
+    assert batches == [25]
+    assert s.count == 25
+    assert rule.summary('Scope') == 'Scope sampling: 25 values at 1 amplitudes, 25 to 25 per amplitude'
+
+@pytest.mark.parametrize('seed', range(0, 5))
+def test_stops_at_target(seed):
+    X = np.random.default_rng(seed).normal(10.0, 1.0, 1000)
+    rule = Sequential(8, 1000, absolute=0.1)
+    s, batches = sample(rule, X)
+    assert s.sem() <= 0.1
+    assert 8 <= s.count < 1000
+    prev = running(X[0:s.count-batches[-1]])
+    assert prev.count < 8 or prev.sem() > 0.1     # Not done before the last batch
+
+def test_relative_target():
+    X = np.random.default_rng(1).normal(50.0, 1.0, 1000)
+    rule = Sequential(4, 1000, absolute=0.001, relative=0.004)      # 0.2 at the mean of 50
+    s, batches = sample(rule, X)
+    assert s.sem() <= 0.004*abs(s.mean)
+    assert s.count < 100
+
+def test_minimum():
+    rule = Sequential(6, 48, absolute=100.0)      # Met by any spread
+    s, batches = sample(rule, np.random.default_rng(2).normal(0.0, 1.0, 100))
+    assert s.count == 6 and batches == [6]
+
+def test_maximum():
+    rule = Sequential(6, 48, absolute=1e-6)       # Never met
+    s, batches = sample(rule, np.random.default_rng(3).normal(0.0, 1.0, 100))
+    assert s.count == 48
+    assert rule.more(s) == 0
+
+def test_minimum_of_two():
+    # The spread needs two values, so a sequential rule takes at least two
+    assert Sequential(1, 10).minimum == 2
+    assert Sequential(1, 1).minimum == 1
+
+def test_batch():
+    rule = Sequential(8, 100, absolute=1e-6, batch=25)
+    s, batches = sample(rule, np.random.default_rng(4).normal(0.0, 1.0, 100))
+    assert max(batches) <= 25 and s.count == 100
+
+def test_summary():
+    rule = Sequential(4, 40, absolute=0.2)
+    assert rule.summary('ACMI') == 'ACMI sampling: no amplitudes'
+    rng = np.random.default_rng(5)
+    for sigma in (0.1, 2.0):
+        sample(rule, rng.normal(0.0, sigma, 100))
+    assert rule.counts[0] == 4 and rule.counts[1] > 4
+    assert rule.summary('ACMI').startswith('ACMI sampling: '+str(sum(rule.counts))+' values at 2 amplitudes')
+
+def test_report(capsys):
+    class Log(list):
+        def write(self, mess):
+            self.append(mess)
+        def flush(self):
+            self.append(None)
+    log = Log()
+    report(['Scope trigger wait: 0.01 Sec avg', 'ACMI sampling: no amplitudes'], log)
+    assert capsys.readouterr().out == 'Scope trigger wait: 0.01 Sec avg\nACMI sampling: no amplitudes\n'
+    assert log == ['Scope trigger wait: 0.01 Sec avg\n', 'ACMI sampling: no amplitudes\n', None]
+    report(['no log'])
+    assert capsys.readouterr().out == 'no log\n'
@@ -0,0 +1,60 @@
+import io
+import pytest
+
+from Sweep import Sweep, Vp
+from Pipeline import Pipeline
+from ScopeDriver import MSO64B
+from ACMIPlc import Sampler, PLCSession
+from Stats import Sequential
+from Simulator import Lab, FakeResourceManager, FakeACMI
+
+ADCtags = ['Program:Main_Loop.'+t for t in ['Beam_ADCA','Beam_ADCB','ST1AB_ADCA','ST1AB_ADCB','ST1BA_ADCA','ST1BA_ADCB']]
+
+def sweep(polarity, trigger, mode='frames'):
+    """A Sweep of the first two amplitudes against the simulator, with the pulser set straight
+    in the Lab, and its raw data file."""
+    lab = Lab({'scope_query':0.0, 'scope_mbps':1e4, 'rate':1e4, 'plc':0.0, 'acmi_period':0.01}, tau=1e-3, seed=1)
+    lab.set_polarity('NEG' if polarity < 0 else 'POS')
+    scope = MSO64B('TCPIP0::sim::inst0::INSTR', rm=FakeResourceManager(lab), completion='opc')
+    scope.transfer('CH1',0,5000)
+    if(mode == 'area'):
+        scope.area_setup(-10e-9, 70e-9)
+    comm = PLCSession('10.0.128.47', driver=FakeACMI(lab).PLC)
+    comm.connect()
+    f = io.StringIO()
+    S = Sweep(scope, lambda cmd: lab.set_volts(float(cmd.split()[1])), Sampler(comm, ADCtags, poll=0.002, period=0.01), f,
+              polarity=polarity, trigger=trigger, amps=range(0,2), fastframe=mode == 'frames', area=mode == 'area',
+              shotrule=Sequential(5,5), acmirule=Sequential(4,4))
+    S.acmisettle.dwell = 0.0
+    return S, f
+
+def run(S):
+    pipe = Pipeline(S.acquire_pulses, S.integrate_pulses).start()
+    R = []
+    while(pipe.alive()):
+        R += pipe.results()
+    return R+pipe.results()
+
+@pytest.mark.parametrize('polarity,trigger,sign', [(-1,-0.5,1.0), (1,1.0,-1.0)])
+def test_scope_charge(polarity, trigger, sign):
+    # PosACMI (negative pulses) logs positive charges, NegACMI (positive pulses) negative ones
+    S, f = sweep(polarity, trigger)
+    R = run(S)
+    assert [r[0] for r in R if r[-1]] == [0, 1]
+    for j in range(0, 2):
+        assert S.Nshot[j] == 5
+        assert S.Qstats[j].mean == pytest.approx(sign*Vp[j]*50e-9/50.0*1e9, rel=0.02)
+    assert f.getvalue().count('\n') == 2*5+2*2
+
+def test_scope_area():
+    S, f = sweep(-1, -0.5, mode='area')
+    run(S)
+    assert S.Qstats[1].mean == pytest.approx(2.0, rel=0.02)
+
+def test_sample_acmi():
+    # The two settled updates count as samples, so the ACMI rule takes two more
+    S, f = sweep(-1, -0.5)
+    S.HPwrite(':SOUR:VOLT 5')
+    A, Bstats = S.sample_acmi(4)
+    assert len(A) == 4 and Bstats.count == 4
+    assert len(S.acmisettle.settled) == 2 and A[0:2] == S.acmisettle.settled